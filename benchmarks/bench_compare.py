@@ -0,0 +1,50 @@
+"""
+Benchmark of the trace comparison of compare_traces.py: compare_traces, one dictionary
+per entry, against compare_trace_files, vectorized over the memory-mapped columns of the
+binary traces. Uses the synthetic loop of bench_final_trace.py and checks that both find
+the same mismatches (a few are injected).
+
+Usage: python3 benchmarks/bench_compare.py [-n INSTRUCTIONS]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compare_traces
+import trace_format
+from bench_final_trace import synthetic_traces
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the trace comparison.")
+    parser.add_argument("-n", type=int, default=2000000, help="Instructions in the traces (default: 2M).")
+    args = parser.parse_args()
+
+    spike_trace, dut_trace = synthetic_traces(args.n)
+    final_trace = compare_traces.generate_final_trace(spike_trace, dut_trace, "bench")
+    for i in range(0, len(final_trace), max(1, len(final_trace) // 10)): # a few wrong values
+        if final_trace[i]["reg_val"] is not None:
+            final_trace[i] = dict(final_trace[i], reg_val=final_trace[i]["reg_val"] ^ 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        spike_path = trace_format.trace_path(directory, "bench", "spike")
+        final_path = trace_format.trace_path(directory, "bench", "final")
+        trace_format.save_trace(spike_path, trace_format.KIND_SPIKE, spike_trace)
+        trace_format.save_trace(final_path, trace_format.KIND_FINAL, final_trace)
+
+        start = time.perf_counter()
+        expected = compare_traces.compare_traces(spike_trace, final_trace, "bench")
+        dictionaries = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mismatches = compare_traces.compare_trace_files(spike_path, final_path, "bench")
+        columns = time.perf_counter() - start
+
+    assert mismatches == expected, "the comparisons disagree"
+    print(f"{args.n} instructions, {len(mismatches)} mismatches")
+    print(f"compare_traces (dictionaries): {dictionaries:.3f} s")
+    print(f"compare_trace_files (columns): {columns:.3f} s ({dictionaries / columns:.1f}x)")
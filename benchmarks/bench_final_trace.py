@@ -0,0 +1,77 @@
+"""
+Scaling benchmark of compare_traces.generate_final_trace.
+
+Builds synthetic spike and fragmented traces of a loop that rewrites the same register
+values (every iteration has repeated writes, which the fragmented trace does not show and
+generate_final_trace has to add as speculative commits, in front of the commits of all the
+following iterations) plus speculative fetches, for
+traces of 10K to 10M instructions, and prints the time per instruction of each size. A
+linear pass keeps it constant.
+
+The final trace holds one dictionary per instruction, so 10M instructions need several GB
+of memory; use --sizes to stop earlier.
+
+Usage: python3 benchmarks/bench_final_trace.py [--sizes 10000,100000,1000000,10000000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import compare_traces
+
+# Loop body: (pc, instr, target_reg, reg_val, mem_addr, mem_val). reg_val None is the
+# iteration count.
+LOOP = (
+    (0x1000, 0x00500093, 1, 5, None, None),          # addi x1, x0, 5 (same value every iteration)
+    (0x1004, 0x00a00113, 2, 10, None, None),         # addi x2, x0, 10 (same value every iteration)
+    (0x1008, 0x00112023, None, None, 0x2000, 5),     # sw x1, 0(x2)
+    (0x100c, 0x00012183, 3, 5, 0x2000, None),        # lw x3, 0(x2)
+    (0x1010, 0x00120213, 4, None, None, None),       # addi x4, x4, 1 (loop counter)
+    (0x1014, 0xfe0006e3, None, None, None, None),    # beq x0, x0, -20
+)
+NAMES = ("pc", "instr", "target_reg", "reg_val", "mem_addr", "mem_val")
+
+def synthetic_traces(instructions):
+    """
+    Spike and fragmented traces of `instructions` instructions of LOOP. The loop entries
+    are shared between iterations to keep the inputs small.
+    """
+    spike_body = [dict(zip(NAMES, entry)) for entry in LOOP]
+    spike_trace, fetches, regfile_commits, memory_accesses = [], [], [], []
+    speculative_fetch = [0x1018, 0x00000013] # fetched after the branch, then flushed
+    for i in range(instructions):
+        iteration, position = divmod(i, len(LOOP))
+        pc, instr, target_reg, reg_val, mem_addr, mem_val = LOOP[position]
+        if target_reg is not None and reg_val is None:
+            reg_val = iteration + 1
+            spike_trace.append(dict(zip(NAMES, (pc, instr, target_reg, reg_val, mem_addr, mem_val))))
+        else:
+            spike_trace.append(spike_body[position])
+        fetches.append([pc, instr])
+        if pc == 0x1014:
+            fetches.append(speculative_fetch)
+        if target_reg is not None and (iteration == 0 or target_reg == 4): # only x4 changes after the first iteration
+            regfile_commits.append([target_reg, reg_val])
+        if mem_val is not None:
+            memory_accesses.append([mem_addr, mem_val])
+    dut_trace = {"fetches": fetches, "regfile_commits": regfile_commits, "memory_accesses": memory_accesses}
+    return spike_trace, dut_trace
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling benchmark of generate_final_trace.")
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000,10000000",
+                        help="Comma separated trace lengths, in instructions.")
+    args = parser.parse_args()
+
+    print(f"{'instructions':>12} {'seconds':>9} {'ns/instr':>9}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        spike_trace, dut_trace = synthetic_traces(size)
+        start = time.perf_counter()
+        final_trace = compare_traces.generate_final_trace(spike_trace, dut_trace, "bench")
+        seconds = time.perf_counter() - start
+        assert sum(not entry["speculative_fetch"] for entry in final_trace) == size
+        print(f"{size:>12} {seconds:>9.3f} {seconds / size * 1e9:>9.0f}", flush=True)
+        del spike_trace, dut_trace, final_trace
@@ -0,0 +1,59 @@
+"""
+Cycles per second of the register file monitors of exec_trace.py, on a real simulation.
+
+This is a cocotb test module: it runs the program of ELF_PATH once per monitor ("poll",
+"edge" and, when the regfile JSON has a regfile_interface, "write_port") in the same
+simulation, logs the simulated cycles per second of each one and checks that they give
+the same regfile commits as polling. The processor must have REGFILE_ARRAY_AVAILABLE.
+
+Usage, with the makefile, regfile JSON and manual flags of exec_trace.py:
+
+    REGFILE_JSON=$PWD/example/tinyriscv_reg_file.json \
+    MANUAL_FLAGS_JSON=$PWD/example/tinyriscv_manual_ntv_flags.json \
+    ELF_PATH=$PWD/example/sanity_check.elf OUTPUT_DIR=/tmp/bench_regfile \
+    PYTHONPATH=$PWD:$PWD/benchmarks make -f example/tinyriscv.mk MODULE=bench_regfile_monitor
+"""
+import os
+import time
+
+import cocotb
+
+import config_loader
+import debug_trace
+import exec_trace
+import trace_format
+
+@cocotb.test()
+async def regfile_monitor_benchmark(dut):
+    config_data = config_loader.ConfigLoader([os.environ.get('REGFILE_JSON'), os.environ.get('MANUAL_FLAGS_JSON')],
+                                             ['OUTPUT_DIR', 'ELF_PATH', 'TRACE_FORMAT'])
+    assert config_data.get('REGFILE_ARRAY_AVAILABLE'), "The benchmark needs REGFILE_ARRAY_AVAILABLE"
+
+    monitors = ["poll", "edge"]
+    if config_data.get('regfile_interface'):
+        monitors.append("write_port")
+
+    cocotb.start_soon(exec_trace.custom_clock(dut.sys_clk))
+    debug = debug_trace.DebugTrace(dut, config_data.get('TWO_PORTED_MEMORY_MODEL'), debug_trace.DEBUG_OFF)
+    output_dir = config_data.get('OUTPUT_DIR')
+
+    commits = {}
+    for monitor in monitors:
+        config_data.config_data['REGFILE_MONITOR'] = monitor
+        config_data.config_data['OUTPUT_DIR'] = os.path.join(output_dir, monitor)
+        tasks = []
+        start = time.perf_counter()
+        try:
+            status = await exec_trace.run_program(dut, config_data, config_data.get('ELF_PATH'), tasks, debug)
+        finally:
+            for task in tasks:
+                task.kill()
+        elapsed = time.perf_counter() - start
+        commits[monitor] = trace_format.load_trace(status["trace"])["regfile_commits"]
+        dut._log.info("%-10s %s, %d cycles in %.2f s: %.0f cycles/s, %d regfile commits", monitor, status["status"],
+                      status["cycles"], elapsed, status["cycles"] / elapsed, len(commits[monitor]))
+
+    for monitor in monitors[1:]:
+        if commits[monitor] != commits["poll"]:
+            dut._log.warning("%s does not give the same regfile commits as poll", monitor)
+    assert commits["edge"] == commits["poll"], "edge and poll monitors disagree"
@@ -0,0 +1,89 @@
+"""
+Benchmark of the spike commit-log parsers on a synthetic log.
+
+Compares the regex parser (parse_spike_trace) with the batch parser, both when it
+builds the same list of dictionaries (fast_parse_spike_trace) and when its columns go
+straight to the binary writer (parse_spike_batches), and checks that the results match.
+
+Usage: python3 benchmarks/bench_spike_parser.py [-n LINES] [--seed SEED] [--keep FILE]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import spike_trace
+
+def write_synthetic_log(path, lines, seed=0):
+    """
+    Writes a spike commit log with the shapes spike prints: a warning line, a few debug
+    ROM instructions, register writes, loads, byte/half/word stores and instructions
+    without side effect.
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write("warning: tohost and fromhost symbols not in ELF; can't communicate with target\n")
+        for i in range(5):
+            f.write(f"core   0: 3 0x{spike_trace.DEBUG_START + 4 * i:08x} (0x00000013)\n")
+        out = []
+        for i in range(lines):
+            pc = 0x80000000 + 4 * i
+            instr = rng.getrandbits(32)
+            kind = rng.random()
+            line = f"core   0: 3 0x{pc:08x} (0x{instr:08x})"
+            if kind < 0.55:
+                line += f" x{rng.randrange(1, 32):<2d} 0x{rng.getrandbits(32):08x}"
+            elif kind < 0.70:
+                line += f" x{rng.randrange(1, 32):<2d} 0x{rng.getrandbits(32):08x} mem 0x{rng.getrandbits(32):08x}"
+            elif kind < 0.85:
+                digits = rng.choice((2, 4, 8))
+                line += f" mem 0x{rng.getrandbits(32):08x} 0x{rng.getrandbits(4 * digits):0{digits}x}"
+            out.append(line + "\n")
+            if len(out) == 100000:
+                f.writelines(out)
+                out = []
+        f.writelines(out)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def count_columns(trace_file):
+    with open(trace_file, "rb") as f:
+        return sum(len(columns["pc"]) for columns, _ in spike_trace.parse_spike_batches(spike_trace.iter_line_chunks(f)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the spike commit-log parsers.")
+    parser.add_argument("-n", "--lines", type=int, default=2000000, help="Number of commit lines (default: 2M)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic log")
+    parser.add_argument("--keep", help="Write the synthetic log to this file and keep it")
+    args = parser.parse_args()
+
+    path = args.keep or os.path.join(tempfile.mkdtemp(), "bench.trace")
+    write_synthetic_log(path, args.lines, args.seed)
+    print(f"{args.lines} lines, {os.path.getsize(path) / 1e6:.1f} MB")
+
+    try:
+        reference, regex_time = timed(spike_trace.parse_spike_trace, path)
+        entries, dict_time = timed(spike_trace.fast_parse_spike_trace, path)
+        rows, column_time = timed(count_columns, path)
+        if entries != reference or rows != len(reference):
+            print("ERROR: the batch parser does not match parse_spike_trace")
+            sys.exit(1)
+
+        for name, elapsed in (("regex (parse_spike_trace)", regex_time),
+                              ("batch, dictionaries", dict_time),
+                              ("batch, columns", column_time)):
+            print(f"{name:28s} {elapsed:7.2f} s {args.lines / elapsed / 1e6:7.2f} M lines/s {regex_time / elapsed:6.1f}x")
+    finally:
+        if not args.keep:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+if __name__ == "__main__":
+    main()
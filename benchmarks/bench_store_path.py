@@ -0,0 +1,87 @@
+"""
+Benchmark of the store path of the exec_trace.py memory models, without a simulator.
+
+Compares the previous if/elif chain on the write strobe string with the STROBE_MASKS
+table of exec_trace.store, on stores with random strobes read from cocotb BinaryValue
+objects as the memory models do, and checks that both write the same words.
+
+Usage: python3 benchmarks/bench_store_path.py [-n STORES]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cocotb.binary import BinaryValue
+
+import exec_trace
+import sparse_memory
+
+class Handle:
+    """Stands for a cocotb signal handle: only its value is used."""
+    def __init__(self, value=None):
+        self.value = value
+
+def chain_store(memory, simulated_addr, data_out, sel):
+    """The store path of the memory models before the strobe table (contiguous strobes only)."""
+    if sel.value == "1111":
+        write_value = data_out.value.integer
+        memory[simulated_addr] = write_value
+    elif sel.value == "0011":
+        write_value = (memory[simulated_addr] & 0xFFFF0000) | (data_out.value.integer & 0x0000FFFF)
+        memory[simulated_addr] = write_value
+    elif sel.value == "1100":
+        write_value = (memory[simulated_addr] & 0x0000FFFF) | (data_out.value.integer & 0xFFFF0000)
+        memory[simulated_addr] = write_value
+    elif sel.value == "0001":
+        write_value = (memory[simulated_addr] & 0xFFFFFF00) | (data_out.value.integer & 0x000000FF)
+        memory[simulated_addr] = write_value
+    elif sel.value == "0010":
+        write_value = (memory[simulated_addr] & 0xFFFF00FF) | (data_out.value.integer & 0x0000FF00)
+        memory[simulated_addr] = write_value
+    elif sel.value == "0100":
+        write_value = (memory[simulated_addr] & 0xFF00FFFF) | (data_out.value.integer & 0x00FF0000)
+        memory[simulated_addr] = write_value
+    elif sel.value == "1000":
+        write_value = (memory[simulated_addr] & 0x00FFFFFF) | (data_out.value.integer & 0xFF000000)
+        memory[simulated_addr] = write_value
+    return write_value
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the store path of the memory models.")
+    parser.add_argument("-n", "--stores", type=int, default=200000, help="Number of stores (default: 200K)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    stores = [(rng.randrange(0, 1 << 16) & ~3, BinaryValue(rng.getrandbits(32), n_bits=32),
+               BinaryValue(rng.choice((0b1111, 0b0011, 0b1100, 0b0001, 0b0010, 0b0100, 0b1000)), n_bits=4))
+              for _ in range(args.stores)]
+    data_out, sel = Handle(), Handle()
+
+    words = [0x13] * (1 << 14)
+    start = time.perf_counter()
+    for address, data, strobe in stores:
+        data_out.value, sel.value = data, strobe
+        chain_store(words, address // 4, data_out, sel)
+    chain_time = time.perf_counter() - start
+
+    class Dut: # only the logger is used, for unresolved strobes
+        _log = None
+    memory = sparse_memory.SparseMemory()
+    start = time.perf_counter()
+    for address, data, strobe in stores:
+        data_out.value, sel.value = data, strobe
+        exec_trace.store(Dut, memory, address, data_out.value.integer, sel)
+    table_time = time.perf_counter() - start
+
+    if any(memory.read_word(4 * i) != word for i, word in enumerate(words)):
+        print("ERROR: the two store paths wrote different words")
+        sys.exit(1)
+    for name, elapsed in (("if/elif chain", chain_time), ("strobe table", table_time)):
+        print(f"{name:14s} {elapsed:6.2f} s {args.stores / elapsed / 1e6:6.2f} M stores/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# This module contains the helpers shared by the on-disk caches (ELF program images,
+# spike traces): content hashes, the cache location and atomic writes.
+#
+# The caches live in $NTV_CACHE_DIR, or ~/.cache/ntv by default. Setting NTV_NO_CACHE
+# to a non-empty value disables them. Caches that evict entries keep at most
+# $NTV_CACHE_MAX_MB megabytes (4096 by default), least recently used entries going first.
+
+import hashlib
+import os
+
+DEFAULT_CACHE_MAX_MB = 4096
+
+def file_digest(path, block_size=1 << 20):
+    """
+    SHA-256 of the contents of a file.
+
+    Returns:
+        str: The digest, in hex.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+_unusable = set() # cache directories already reported as unusable by this process
+
+def cache_dir(name):
+    """
+    Directory of the `name` cache, created if needed.
+
+    Returns:
+        str: The path, or None if the caches are disabled or the directory cannot be
+        written (e.g. a read-only home directory): the tools then run without cache.
+    """
+    if os.environ.get("NTV_NO_CACHE"):
+        return None
+    root = os.environ.get("NTV_CACHE_DIR") or \
+        os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ntv")
+    path = os.path.join(root, name)
+    try:
+        os.makedirs(path, exist_ok=True)
+        if not os.access(path, os.W_OK | os.X_OK):
+            raise PermissionError(f"{path} is not writable")
+    except OSError as e:
+        if path not in _unusable:
+            _unusable.add(path)
+            print(f"Warning: {name} cache disabled, cannot use {path}: {e}")
+        return None
+    return path
+
+def atomic_write(path, data):
+    """Write `data` (bytes) to `path` so that readers never see a partial file."""
+    temporary_file = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_file, "wb") as f:
+        f.write(data)
+    os.replace(temporary_file, path)
+
+def text_digest(*parts):
+    """SHA-256, in hex, of several strings (e.g. other digests and command line arguments)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+def max_cache_bytes():
+    """Size limit of the evicting caches, from NTV_CACHE_MAX_MB."""
+    return int(os.environ.get("NTV_CACHE_MAX_MB") or DEFAULT_CACHE_MAX_MB) << 20
+
+def touch(path):
+    """Mark a cache entry as used now, for the LRU eviction."""
+    os.utime(path)
+
+def evict(directory, max_bytes):
+    """
+    Delete the least recently used entries of a cache directory (oldest modification
+    time, see touch) until it holds at most `max_bytes`.
+
+    Returns:
+        int: Number of entries deleted.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError: # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return deleted
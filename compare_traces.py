@@ -1,355 +1,1074 @@
 import argparse
+import collections
+import contextlib
+import io
+import itertools
 import json
 import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree import ElementTree
 
+import numpy as np
+
+import cache_utils
+import metrics
+import results_db
+import rv_decode
+import trace_format
+import trace_index
+
+# The classification is table driven (see rv_decode), these helpers are kept for scripts
+# that test one instruction at a time
 def is_load_instruction(instruction):
-    load_op_code = instruction & 0b1111111 == 0b0000011 # lb, lh, lw, lbu, lhu
-    return load_op_code
-    
+    return rv_decode.RV32I_TABLE.classify(instruction) == rv_decode.CLASS_LOAD # lb, lh, lw, lbu, lhu
+
 def is_store_byte_instruction(instruction):
-    store_op_code = instruction & 0b1111111 == 0b0100011 # sb, sh, sw
-    store_func3 = (instruction >> 12) & 0b111 == 0b000
-    return store_op_code and store_func3
+    return is_store_instruction(instruction, 1) # sb
 
 def is_store_half_instruction(instruction):
-    store_op_code = instruction & 0b1111111 == 0b0100011 # sb, sh, sw
-    store_func3 = (instruction >> 12) & 0b111 == 0b001
-    return store_op_code and store_func3
+    return is_store_instruction(instruction, 2) # sh
 
 def is_store_word_instruction(instruction):
-    store_op_code = instruction & 0b1111111 == 0b0100011 # sb, sh, sw
-    store_func3 = (instruction >> 12) & 0b111 == 0b010
-    return store_op_code and store_func3
+    return is_store_instruction(instruction, 4) # sw
+
+def is_store_instruction(instruction, store_bytes):
+    return int(rv_decode.RV32I_TABLE.store_bytes[rv_decode.index(instruction)]) == store_bytes
 
 def is_branch_instruction(instruction):
-    branch_op_code = instruction & 0b1111111 == 0b1100011 # beq, bne, blt, bge, bltu, bgeu
-    return branch_op_code
+    return rv_decode.RV32I_TABLE.classify(instruction) == rv_decode.CLASS_BRANCH # beq, bne, blt, bge, bltu, bgeu
 
 def is_jump_instruction(instruction):
-    jump_op_code = (instruction & 0b1111111 == 0b1101111) or (instruction & 0b1111111 == 0b1100111) # jal or jalr
-    # write_to_zero = (instruction & 0b00000000000000000000111110000000) == 0
-    return jump_op_code
+    return rv_decode.RV32I_TABLE.classify(instruction) == rv_decode.CLASS_JUMP # jal or jalr
 
 def is_reg_instruction(instruction):
-    op_code = instruction & 0b1111111
-    reg_opcode = (  op_code == 0b0110111 or # lui
-                    op_code == 0b0010111 or # auipc 
-                    op_code == 0b0010011 or # addi, slti, sltiu, xori, ori, andi, slli, srli, srai
-                    op_code == 0b0110011    # add, sub, sll, slt, sltu, xor, srl, sra, or, and 
-                )
-    return reg_opcode
+    return rv_decode.RV32I_TABLE.classify(instruction) == rv_decode.CLASS_REG # lui, auipc, OP-IMM and OP
 
 def is_fence_instruction(instruction):
-    fence_op_code = instruction & 0b1111111 == 0b0001111 # fence
-    return fence_op_code
+    return rv_decode.RV32I_TABLE.classify(instruction) == rv_decode.CLASS_FENCE # fence
+
+DECODE_CHUNK = 1 << 16 # fetched instructions classified at once
+
+# Bits of the memory access kept for each store width, in bytes
+STORE_MASKS = {1: 0xFF, 2: 0xFFFF, 4: 0xFFFFFFFF}
 
-def reorder_superscalar_commits(spike_entry, next_spike_entry, regfile_commits, regfile_commits_index):
+class CommitStream:
+    """
+    Regfile commits waiting to be aligned, fed from the fragmented trace a chunk at a time.
+    The commits added while aligning (repeated writes, reordered superscalar commits) go
+    in front of them. Every operation is O(1).
+
+    Args:
+        commits (iterable): First regfile_commits of the fragmented trace.
+    """
+    def __init__(self, commits=()):
+        self.commits = collections.deque(commits)
+
+    def __len__(self):
+        return len(self.commits)
+
+    def extend(self, commits):
+        """Add commits read from the trace after the current ones."""
+        self.commits.extend(commits)
+
+    def peek(self, offset=0):
+        """The commit `offset` positions after the cursor."""
+        return self.commits[offset]
+
+    def push_front(self, commit):
+        """Make `commit` the next one."""
+        self.commits.appendleft(commit)
+
+    def pop(self):
+        """Consume the next commit."""
+        return self.commits.popleft()
+
+    def swap_front(self):
+        """Exchange the next two commits."""
+        first = self.pop()
+        second = self.pop()
+        self.push_front(first)
+        self.push_front(second)
+
+def reorder_superscalar_commits(spike_entry, next_spike_entry, regfile_commits):
     """
     Look for the next commits in case the superscalar processor committed out of order.
     If it does not find a match with the next commit, nothing is changed.
     It checks if the swap is valid by looking at the next spike entry as well.
+
+    Args:
+        regfile_commits (CommitStream): The commits, the next one being the candidate for
+            spike_entry.
     """
-    next_index = regfile_commits_index + 1
-    if next_index < len(regfile_commits):
-        next_commit = regfile_commits[next_index]
+    if next_spike_entry is not None and len(regfile_commits) > 1:
+        commit, next_commit = regfile_commits.peek(0), regfile_commits.peek(1)
 
         if (next_commit[0] == spike_entry["target_reg"] and next_commit[1] == spike_entry["reg_val"] and
-            regfile_commits[regfile_commits_index][0] == next_spike_entry["target_reg"] and regfile_commits[regfile_commits_index][1] == next_spike_entry["reg_val"]
+            commit[0] == next_spike_entry["target_reg"] and commit[1] == next_spike_entry["reg_val"]
             ):
-            # Swap the commits
-            regfile_commits[regfile_commits_index], regfile_commits[next_index] = regfile_commits[next_index], regfile_commits[regfile_commits_index]
+            regfile_commits.swap_front()
     return
 
-def generate_final_trace(spike_trace, dut_trace, elf_name):
+def final_entry(fetch, target_reg=None, reg_val=None, mem_addr=None, mem_val=None, speculative_fetch=False, speculative_commit=False):
+    """An entry of the final trace for the fetch (pc, instr)."""
+    return {
+        "pc": fetch[0],
+        "instr": fetch[1],
+        "target_reg": target_reg,
+        "reg_val": reg_val,
+        "mem_addr": mem_addr,
+        "mem_val": mem_val,
+        "speculative_fetch": speculative_fetch,
+        "speculative_commit": speculative_commit
+    }
+
+FRAGMENTS = ("fetches", "regfile_commits", "memory_accesses")
+
+class TraceAligner:
     """
-    Compares the spike trace with the dut fragmented trace to generate a final dut trace.
+    Generates the final dut trace from the spike trace and the dut fragmented trace.
     If the dut trace has more fetches than needed, these are marked as speculative fetches.
     Since the simulation only detects changes to the register file, repeated writes such as
     regfile[1] <= 5
     regfile[1] <= 5
-    are not detected. In this case, a correct commit is added and marked as speculative commit. 
-    """
-    # Generate processor/dut trace while comparing to the spike trace
-    fetches_index = 0
-    regfile_commits_index = 0
-    memory_accesses_index = 0
-    dut_trace_final = []
-    spike_regfile = [0] * 32 # CAUTION: sometimes RTL processors do not initialize with zero! This affetcs the commits list.
-    spike_index = 0
-    while spike_index < len(spike_trace):
-
-        spike_entry = spike_trace[spike_index]
-        
-        if spike_index + 1 < len(spike_trace):
-            next_spike_entry = spike_trace[spike_index+1] # for reordering superscalar commits
-
-        # dut_trace was shorter than spike_trace, probably a bug
-        if fetches_index >= len(dut_trace["fetches"]):
-            print(f"{elf_name} trace ended before expected (out of fetches).")
-            break
-        
-        # filter memory reads, dut cannot detect memory reads
-        if spike_entry["mem_addr"] is not None and spike_entry["mem_val"] is None:
-            spike_entry["mem_addr"] = None
-            
-        # Tolerate odd PCs to help exposing JALR LSB bugs
-        if (spike_entry["pc"] != (dut_trace["fetches"][fetches_index][0] & 0xFFFFFFFE)
-            # or spike_entry["instr"] != dut_trace["fetches"][fetches_index][1]
-        ):
-            # Assume speculative fetch
-            dut_trace_final.append({
-                "pc": dut_trace["fetches"][fetches_index][0],
-                "instr": dut_trace["fetches"][fetches_index][1],
-                "target_reg": None,
-                "reg_val": None,
-                "mem_addr": None,
-                "mem_val": None,
-                "speculative_fetch": True,
-                "speculative_commit": False
-            })
-            fetches_index += 1
+    are not detected. In this case, a correct commit is added and marked as speculative commit.
+
+    The spike entries are read from an iterator, one ahead of the entry being aligned. The
+    fragments are fed in chunks (feed) and dropped once aligned, so memory does not depend
+    on the length of the traces; end tells that a fragment list has no more rows. advance
+    aligns as far as the fed fragments allow. The fetched instructions are classified by
+    `decode_table` (rv_decode.DecodeTable) one chunk at a time.
+
+    Args:
+        spike_entries (iterable): The spike trace entries.
+        elf_name (str): Name used in the messages.
+        decode_table (rv_decode.DecodeTable): Classification of the fetched instructions.
+    Attributes:
+        done (bool): The alignment is over (end of the spike trace, or of a fragment list).
+        waiting (str): With done False, the fragment list advance needs more rows of.
+        spike_entry (dict): The first spike entry not aligned yet, None at the end.
+    """
+    def __init__(self, spike_entries, elf_name, decode_table=rv_decode.RV32I_TABLE):
+        self.spike_entries = iter(spike_entries)
+        self.elf_name = elf_name
+        self.decode_table = decode_table
+        self.fetches = collections.deque() # (pc, instr, class, store bytes, rd)
+        self.regfile_commits = CommitStream()
+        self.memory_accesses = collections.deque()
+        self.ended = set()
+        self.done = False
+        self.waiting = None
+        self.spike_regfile = [0] * 32 # CAUTION: sometimes RTL processors do not initialize with zero! This affetcs the commits list.
+        self.spike_entry = next(self.spike_entries, None)
+        # for reordering superscalar commits
+        self.next_spike_entry = next(self.spike_entries, None) if self.spike_entry is not None else None
+
+    def feed(self, fragment, rows):
+        """Add rows to one of the FRAGMENTS lists, after the rows already fed."""
+        if fragment == "fetches":
+            rows = list(rows)
+            classes, store_bytes, rd = self.decode_table.decode([fetch[1] for fetch in rows])
+            self.fetches.extend(zip([fetch[0] for fetch in rows], [fetch[1] for fetch in rows],
+                                    classes.tolist(), store_bytes.tolist(), rd.tolist()))
+        elif fragment == "regfile_commits":
+            self.regfile_commits.extend(rows)
         else:
+            self.memory_accesses.extend(rows)
+
+    def end(self, fragment=None):
+        """No more rows for `fragment`, or for every fragment if None."""
+        self.ended.update(FRAGMENTS if fragment is None else (fragment,))
+
+    def _wait(self, fragment):
+        """True if `fragment` may still get rows, advance must stop until they are fed."""
+        if fragment in self.ended:
+            return False
+        self.waiting = fragment
+        return True
+
+    def _stop(self, message):
+        print(f"{self.elf_name} {message}")
+        self.done = True
+
+    def advance(self):
+        """
+        Align the fed fragments.
+
+        Yields:
+            tuple: (final entry, spike entry) for every final entry, the spike entry being
+            the one consumed by the final entry (None for speculative fetches). Returns when
+            done, or when rows of the `waiting` fragment list are needed.
+        """
+        self.waiting = None
+        while not self.done:
+            spike_entry = self.spike_entry
+            if spike_entry is None:
+                self.done = True
+                return
+
+            # dut_trace was shorter than spike_trace, probably a bug
+            if not self.fetches:
+                if not self._wait("fetches"):
+                    self._stop("trace ended before expected (out of fetches).")
+                return
+
+            fetch = self.fetches[0]
+            instruction_class = fetch[2]
+
+            # Tolerate odd PCs to help exposing JALR LSB bugs
+            if spike_entry["pc"] != (fetch[0] & 0xFFFFFFFE):
+                # Assume speculative fetch
+                self.fetches.popleft()
+                yield final_entry(fetch, speculative_fetch=True), None
+                continue
 
             # repeated writes cannot be detected. Mark them as speculative commits
             # this only work for the array version. harv and cve2, for example, do not support repeated writes
             speculative_commit = False
             if spike_entry["target_reg"] is not None:
-                speculative_commit = spike_regfile[spike_entry["target_reg"]] == spike_entry["reg_val"]
-            
+                speculative_commit = self.spike_regfile[spike_entry["target_reg"]] == spike_entry["reg_val"]
+
+            # wait for the fragments this entry needs before changing anything
+            writes_rd = rv_decode.WRITES_RD[instruction_class] and fetch[4] != 0 # writes to x0 are not computed
+            if writes_rd:
+                # the next commit and, to check the superscalar reordering, the one after
+                needed = 1 if instruction_class == rv_decode.CLASS_JUMP or self.next_spike_entry is None else 2
+                if len(self.regfile_commits) + speculative_commit < needed and self._wait("regfile_commits"):
+                    return
+            elif instruction_class == rv_decode.CLASS_STORE:
+                if not self.memory_accesses and self._wait("memory_accesses"):
+                    return
+
             if speculative_commit:
                 # add new commit
-                dut_trace["regfile_commits"].insert(regfile_commits_index, [spike_entry["target_reg"], spike_entry["reg_val"]])
-
-            # Check if the instruction is writing to the x0 register
-            # Writes to x0 are not computed
-            write_to_zero = (dut_trace["fetches"][fetches_index][1] & 0b00000000000000000000111110000000) == 0
-
-            if is_load_instruction(dut_trace["fetches"][fetches_index][1]):
-                if write_to_zero: # just the fetch
-                    dut_trace_final.append({
-                        "pc": dut_trace["fetches"][fetches_index][0],
-                        "instr": dut_trace["fetches"][fetches_index][1],
-                        "target_reg": None,
-                        "reg_val": None,
-                        "mem_addr": None,
-                        "mem_val": None,
-                        "speculative_fetch": False,
-                        "speculative_commit": speculative_commit
-                    })
-                    fetches_index += 1
-                    spike_index += 1
-                else:
-                    if regfile_commits_index >= len(dut_trace["regfile_commits"]):
-                        print(f"{elf_name} trace ended before expected (out of regfile_commits).")
-                        break
-                    
-                    reorder_superscalar_commits(spike_entry, next_spike_entry, dut_trace["regfile_commits"], regfile_commits_index)
-
-                    dut_trace_final.append({
-                        "pc": dut_trace["fetches"][fetches_index][0],
-                        "instr": dut_trace["fetches"][fetches_index][1],
-                        "target_reg": dut_trace["regfile_commits"][regfile_commits_index][0],
-                        "reg_val": dut_trace["regfile_commits"][regfile_commits_index][1],
-                        "mem_addr": None,
-                        "mem_val": None,
-                        "speculative_fetch": False,
-                        "speculative_commit": speculative_commit
-                    })
-                    fetches_index += 1
-                    regfile_commits_index += 1
-                    spike_index += 1
-                    spike_regfile[spike_entry["target_reg"]] = spike_entry["reg_val"]
-
-            elif (is_store_byte_instruction(dut_trace["fetches"][fetches_index][1]) or
-                  is_store_half_instruction(dut_trace["fetches"][fetches_index][1]) or
-                  is_store_word_instruction(dut_trace["fetches"][fetches_index][1])):
-                
-                if memory_accesses_index >= len(dut_trace["memory_accesses"]):
-                    print(f"{elf_name} trace ended before expected (out of memory accesses)")
-                    break
-                
+                self.regfile_commits.push_front([spike_entry["target_reg"], spike_entry["reg_val"]])
+
+            if writes_rd:
+                if not self.regfile_commits:
+                    self._stop("trace ended before expected (out of regfile_commits).")
+                    return
+
+                if instruction_class != rv_decode.CLASS_JUMP:
+                    reorder_superscalar_commits(spike_entry, self.next_spike_entry, self.regfile_commits)
+
+                commit = self.regfile_commits.pop()
+                entry = final_entry(fetch, commit[0], commit[1], speculative_commit=speculative_commit)
+                self.spike_regfile[spike_entry["target_reg"]] = spike_entry["reg_val"]
+
+            elif rv_decode.WRITES_RD[instruction_class]: # just the fetch
+                entry = final_entry(fetch, speculative_commit=speculative_commit)
+
+            elif instruction_class == rv_decode.CLASS_STORE:
+                if not self.memory_accesses:
+                    self._stop("trace ended before expected (out of memory accesses)")
+                    return
+
                 # Exract only the bytes that were actually stored (considering write strobe)
                 # Spike address points to the specific bytes to be stored
-                byte_shift = 8*(spike_entry["mem_addr"] & 0b11)
-                if is_store_word_instruction(dut_trace["fetches"][fetches_index][1]):
-                    aux_mem_val = (dut_trace["memory_accesses"][memory_accesses_index][1] >> byte_shift)
-                elif is_store_half_instruction(dut_trace["fetches"][fetches_index][1]):
-                    aux_mem_val = (dut_trace["memory_accesses"][memory_accesses_index][1] >> byte_shift) & 0xFFFF
-                elif is_store_byte_instruction(dut_trace["fetches"][fetches_index][1]):
-                    aux_mem_val = (dut_trace["memory_accesses"][memory_accesses_index][1] >> byte_shift) & 0xFF
+                mem_addr, mem_val = self.memory_accesses.popleft()
+                mem_val = (mem_val >> 8*(spike_entry["mem_addr"] & 0b11)) & STORE_MASKS[fetch[3]]
 
                 # align dut address to be compatible with spike
-                dut_trace["memory_accesses"][memory_accesses_index][0] = dut_trace["memory_accesses"][memory_accesses_index][0] + (spike_entry["mem_addr"] & 0b11)
-                
-                dut_trace_final.append({
-                    "pc": dut_trace["fetches"][fetches_index][0],
-                    "instr": dut_trace["fetches"][fetches_index][1],
-                    "target_reg": None,
-                    "reg_val": None,
-                    "mem_addr": dut_trace["memory_accesses"][memory_accesses_index][0],
-                    "mem_val": aux_mem_val,
-                    "speculative_fetch": False,
-                    "speculative_commit": False
-                })
-                fetches_index += 1
-                memory_accesses_index += 1
-                spike_index += 1
-            elif is_branch_instruction(dut_trace["fetches"][fetches_index][1]):
-                dut_trace_final.append({
-                    "pc": dut_trace["fetches"][fetches_index][0],
-                    "instr": dut_trace["fetches"][fetches_index][1],
-                    "target_reg": None,
-                    "reg_val": None,
-                    "mem_addr": None,
-                    "mem_val": None,
-                    "speculative_fetch": False,
-                    "speculative_commit": False
-                })
-                fetches_index += 1
-                spike_index += 1
-            elif is_reg_instruction(dut_trace["fetches"][fetches_index][1]):               
-                if write_to_zero: # just the fetch
-                    dut_trace_final.append({
-                        "pc": dut_trace["fetches"][fetches_index][0],
-                        "instr": dut_trace["fetches"][fetches_index][1],
-                        "target_reg": None,
-                        "reg_val": None,
-                        "mem_addr": None,
-                        "mem_val": None,
-                        "speculative_fetch": False,
-                        "speculative_commit": speculative_commit
-                    })
-                    fetches_index += 1
-                    spike_index += 1
-                else:
-                    if regfile_commits_index >= len(dut_trace["regfile_commits"]):
-                        print(f"{elf_name} trace ended before expected (out of regfile_commits).")
-                        break
-
-                    reorder_superscalar_commits(spike_entry, next_spike_entry, dut_trace["regfile_commits"], regfile_commits_index)
-
-                    dut_trace_final.append({
-                        "pc": dut_trace["fetches"][fetches_index][0],
-                        "instr": dut_trace["fetches"][fetches_index][1],
-                        "target_reg": dut_trace["regfile_commits"][regfile_commits_index][0],
-                        "reg_val": dut_trace["regfile_commits"][regfile_commits_index][1],
-                        "mem_addr": None,
-                        "mem_val": None,
-                        "speculative_fetch": False,
-                        "speculative_commit": speculative_commit
-                    })
-                    fetches_index += 1
-                    regfile_commits_index += 1
-                    spike_index += 1
-                    spike_regfile[spike_entry["target_reg"]] = spike_entry["reg_val"]
-                    
-            elif is_jump_instruction(dut_trace["fetches"][fetches_index][1]):
-                if write_to_zero: # just the fetch
-                    dut_trace_final.append({
-                        "pc": dut_trace["fetches"][fetches_index][0],
-                        "instr": dut_trace["fetches"][fetches_index][1],
-                        "target_reg": None,
-                        "reg_val": None,
-                        "mem_addr": None,
-                        "mem_val": None,
-                        "speculative_fetch": False,
-                        "speculative_commit": speculative_commit
-                    })
-                    fetches_index += 1
-                    spike_index += 1
-                else:
-                    if regfile_commits_index >= len(dut_trace["regfile_commits"]):
-                        print(f"{elf_name} trace ended before expected (out of regfile_commits).")
-                        break
-                    
-                    dut_trace_final.append({
-                        "pc": dut_trace["fetches"][fetches_index][0],
-                        "instr": dut_trace["fetches"][fetches_index][1],
-                        "target_reg": dut_trace["regfile_commits"][regfile_commits_index][0],
-                        "reg_val": dut_trace["regfile_commits"][regfile_commits_index][1],
-                        "mem_addr": None,
-                        "mem_val": None,
-                        "speculative_fetch": False,
-                        "speculative_commit": speculative_commit
-                    })
-                    fetches_index += 1
-                    regfile_commits_index += 1
-                    spike_index += 1
-                    spike_regfile[spike_entry["target_reg"]] = spike_entry["reg_val"]
-
-            elif is_fence_instruction(dut_trace["fetches"][fetches_index][1]):
-                dut_trace_final.append({
-                    "pc": dut_trace["fetches"][fetches_index][0],
-                    "instr": dut_trace["fetches"][fetches_index][1],
-                    "target_reg": None,
-                    "reg_val": None,
-                    "mem_addr": None,
-                    "mem_val": None,
-                    "speculative_fetch": False,
-                    "speculative_commit": False
-                })
-                fetches_index += 1
-                spike_index += 1
+                mem_addr += spike_entry["mem_addr"] & 0b11
+
+                entry = final_entry(fetch, mem_addr=mem_addr, mem_val=mem_val)
+
+            elif instruction_class == rv_decode.CLASS_BRANCH or instruction_class == rv_decode.CLASS_FENCE:
+                entry = final_entry(fetch)
+
             else:
-                print(f"Unknown instruction: {hex(dut_trace['fetches'][fetches_index][1])}.")
+                print(f"Unknown instruction: {hex(fetch[1])}.")
                 # ignore unknown instruction as a speculative fetch
-                dut_trace_final.append({
-                    "pc": dut_trace["fetches"][fetches_index][0],
-                    "instr": dut_trace["fetches"][fetches_index][1],
-                    "target_reg": None,
-                    "reg_val": None,
-                    "mem_addr": None,
-                    "mem_val": None,
-                    "speculative_fetch": True,
-                    "speculative_commit": False
-                })
-                fetches_index += 1
-                spike_index += 1
-    return dut_trace_final
+                entry = final_entry(fetch, speculative_fetch=True)
+
+            # move to the next entry before yielding, so that a caller can stop here
+            self.fetches.popleft()
+            self.spike_entry = self.next_spike_entry
+            self.next_spike_entry = next(self.spike_entries, None) if self.spike_entry is not None else None
+            yield entry, spike_entry
+
+def align_fragments(aligner, dut_trace, chunk=None):
+    """
+    Run a TraceAligner on a whole fragmented trace, reading its fragment lists (lists or
+    iterators, see trace_format.iter_fragments) `chunk` rows (default DECODE_CHUNK) at a
+    time when the aligner needs them.
+
+    Yields:
+        tuple: What aligner.advance yields, (final entry, spike entry).
+    """
+    chunk = chunk or DECODE_CHUNK
+    sources = {fragment: iter(dut_trace[fragment]) for fragment in FRAGMENTS}
+    while True:
+        yield from aligner.advance()
+        if aligner.done:
+            return
+        rows = list(itertools.islice(sources[aligner.waiting], chunk))
+        if rows:
+            aligner.feed(aligner.waiting, rows)
+        else:
+            aligner.end(aligner.waiting)
+
+def iter_final_trace(spike_trace, dut_trace, elf_name, decode_table=rv_decode.RV32I_TABLE):
+    """
+    Compares the spike trace with the dut fragmented trace to generate a final dut trace
+    (see TraceAligner). The traces may be lists or iterators.
+
+    Yields the entries of the final trace one by one, so that a caller can stop early;
+    generate_final_trace returns them all.
+    """
+    aligner = TraceAligner(spike_trace, elf_name, decode_table)
+    for entry, _ in align_fragments(aligner, dut_trace):
+        yield entry
+
+def generate_final_trace(spike_trace, dut_trace, elf_name, decode_table=rv_decode.RV32I_TABLE):
+    """
+    Compares the spike trace with the dut fragmented trace to generate a final dut trace
+    (see iter_final_trace).
+
+    Returns:
+        list: The entries of the final trace.
+    """
+    with metrics.Stage("generate_final_trace", elf_name) as stage:
+        final_trace = list(iter_final_trace(spike_trace, dut_trace, elf_name, decode_table))
+        stage.count("entries", len(final_trace))
+        return final_trace
+
+ENTRY_FIELDS = ("pc", "instr", "target_reg", "reg_val", "mem_addr", "mem_val")
+
+def entry_columns(entries):
+    """
+    Columns of a list of trace entries (dictionaries), for compare_columns.
+
+    Returns:
+        dict: field -> (values, valid) NumPy arrays, missing values read as 0. Final traces
+        also have "speculative_fetch" -> bool array.
+    """
+    columns = {}
+    for field in ENTRY_FIELDS:
+        values = [entry[field] for entry in entries]
+        valid = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        columns[field] = (np.fromiter((value or 0 for value in values), dtype=np.int64, count=len(values)), valid)
+    if entries and "speculative_fetch" in entries[0]:
+        columns["speculative_fetch"] = np.fromiter((entry.get("speculative_fetch", False) for entry in entries), dtype=bool, count=len(entries))
+    return columns
+
+def load_json_trace(path):
+    """trace_format.load_trace of a JSON trace, timed as its <stage>_json_load metrics stage."""
+    with metrics.trace_stage(path, "json_load") as stage:
+        data = trace_format.load_trace(path)
+        stage.count("entries", trace_format.count_rows(data))
+    return data
+
+def read_entries(path):
+    """The entries of a spike or final trace, as trace_format.iter_entries (timing JSON loads)."""
+    if not trace_format.is_binary_trace(path):
+        return iter(load_json_trace(path))
+    return trace_format.iter_entries(path)
+
+def read_fragments(path):
+    """The fragments of a fragmented trace, as trace_format.iter_fragments (timing JSON loads)."""
+    if not trace_format.is_binary_trace(path):
+        return load_json_trace(path)
+    return trace_format.iter_fragments(path)
+
+def trace_columns(path):
+    """
+    Columns of a spike or final trace file, as entry_columns. Binary traces are read
+    block by block from the memory-mapped file, without building entries.
+    """
+    if not trace_format.is_binary_trace(path):
+        return entry_columns(load_json_trace(path))
+    return trace_index.table_columns(path, "entries")
+
+def compare_columns(spike_columns, dut_columns):
+    """
+    Vectorized comparison of a spike trace with a dut final trace, given as columns
+    (entry_columns or trace_columns). Same rules as compare_traces: speculative fetches of
+    the dut are skipped, the address of memory reads is not compared, and the comparison
+    stops at the first spike entry without a dut entry.
+
+    Returns:
+        dict: "indices": positions of the mismatching spike entries; "fields": field -> bool
+        array, per mismatch, set if that field differs; "dut_indices": positions of the
+        matching dut entries in the final trace (-1 when missing); "out_of_dut_entries":
+        True if the dut trace ended first.
+    """
+    spike_length = len(spike_columns["pc"][0])
+    dut_indices = np.arange(len(dut_columns["pc"][0]))
+    if "speculative_fetch" in dut_columns:
+        dut_indices = dut_indices[~dut_columns["speculative_fetch"]]
+    compared = min(spike_length, len(dut_indices))
+    dut_indices = dut_indices[:compared]
+
+    columns = {}
+    for field in ENTRY_FIELDS:
+        spike_values, spike_valid = spike_columns[field]
+        dut_values, dut_valid = dut_columns[field]
+        columns[field] = (spike_values[:compared], spike_valid[:compared],
+                          dut_values[dut_indices], dut_valid[dut_indices])
+
+    # the memory models cannot detect memory reads: no address for reads in spike, and
+    # none for loads in the DUT final trace
+    spike_values, spike_valid, dut_values, dut_valid = columns["mem_addr"]
+    spike_valid = spike_valid & columns["mem_val"][1]
+    dut_valid = dut_valid & ((columns["instr"][0] & 0b1111111) != 0b0000011)
+    columns["mem_addr"] = (spike_values, spike_valid, dut_values, dut_valid)
+
+    differs = {}
+    for field, (spike_values, spike_valid, dut_values, dut_valid) in columns.items():
+        differs[field] = (spike_valid != dut_valid) | (spike_valid & (spike_values != dut_values))
+    mismatch = np.logical_or.reduce(list(differs.values())) if compared else np.zeros(0, dtype=bool)
+
+    indices = np.flatnonzero(mismatch)
+    out_of_dut_entries = compared < spike_length
+    fields = {field: differs[field][indices] for field in ENTRY_FIELDS}
+    mismatch_dut_indices = dut_indices[indices]
+    if out_of_dut_entries: # the first spike entry without a dut entry
+        indices = np.append(indices, compared)
+        mismatch_dut_indices = np.append(mismatch_dut_indices, -1)
+        present = {field: bool(spike_columns[field][1][compared]) for field in ENTRY_FIELDS}
+        present["mem_addr"] = present["mem_addr"] and present["mem_val"]
+        fields = {field: np.append(fields[field], present[field]) for field in ENTRY_FIELDS}
+    return {"indices": indices, "fields": fields, "dut_indices": mismatch_dut_indices, "out_of_dut_entries": out_of_dut_entries}
+
+def column_entry(columns, index):
+    """The entry at `index` of trace columns, as a dictionary (None for missing values)."""
+    entry = {}
+    for field in ENTRY_FIELDS:
+        values, valid = columns[field]
+        entry[field] = int(values[index]) if valid[index] else None
+    return entry
+
+EMPTY_ENTRY = dict.fromkeys(ENTRY_FIELDS)
+
+def mismatch_entries(spike_entry, dut_entry):
+    """The mismatch as compare_traces reports it: no read address in spike, none for loads in the DUT."""
+    if spike_entry["mem_addr"] is not None and spike_entry["mem_val"] is None:
+        spike_entry = dict(spike_entry, mem_addr=None)
+    dut_entry = {field: dut_entry[field] for field in ENTRY_FIELDS}
+    if spike_entry["instr"] & 0b1111111 == 0b0000011:
+        dut_entry["mem_addr"] = None
+    return {"spike": spike_entry, "dut": dut_entry}
 
 def compare_traces(spike_trace, dut_final_trace, elf_name):
     """
     Compare spike trace with dut final trace.
     Ignore speculative fetch entries in the dut final trace.
+    Reference implementation, one entry at a time: compare_stream (fragmented traces) and
+    compare_trace_files (saved final traces, vectorized) give the same mismatches.
     """
-    non_speculative_entries = [entry for entry in dut_final_trace if not entry.get("speculative_fetch", False)]
-    mismatches = []
+    with metrics.Stage("compare_traces", elf_name) as stage:
+        stage.count("entries", len(spike_trace))
+        non_speculative_entries = [entry for entry in dut_final_trace if not entry.get("speculative_fetch", False)]
+        mismatches = []
+    
+        for i in range(len(spike_trace)):
+            spike_entry = spike_trace[i]
+            # the memory models cannot detect memory reads
+            if spike_entry["mem_addr"] is not None and spike_entry["mem_val"] is None:
+                spike_entry = dict(spike_entry, mem_addr=None)
+
+            if i >= len(non_speculative_entries):
+                print(f"Comparison of {elf_name} ended before expected (out of dut entries).")
+                empty_entry = {
+                    "pc": None,
+                    "instr": None,
+                    "target_reg": None,
+                    "reg_val": None,
+                    "mem_addr": None,
+                    "mem_val": None
+                }
+                mismatches.append({"spike": spike_entry,
+                                   "dut": empty_entry})
+                break
+
+            dut_entry = non_speculative_entries[i].copy()
+            dut_entry.pop("speculative_fetch", None)  # Remove speculative key if exists
+            dut_entry.pop("speculative_commit", None)
+
+            # DUT final trace does not show memory address for load instructions
+            if spike_entry["instr"] & 0b1111111 == 0b0000011:
+                dut_entry["mem_addr"] = None
+
+            # Compare the spike entry with the DUT entry
+            if spike_entry != dut_entry:
+                mismatches.append({
+                    "spike": spike_entry,
+                    "dut": dut_entry
+                })
     
-    for i in range(len(spike_trace)):
-        spike_entry = spike_trace[i]
+        return mismatches
 
-        if i >= len(non_speculative_entries):
+def compare_trace_files(spike_path, dut_final_path, elf_name):
+    """
+    Same as compare_traces, for traces saved to files, with compare_columns. Binary traces
+    are compared from the memory-mapped columns, without loading their entries; entries
+    are only built for the mismatches.
+    """
+    with metrics.Stage("compare_trace_files", elf_name) as stage:
+        spike_columns = trace_columns(spike_path)
+        dut_columns = trace_columns(dut_final_path)
+        result = compare_columns(spike_columns, dut_columns)
+        if result["out_of_dut_entries"]:
             print(f"Comparison of {elf_name} ended before expected (out of dut entries).")
-            empty_entry = {
-                "pc": None,
-                "instr": None,
-                "target_reg": None,
-                "reg_val": None,
-                "mem_addr": None,
-                "mem_val": None
-            }
-            mismatches.append({"spike": spike_entry,
-                               "dut": empty_entry})
-            break
+        stage.count("entries", len(spike_columns["pc"][0]))
+        return column_mismatches(spike_columns, dut_columns, result)
+
+def column_mismatches(spike_columns, dut_columns, result, limit=None):
+    """
+    The mismatches of a compare_columns result as compare_traces reports them, building
+    entries only for the first `limit` ones (all if None).
+    """
+    mismatches = []
+    for index, dut_index in zip(result["indices"][:limit].tolist(), result["dut_indices"][:limit].tolist()):
+        dut_entry = column_entry(dut_columns, dut_index) if dut_index >= 0 else EMPTY_ENTRY
+        mismatches.append(mismatch_entries(column_entry(spike_columns, index), dut_entry))
+    return mismatches
 
-        # DUT final trace does not show memory address for load instructions
-        if spike_entry["instr"] & 0b1111111 == 0b0000011:
-            dut_entry["mem_addr"] = None
+def is_final_trace(path):
+    """True if a DUT trace is a saved final trace: by its kind if binary, by its name if JSON."""
+    if trace_format.is_binary_trace(path):
+        with trace_format.TraceReader(path) as reader:
+            return reader.kind == trace_format.KIND_FINAL
+    return trace_format.split_trace_name(os.path.basename(path))[1] == "final"
 
+def entries_match(spike_entry, dut_entry):
+    """True if a final trace entry matches its spike entry, as compared by compare_traces."""
+    if (spike_entry["pc"] != dut_entry["pc"] or spike_entry["instr"] != dut_entry["instr"] or
+        spike_entry["target_reg"] != dut_entry["target_reg"] or spike_entry["reg_val"] != dut_entry["reg_val"] or
+        spike_entry["mem_val"] != dut_entry["mem_val"]
+        ):
+        return False
+    # the memory models cannot detect memory reads, and loads have no DUT address
+    spike_addr = spike_entry["mem_addr"] if spike_entry["mem_val"] is not None else None
+    dut_addr = None if spike_entry["instr"] & 0b1111111 == 0b0000011 else dut_entry["mem_addr"]
+    return spike_addr == dut_addr
 
-        dut_entry = non_speculative_entries[i].copy()
-        dut_entry.pop("speculative_fetch", None)  # Remove speculative key if exists
-        dut_entry.pop("speculative_commit", None)
+class TraceComparison:
+    """
+    Compares the final entries of a TraceAligner with the spike entries as they are
+    aligned: the k-th non-speculative final entry is compared with the k-th spike entry,
+    as in compare_traces. Only the spike entries consumed by speculative (unknown)
+    instructions wait to be compared, so memory does not depend on the length of the traces.
 
-        # Compare the spike entry with the DUT entry
-        if spike_entry != dut_entry:
-            mismatches.append({
-                "spike": spike_entry,
-                "dut": dut_entry
-            })
-    
+    Args:
+        aligner (TraceAligner): The aligner whose output is compared.
+        sink: Optional object with an append method (e.g. trace_format.EntryWriter, or a
+            list) receiving every final entry, speculative ones included.
+    """
+    def __init__(self, aligner, sink=None):
+        self.aligner = aligner
+        self.sink = sink
+        self.unpaired = collections.deque()
+        self.index = 0
+
+    def pairs(self, aligned_entries):
+        """
+        Compare the output of aligner.advance (or of align_fragments).
+
+        Yields:
+            tuple: (index, spike entry, final entry, True if they match) for every
+            non-speculative final entry, index being the position in the spike trace.
+        """
+        for dut_entry, spike_entry in aligned_entries:
+            if self.sink is not None:
+                self.sink.append(dut_entry)
+            if spike_entry is not None:
+                self.unpaired.append(spike_entry)
+            if dut_entry["speculative_fetch"]:
+                continue
+            spike_entry = self.unpaired.popleft()
+            self.index += 1
+            yield self.index - 1, spike_entry, dut_entry, entries_match(spike_entry, dut_entry)
+
+    def pending(self):
+        """True if spike entries are still to be compared."""
+        return bool(self.unpaired) or self.aligner.spike_entry is not None
+
+    def missing_entry(self):
+        """Once the aligner is done, the first spike entry without a DUT entry, or None."""
+        return self.unpaired[0] if self.unpaired else self.aligner.spike_entry
+
+def compare_stream(spike_entries, dut_trace, elf_name, sink=None, decode_table=rv_decode.RV32I_TABLE):
+    """
+    Aligns and compares in a single pass over the traces, with O(1) memory in their length:
+    same mismatches as generate_final_trace + compare_traces, without keeping the final
+    trace. It can be written on the way by `sink` (see TraceComparison).
+
+    Args:
+        spike_entries (iterable): The spike trace entries (see trace_format.iter_entries).
+        dut_trace (dict): The fragment lists or iterators (see trace_format.iter_fragments).
+    Returns:
+        list: The mismatches, {"spike", "dut"} each.
+    """
+    aligner = TraceAligner(spike_entries, elf_name, decode_table)
+    comparison = TraceComparison(aligner, sink)
+    mismatches = []
+    for _, spike_entry, dut_entry, match in comparison.pairs(align_fragments(aligner, dut_trace)):
+        if not match:
+            mismatches.append(mismatch_entries(spike_entry, dut_entry))
+
+    missing = comparison.missing_entry()
+    if missing is not None:
+        print(f"Comparison of {elf_name} ended before expected (out of dut entries).")
+        mismatches.append(mismatch_entries(missing, EMPTY_ENTRY))
     return mismatches
 
+def first_mismatches(spike_trace, dut_trace, elf_name, max_mismatches=1, context=0, decode_table=rv_decode.RV32I_TABLE, sink=None):
+    """
+    Aligns and compares at the same time, and stops at the `max_mismatches`-th mismatch,
+    plus `context` entries: the time depends on where the DUT diverges, not on the length
+    of the traces. Same alignment and mismatches as generate_final_trace + compare_traces.
+    The traces may be lists or iterators, as in compare_stream.
+
+    Args:
+        max_mismatches (int): Mismatches to find before stopping.
+        context (int): Entries kept before and after the first mismatch.
+        sink: Optional receiver of the final entries aligned before stopping.
+    Returns:
+        dict: "mismatches": {"index", "spike", "dut"} per mismatch, index being the position
+        in the spike trace; "before" and "after": up to `context` {"index", "spike", "dut"}
+        around the first mismatch (matching or not); "stopped": True if the comparison
+        stopped before the end of the traces.
+    """
+    aligner = TraceAligner(spike_trace, elf_name, decode_table)
+    comparison = TraceComparison(aligner, sink)
+    mismatches = []
+    before = collections.deque(maxlen=context)
+    after = []
+    for index, spike_entry, dut_entry, match in comparison.pairs(align_fragments(aligner, dut_trace)):
+        if mismatches and len(after) < context:
+            after.append(dict(mismatch_entries(spike_entry, dut_entry), index=index))
+        if not match:
+            if len(mismatches) < max_mismatches:
+                mismatches.append(dict(mismatch_entries(spike_entry, dut_entry), index=index))
+        elif not mismatches:
+            before.append((index, spike_entry, dut_entry))
+        if len(mismatches) >= max_mismatches and len(after) >= context:
+            break
+
+    before = [dict(mismatch_entries(spike_entry, dut_entry), index=index) for index, spike_entry, dut_entry in before]
+    if len(mismatches) >= max_mismatches and len(after) >= context:
+        return {"mismatches": mismatches, "before": before, "after": after, "stopped": comparison.pending()}
+
+    missing = comparison.missing_entry()
+    if missing is not None and len(mismatches) < max_mismatches:
+        print(f"Comparison of {elf_name} ended before expected (out of dut entries).")
+        mismatches.append(dict(mismatch_entries(missing, EMPTY_ENTRY), index=comparison.index))
+    return {"mismatches": mismatches, "before": before, "after": after, "stopped": False}
+
+class TappedSink:
+    """
+    Append end of a trace table (e.g. trace_format.TableSink) that also keeps the rows
+    appended since the last take, for a LockstepChecker.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.rows = []
+
+    def append(self, row):
+        self.sink.append(row)
+        self.rows.append(row)
+
+    def __len__(self):
+        return len(self.sink)
+
+    def take(self):
+        """The new rows, forgotten here."""
+        rows, self.rows = self.rows, []
+        return rows
+
+class LockstepChecker:
+    """
+    Compares the DUT with the spike trace while it runs (exec_trace.py lockstep mode). The
+    fragments are captured through the sinks returned by tap; check aligns them with the
+    TraceAligner rules and compares them with TraceComparison, so the first mismatch it
+    finds is the first one compare_traces would find on the whole traces.
+
+    Args:
+        spike_entries (iterable): The spike trace entries (see trace_format.iter_entries).
+        elf_name (str): Name used in the messages.
+        context (int): Entries kept before the mismatch, for the report.
+    """
+    def __init__(self, spike_entries, elf_name, context=5, decode_table=rv_decode.RV32I_TABLE):
+        self.elf_name = elf_name
+        self.aligner = TraceAligner(spike_entries, elf_name, decode_table)
+        self.comparison = TraceComparison(self.aligner)
+        self.taps = {}
+        self.before = collections.deque(maxlen=context)
+        self.result = None
+
+    def tap(self, fragment, sink):
+        """A TappedSink for one of the FRAGMENTS lists, appending to `sink` as well."""
+        self.taps[fragment] = TappedSink(sink)
+        return self.taps[fragment]
+
+    def _divergence(self, index, spike_entry, dut_entry, stopped):
+        before = [dict(mismatch_entries(*pair[1:]), index=pair[0]) for pair in self.before]
+        mismatch = dict(mismatch_entries(spike_entry, dut_entry), index=index)
+        return {"mismatches": [mismatch], "before": before, "after": [], "stopped": stopped}
+
+    def check(self):
+        """
+        Align and compare the fragments captured so far.
+
+        Returns:
+            dict: The first mismatch, as returned by first_mismatches (max_mismatches=1),
+            or None if the DUT matches spike so far.
+        """
+        if self.result is not None:
+            return self.result
+        for fragment, tap in self.taps.items():
+            rows = tap.take()
+            if rows:
+                self.aligner.feed(fragment, rows)
+        for index, spike_entry, dut_entry, match in self.comparison.pairs(self.aligner.advance()):
+            if not match:
+                self.result = self._divergence(index, spike_entry, dut_entry, True)
+                break
+            self.before.append((index, spike_entry, dut_entry))
+        return self.result
+
+    def finish(self):
+        """
+        Compare the rest once the DUT has stopped; the spike entries left without a DUT
+        entry are a mismatch, as in compare_traces.
+
+        Returns:
+            dict: The first mismatch, or None if the whole trace matches.
+        """
+        self.check()
+        self.aligner.end()
+        if self.check() is None:
+            missing = self.comparison.missing_entry()
+            if missing is not None:
+                print(f"Comparison of {self.elf_name} ended before expected (out of dut entries).")
+                self.result = self._divergence(self.comparison.index, missing, EMPTY_ENTRY, False)
+        return self.result
+
+def format_entry(entry):
+    """Entry with its addresses and values in hex, for printing."""
+    formatted = {field: entry[field] for field in ENTRY_FIELDS}
+    for field in ("pc", "instr", "reg_val", "mem_addr", "mem_val"):
+        if formatted[field] is not None:
+            formatted[field] = f"0x{formatted[field]:08x}"
+    return formatted
+
+def print_mismatches(elf_name, mismatches):
+    if not mismatches:
+        print("\033[92mNo mismatches found for", elf_name, "\033[0m")
+        return
+    print(f"\033[91mMismatches found for {elf_name}:\033[0m")
+    for mismatch in mismatches:
+        print("Spike entry:\t", format_entry(mismatch["spike"]))
+        print("DUT entry:\t", format_entry(mismatch["dut"]))
+        print()
+
+def format_divergence(elf_name, result):
+    """Lines of the report of a first_mismatches result, with the context around the first mismatch."""
+    mismatches = result["mismatches"]
+    if not mismatches:
+        return ["\033[92mNo mismatches found for " + elf_name + " \033[0m"]
+    first = mismatches[0]["index"]
+    lines = [f"\033[91m{elf_name} diverges at entry {first} (pc {format_entry(mismatches[0]['spike'])['pc']}):\033[0m"]
+    for pair in result["before"] + [mismatches[0]] + result["after"]:
+        marker = ">>" if pair["index"] == first else ("!=" if pair["spike"] != pair["dut"] else "  ")
+        lines.append(f"{marker} {pair['index']:>8} Spike entry:\t {format_entry(pair['spike'])}")
+        lines.append(f"{marker} {pair['index']:>8} DUT entry:\t {format_entry(pair['dut'])}")
+    if len(mismatches) > 1:
+        lines.append(f"\033[91mNext mismatches of {elf_name}:\033[0m")
+        for mismatch in mismatches[1:]:
+            lines.append(f"   {mismatch['index']:>8} Spike entry:\t {format_entry(mismatch['spike'])}")
+            lines.append(f"   {mismatch['index']:>8} DUT entry:\t {format_entry(mismatch['dut'])}")
+    if result["stopped"]:
+        lines.append(f"Comparison of {elf_name} stopped after {len(mismatches)} mismatch(es).")
+    return lines
+
+def print_divergence(elf_name, result):
+    """Prints the result of first_mismatches, with the context around the first mismatch."""
+    lines = format_divergence(elf_name, result)
+    print("\n".join(lines))
+    if result["mismatches"]:
+        print()
+
+def compare_elf(spike_path, dut_path, elf_name, output_folder=None, trace_output_format="binary", max_mismatches=0, context=5):
+    """
+    Aligns and compares the traces of one ELF and prints the mismatches, in a single pass
+    over the trace files, writing the final trace on the way if there is an output folder.
+    A final trace already saved is compared as is (compare_final_elf).
+
+    Args:
+        max_mismatches (int): Stop after this many mismatches (first_mismatches), 0 to
+            compare everything (compare_stream).
+        context (int): With max_mismatches, entries shown around the first mismatch.
+    Returns:
+        dict: Summary: elf, status ("passed" or "mismatch"), mismatches (their number),
+        first_pc and first_index (pc and spike entry of the first mismatch, None if they
+        match or unknown), instructions (spike entries read) and timings (stage -> seconds,
+        see metrics).
+    """
+    if is_final_trace(dut_path):
+        return compare_final_elf(spike_path, dut_path, elf_name, max_mismatches)
+
+    spike_count = itertools.count() # advanced by every spike entry read
+    spike_entries = (entry for entry, _ in zip(read_entries(spike_path), spike_count))
+    dut_trace = read_fragments(dut_path)
+
+    sink = None
+    if output_folder:
+        final_path = trace_format.trace_path(output_folder, elf_name, "final", trace_output_format)
+        sink = trace_format.EntryWriter(final_path, trace_format.KIND_FINAL, trace_output_format)
+
+    timings = {}
+    with metrics.Stage("compare", elf_name, timings) as stage:
+        try:
+            if max_mismatches:
+                # the alignment stops at the divergence, so does the final trace
+                result = first_mismatches(spike_entries, dut_trace, elf_name, max_mismatches, context, sink=sink)
+                print_divergence(elf_name, result)
+                mismatches = result["mismatches"]
+            else:
+                mismatches = compare_stream(spike_entries, dut_trace, elf_name, sink)
+                print_mismatches(elf_name, mismatches)
+        finally:
+            if sink is not None:
+                sink.close()
+        instructions = next(spike_count)
+        stage.count("instructions", instructions)
+        stage.count("mismatches", len(mismatches))
+    if output_folder:
+        trace_index.build_index_if_binary(final_path)
+    return {
+        "elf": elf_name,
+        "status": "mismatch" if mismatches else "passed",
+        "mismatches": len(mismatches),
+        "first_pc": mismatches[0]["spike"]["pc"] if mismatches else None,
+        "first_index": mismatches[0].get("index") if mismatches else None,
+        "instructions": instructions,
+        "timings": timings,
+    }
+
+def compare_final_elf(spike_path, final_path, elf_name, max_mismatches=0):
+    """
+    Compares a spike trace with a final trace already saved, with compare_columns over the
+    memory-mapped columns, and prints the mismatches (the first `max_mismatches`, or all).
+
+    Returns:
+        dict: Summary, as compare_elf.
+    """
+    timings = {}
+    with metrics.Stage("compare", elf_name, timings) as stage:
+        spike_columns = trace_columns(spike_path)
+        dut_columns = trace_columns(final_path)
+        result = compare_columns(spike_columns, dut_columns)
+        if result["out_of_dut_entries"]:
+            print(f"Comparison of {elf_name} ended before expected (out of dut entries).")
+        mismatches = column_mismatches(spike_columns, dut_columns, result, max_mismatches or None)
+        print_mismatches(elf_name, mismatches)
+        count = len(result["indices"])
+        if count > len(mismatches):
+            print(f"Comparison of {elf_name} shows {len(mismatches)} of {count} mismatch(es).")
+        instructions = len(spike_columns["pc"][0])
+        stage.count("instructions", instructions)
+        stage.count("mismatches", count)
+    return {
+        "elf": elf_name,
+        "status": "mismatch" if count else "passed",
+        "mismatches": count,
+        "first_pc": mismatches[0]["spike"]["pc"] if mismatches else None,
+        "first_index": int(result["indices"][0]) if count else None,
+        "instructions": instructions,
+        "timings": timings,
+    }
+
+REPORT_LIMIT = 1 << 16 # characters of the output of a comparison kept for its report
+
+class ReportBuffer(io.TextIOBase):
+    """
+    Output of a comparison kept for its report: the lines of its first `limit` characters,
+    then only the number of lines left out, so that a comparison with millions of
+    mismatches does not hold (or send back from its worker) their whole text.
+
+    Args:
+        echo (file): Also written there as it comes (streamed to stdout), if given.
+    """
+    def __init__(self, limit=REPORT_LIMIT, echo=None):
+        self.limit = limit
+        self.echo = echo
+        self.parts = []
+        self.size = 0
+        self.left_out = None # lines left out, once the limit is reached
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if self.echo is not None:
+            self.echo.write(text)
+        if self.left_out is not None:
+            self.left_out += text.count("\n")
+        elif self.size + len(text) <= self.limit:
+            self.parts.append(text)
+            self.size += len(text)
+        else:
+            report = "".join(self.parts) + text
+            cut = report.rfind("\n", 0, self.limit) + 1 # whole lines only
+            self.parts = [report[:cut]]
+            self.size = cut
+            self.left_out = report.count("\n", cut)
+        return len(text)
+
+    def flush(self):
+        if self.echo is not None:
+            self.echo.flush()
+
+    def getvalue(self):
+        report = "".join(self.parts)
+        if self.left_out:
+            report += f"... {self.left_out} more line(s) of the comparison left out of this report\n"
+        return report
+
+def compare_job(spike_path, dut_path, elf_name, output_folder=None, trace_output_format="binary", max_mismatches=0, context=5, stream=False):
+    """
+    Runs compare_elf in a worker process: what it prints is returned instead (up to
+    REPORT_LIMIT characters, see ReportBuffer), and errors are reported in the summary
+    instead of raised. The result is added to the results database (see record_comparison).
+
+    Args:
+        stream (bool): Also print the output as it comes, for a single comparison in the
+            main process.
+    Returns:
+        dict: The summary of compare_elf (status "error" and a message if it failed), plus
+        output (the printed text, capped) and seconds.
+    """
+    start = time.time()
+    output = ReportBuffer(echo=sys.stdout if stream else None)
+    with contextlib.redirect_stdout(output):
+        try:
+            summary = compare_elf(spike_path, dut_path, elf_name, output_folder, trace_output_format, max_mismatches, context)
+        except Exception as e:
+            summary = {"elf": elf_name, "status": "error", "message": f"{type(e).__name__}: {e}", "mismatches": 0, "first_pc": None}
+    summary["output"] = output.getvalue()
+    summary["seconds"] = time.time() - start
+    record_comparison(spike_path, dut_path, summary)
+    return summary
+
+def record_comparison(spike_path, dut_path, summary):
+    """
+    Adds the summary of a comparison to the results database (see results_db). The inputs
+    are the two traces (inputs_digest), the processor is the one in the DUT trace metadata.
+    """
+    if results_db.database_path() is None:
+        return # not recorded, do not hash the traces
+    processor = inputs_digest = None
+    try:
+        inputs_digest = cache_utils.text_digest(cache_utils.file_digest(spike_path), cache_utils.file_digest(dut_path))
+        if trace_format.is_binary_trace(dut_path):
+            with trace_format.TraceReader(dut_path) as reader:
+                processor = reader.metadata.get("processor")
+    except (OSError, ValueError):
+        pass # missing or unreadable trace, the summary says so
+    results_db.record_run("compare_traces", summary["elf"], summary["status"], processor=processor,
+                          inputs_digest=inputs_digest, message=summary.get("message"),
+                          mismatches=summary["mismatches"], first_index=summary.get("first_index"),
+                          first_pc=summary["first_pc"], instructions=summary.get("instructions"),
+                          seconds=summary["seconds"], timings=summary.get("timings") or {"compare": summary["seconds"]})
+
+def trace_pairs(spike_dir, dut_dir):
+    """
+    The (elf name, spike trace, fragmented trace) of every spike trace of a folder, sorted;
+    a saved final trace is used if there is no fragmented trace, and None if there is neither. A binary and a JSON spike trace
+    of the same ELF may coexist, only one is listed.
+    """
+    pairs = []
+    for spike_file in sorted(os.listdir(spike_dir)):
+        elf_name, stage = trace_format.split_trace_name(spike_file)
+        if stage == "spike" and trace_format.find_trace(spike_dir, elf_name, "spike") == os.path.join(spike_dir, spike_file):
+            dut_path = trace_format.find_trace(dut_dir, elf_name, "fragmented") or trace_format.find_trace(dut_dir, elf_name, "final")
+            pairs.append((elf_name, os.path.join(spike_dir, spike_file), dut_path))
+    return pairs
+
+def compare_directories(spike_dir, dut_dir, output_folder=None, trace_output_format="binary", max_mismatches=0, context=5, jobs=1):
+    """
+    Compares every pair of traces of two folders (see trace_pairs) with compare_job, `jobs`
+    at a time in worker processes. The output of each comparison (capped, see ReportBuffer)
+    is printed as a whole when it is over, so the outputs of parallel comparisons do not mix.
+
+    Returns:
+        list: The summaries of compare_job, sorted by ELF name, with status "error" for the
+        ELFs without a fragmented trace.
+    """
+    results = []
+    pairs = trace_pairs(spike_dir, dut_dir)
+
+    def report(result):
+        result["report"] = result.pop("output")
+        print(result["report"], end="", flush=True)
+        results.append(result)
+
+    runnable = []
+    for elf_name, spike_path, dut_path in pairs:
+        if dut_path is None:
+            missing = trace_format.trace_path(dut_dir, elf_name, "fragmented")
+            print(f"DUT trace file not found: {missing}")
+            results.append({"elf": elf_name, "status": "error", "message": f"DUT trace file not found: {missing}",
+                            "mismatches": 0, "first_pc": None, "seconds": 0.0})
+        else:
+            runnable.append((spike_path, dut_path, elf_name, output_folder, trace_output_format, max_mismatches, context))
+
+    if jobs <= 1:
+        for job in runnable:
+            report(compare_job(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for future in as_completed([executor.submit(compare_job, *job) for job in runnable]):
+                report(future.result())
+    return sorted(results, key=lambda result: result["elf"])
+
+ANSI_ESCAPE_RE = re.compile(r"\033\[[0-9;]*m")
+JUNIT_REPORT_LIMIT = 1 << 13 # characters of a report in a JUnit failure
+
+def write_summary(path, results, seconds):
+    """
+    Writes the results of compare_directories (or of one compare_job) as JSON: totals, and
+    per test the status, the number of mismatches, the pc of the first one and the time.
+    """
+    summary = {
+        "tests": len(results),
+        "passed": sum(1 for result in results if result["status"] == "passed"),
+        "failed": sum(1 for result in results if result["status"] == "mismatch"),
+        "errors": sum(1 for result in results if result["status"] == "error"),
+        "seconds": seconds,
+        "results": [{key: result.get(key) for key in ("elf", "status", "mismatches", "first_pc", "seconds", "message")}
+                    for result in results],
+    }
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+def write_junit(path, results, seconds, suite_name="ntv"):
+    """
+    Writes the results of compare_directories as a JUnit XML report, one test case per ELF:
+    a failure for mismatches (with the start of the report, without colors), an error for
+    the others.
+    """
+    suite = ElementTree.Element("testsuite", name=suite_name, tests=str(len(results)),
+                                failures=str(sum(1 for result in results if result["status"] == "mismatch")),
+                                errors=str(sum(1 for result in results if result["status"] == "error")),
+                                time=f"{seconds:.3f}")
+    for result in results:
+        case = ElementTree.SubElement(suite, "testcase", classname=suite_name, name=result["elf"], time=f"{result['seconds']:.3f}")
+        if result["status"] == "mismatch":
+            failure = ElementTree.SubElement(case, "failure", message=f"{result['mismatches']} mismatch(es), first at pc 0x{result['first_pc']:08x}")
+            report = ANSI_ESCAPE_RE.sub("", result.get("report", ""))
+            if len(report) > JUNIT_REPORT_LIMIT:
+                report = report[:report.rfind("\n", 0, JUNIT_REPORT_LIMIT) + 1] + "... (report truncated)\n"
+            failure.text = report
+        elif result["status"] != "passed":
+            ElementTree.SubElement(case, "error", message=result.get("message", ""))
+    ElementTree.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Generate a final DUT trace and then compare it to spike's trace")
@@ -360,11 +1079,23 @@ if __name__ == "__main__":
     group1.add_argument("--spike-trace-dir", "-S", type=str, help="Path to the Spike trace folder (uppercase mode)")
     
     group2 = parser.add_mutually_exclusive_group(required=True)
-    group2.add_argument("--dut-trace", "-d", type=str, help="Path to the DUT's fragmented trace file (lowercase mode)")
+    group2.add_argument("--dut-trace", "-d", type=str, help="Path to the DUT's fragmented trace file, or to a final trace already saved (lowercase mode)")
     group2.add_argument("--dut-trace-dir", "-D", type=str, help="Path to the DUT's fragmented trace file (uppercase mode)")
     
-    parser.add_argument("--output-folder", "-o", type=str, required=False, help="Folder to save the final speculative DUT trace")
+    parser.add_argument("--output-folder", "-o", type=str, required=False, help="Folder to save the final speculative DUT trace (not written if omitted)")
+    parser.add_argument("--format", "-F", type=str, choices=["binary", "json"], default="binary", help="Final trace format (default: binary, JSON for export)")
+    parser.add_argument("--max-mismatches", type=int, default=0, help="Stop aligning and comparing after N mismatches; the final trace stops there too (default: 0, compare everything)")
+    parser.add_argument("--first-divergence", action="store_true", help="Stop at the first mismatch and show the entries around it (same as --max-mismatches 1)")
+    parser.add_argument("--context", type=int, default=5, help="Entries shown before and after the first mismatch with --max-mismatches or --first-divergence (default: 5)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of trace pairs compared in parallel with -S/-D (default: 1)")
+    parser.add_argument("--summary", type=str, help="Write the results (status, mismatches, first mismatch pc, time per test) to this JSON file")
+    parser.add_argument("--junit", type=str, help="Write the results to this JUnit XML file")
+    parser.add_argument("--metrics", type=str, help="Append the wall time, CPU time, peak RSS and counts of every stage to this JSON lines file (see metrics.py)")
+    parser.add_argument("--profile", action="store_true", help="Run every stage under cProfile and write <elf>.<stage>.prof next to the final traces (-o), or else the DUT traces")
+    parser.add_argument("--results-db", type=str, help="Record the result of every comparison in this SQLite database (see results_db.py)")
     args = parser.parse_args()
+    if args.first_divergence:
+        args.max_mismatches = args.max_mismatches or 1
     
     # Validate that both arguments are from the same group (both lowercase or both uppercase)
     lowercase_used = args.spike_trace is not None and args.dut_trace is not None
@@ -372,122 +1103,34 @@ if __name__ == "__main__":
 
     if not (lowercase_used or uppercase_used):
         parser.error("You must use either both lowercase options for single file (-s and -d) or both uppercase options for folders (-S and -D)")
+
+    profile_dir = args.output_folder or args.dut_trace_dir or os.path.dirname(os.path.abspath(args.dut_trace))
+    metrics.enable(args.metrics, profile_dir if args.profile else None) # before the worker processes start
+    results_db.enable(args.results_db)
     
+    start = time.time()
     if lowercase_used:
-        with open(args.spike_trace, "r") as f:
-            spike_trace = json.load(f)
-        with open(args.dut_trace, "r") as f:
-            dut_trace = json.load(f)
-
         basename = os.path.basename(args.spike_trace)
         elf_name = basename.split(".")[0]
-        dut_final_trace = generate_final_trace(spike_trace, dut_trace, elf_name)
+        result = compare_job(args.spike_trace, args.dut_trace, elf_name, args.output_folder, args.format, args.max_mismatches, args.context,
+                             stream=True)
+        result["report"] = result.pop("output") # already printed
+        if result["status"] == "error":
+            print(f"Comparison of {elf_name} failed: {result['message']}")
+        results = [result]
 
-        basename = os.path.basename(args.spike_trace)
-        elf_name = basename.split(".")[0]
-        with open(f"{args.output_folder}/{elf_name}.final.json", "w") as f:
-            json.dump(dut_final_trace, f, indent=2)
-
-        mismatches = compare_traces(spike_trace, dut_final_trace, elf_name)
-
-        if mismatches:
-            print(f"\033[91mMismatches found for {elf_name}:\033[0m")
-            for mismatch in mismatches:
-                
-                # Format spike entry with hex values
-                spike_formatted = mismatch["spike"].copy()
-                if spike_formatted["pc"] is not None:
-                    spike_formatted["pc"] = f"0x{spike_formatted['pc']:08x}"
-                if spike_formatted["instr"] is not None:
-                    spike_formatted["instr"] = f"0x{spike_formatted['instr']:08x}"
-                if spike_formatted["reg_val"] is not None:
-                    spike_formatted["reg_val"] = f"0x{spike_formatted['reg_val']:08x}"
-                if spike_formatted["mem_addr"] is not None:
-                    spike_formatted["mem_addr"] = f"0x{spike_formatted['mem_addr']:08x}"
-                if spike_formatted["mem_val"] is not None:
-                    spike_formatted["mem_val"] = f"0x{spike_formatted['mem_val']:08x}"
-                
-                # Format DUT entry with hex values
-                dut_formatted = mismatch["dut"].copy()
-                if dut_formatted["pc"] is not None:
-                    dut_formatted["pc"] = f"0x{dut_formatted['pc']:08x}"
-                if dut_formatted["instr"] is not None:
-                    dut_formatted["instr"] = f"0x{dut_formatted['instr']:08x}"
-                if dut_formatted["reg_val"] is not None:
-                    dut_formatted["reg_val"] = f"0x{dut_formatted['reg_val']:08x}"
-                if dut_formatted["mem_addr"] is not None:
-                    dut_formatted["mem_addr"] = f"0x{dut_formatted['mem_addr']:08x}"
-                if dut_formatted["mem_val"] is not None:
-                    dut_formatted["mem_val"] = f"0x{dut_formatted['mem_val']:08x}"
-                
-                print("Spike entry:\t", spike_formatted)
-                print("DUT entry:\t", dut_formatted)
-                print()
-            
-        else:
-            print("\033[92mNo mismatches found for", elf_name, "\033[0m")
-            
     else:
-        spike_files = sorted(os.listdir(args.spike_trace_dir))
-        if not spike_files:
+        if not os.listdir(args.spike_trace_dir):
             print(f"No files found in spike trace directory: {args.spike_trace_dir}")
             exit(1)
-        
-        for spike_file in spike_files:
-            if spike_file.endswith(".spike.json"):
-                elf_name = spike_file.split(".")[0]
-                spike_path = os.path.join(args.spike_trace_dir, spike_file)
-                dut_path = os.path.join(args.dut_trace_dir, f"{elf_name}.fragmented.json")
-                if not os.path.exists(dut_path):
-                    print(f"DUT trace file not found: {dut_path}")
-                    continue
-
-                with open(spike_path, "r") as f:
-                    spike_trace = json.load(f)
-                with open(dut_path, "r") as f:
-                    dut_trace = json.load(f)
-                
-                dut_final_trace = generate_final_trace(spike_trace, dut_trace, elf_name)
-
-                with open(f"{args.output_folder}/{elf_name}.final.json", "w") as f:
-                    json.dump(dut_final_trace, f, indent=2)
-
-                mismatches = compare_traces(spike_trace, dut_final_trace, elf_name)
-
-                if mismatches:
-                    print(f"\033[91mMismatches found for {elf_name}:\033[0m")
-                    for mismatch in mismatches:
-                        
-                        # Format spike entry with hex values
-                        spike_formatted = mismatch["spike"].copy()
-                        if spike_formatted["pc"] is not None:
-                            spike_formatted["pc"] = f"0x{spike_formatted['pc']:08x}"
-                        if spike_formatted["instr"] is not None:
-                            spike_formatted["instr"] = f"0x{spike_formatted['instr']:08x}"
-                        if spike_formatted["reg_val"] is not None:
-                            spike_formatted["reg_val"] = f"0x{spike_formatted['reg_val']:08x}"
-                        if spike_formatted["mem_addr"] is not None:
-                            spike_formatted["mem_addr"] = f"0x{spike_formatted['mem_addr']:08x}"
-                        if spike_formatted["mem_val"] is not None:
-                            spike_formatted["mem_val"] = f"0x{spike_formatted['mem_val']:08x}"
-                        
-                        # Format DUT entry with hex values
-                        dut_formatted = mismatch["dut"].copy()
-                        if dut_formatted["pc"] is not None:
-                            dut_formatted["pc"] = f"0x{dut_formatted['pc']:08x}"
-                        if dut_formatted["instr"] is not None:
-                            dut_formatted["instr"] = f"0x{dut_formatted['instr']:08x}"
-                        if dut_formatted["reg_val"] is not None:
-                            dut_formatted["reg_val"] = f"0x{dut_formatted['reg_val']:08x}"
-                        if dut_formatted["mem_addr"] is not None:
-                            dut_formatted["mem_addr"] = f"0x{dut_formatted['mem_addr']:08x}"
-                        if dut_formatted["mem_val"] is not None:
-                            dut_formatted["mem_val"] = f"0x{dut_formatted['mem_val']:08x}"
-                        
-                        print("Spike entry:\t", spike_formatted)
-                        print("DUT entry:\t", dut_formatted)
-                        print()
-                
-                else:
-                    print("\033[92mNo mismatches found for", elf_name, "\033[0m")
+        results = compare_directories(args.spike_trace_dir, args.dut_trace_dir, args.output_folder, args.format,
+                                      args.max_mismatches, args.context, args.jobs)
+        failed = [result for result in results if result["status"] != "passed"]
+        print(f"{len(results) - len(failed)}/{len(results)} traces match ({time.time() - start:.1f}s)")
 
+    if args.summary:
+        write_summary(args.summary, results, time.time() - start)
+    if args.junit:
+        write_junit(args.junit, results, time.time() - start)
+    if any(result["status"] != "passed" for result in results):
+        exit(1)
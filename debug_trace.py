@@ -0,0 +1,101 @@
+# This module contains the debug trace of the exec_trace.py testbench: the signals of
+# interest of the memory interfaces, recorded every cycle in a ring buffer and written
+# to the log only when something went wrong (or when asked to)
+
+import collections
+import signal
+
+# Verbosity levels
+DEBUG_OFF = 0   # nothing is recorded
+DEBUG_RING = 1  # the last cycles are kept in memory and dumped on timeout, error or SIGUSR1
+DEBUG_FULL = 2  # every cycle is logged, as the testbench used to do
+
+DEFAULT_DEBUG_DEPTH = 64 # cycles kept in the ring buffer
+
+# (label, handle name, format) of the signals of interest
+SINGLE_MEMORY_SIGNALS = [
+    ("CORE_STB", "core_stb", "%s"),
+    ("CORE_ACK", "core_ack", "%s"),
+    ("CORE_ADDR", "core_addr", "%x"),
+    ("CORE_DATA_IN", "core_data_in", "%x"),
+    ("CORE_WE", "core_we", "%s"),
+    ("CORE_DATA_OUT", "core_data_out", "%s"),
+    ("CORE_SEL", "core_sel", "%s"),
+]
+TWO_MEMORIES_SIGNALS = [
+    ("CORE_STB", "core_stb", "%s"),
+    ("CORE_ACK", "core_ack", "%s"),
+    ("CORE_ADDR", "core_addr", "%x"),
+    ("CORE_DATA_IN", "core_data_in", "%x"),
+    ("CORE_DATA_OUT", "core_data_out", "%s"),
+    ("DATA_MEM_STB", "data_mem_stb", "%s"),
+    ("DATA_MEM_ACK", "data_mem_ack", "%s"),
+    ("DATA_MEM_ADDR", "data_mem_addr", "%s"),
+    ("DATA_MEM_DATA_IN", "data_mem_data_in", "%s"),
+    ("DATA_MEM_WE", "data_mem_we", "%s"),
+    ("DATA_MEM_DATA_OUT", "data_mem_data_out", "%s"),
+    ("DATA_MEM_SEL", "data_mem_sel", "%s"),
+]
+
+class DebugTrace:
+    """
+    Records the signals of interest once per cycle. Recording only copies the signal
+    values into a fixed-size deque; the formatting and logging happen in dump().
+
+    Args:
+        dut: cocotb handle of the top-level.
+        two_memories (bool): The DUT has separate instruction and data memory interfaces.
+        level (int): DEBUG_OFF, DEBUG_RING or DEBUG_FULL.
+        depth (int): Number of cycles kept by DEBUG_RING.
+    """
+    def __init__(self, dut, two_memories, level=DEBUG_RING, depth=DEFAULT_DEBUG_DEPTH):
+        self.log = dut._log
+        self.level = level
+        signals = TWO_MEMORIES_SIGNALS if two_memories else SINGLE_MEMORY_SIGNALS
+        self.labels = [(label, fmt) for label, _, fmt in signals]
+        self.handles = [getattr(dut, name) for _, name, _ in signals] if level != DEBUG_OFF else []
+        self.buffer = collections.deque(maxlen=max(depth, 1))
+        self.requested = False
+        if level == DEBUG_RING and hasattr(signal, "SIGUSR1"):
+            try: # `kill -USR1 <simulator pid>` dumps the buffer at the next cycle
+                signal.signal(signal.SIGUSR1, self._request)
+            except ValueError: # not the main thread
+                pass
+
+    def _request(self, signum, frame):
+        self.requested = True
+
+    def record(self, cycle):
+        """Record the signals of interest at `cycle`."""
+        if self.level == DEBUG_OFF:
+            return
+        values = [handle.value for handle in self.handles]
+        if self.level == DEBUG_FULL:
+            self._log_cycle(cycle, values)
+            return
+        self.buffer.append((cycle, values))
+        if self.requested:
+            self.requested = False
+            self.dump("requested")
+
+    def clear(self):
+        """Forget the recorded cycles (a new program starts)."""
+        self.buffer.clear()
+
+    def dump(self, reason):
+        """Log the recorded cycles, oldest first."""
+        if not self.buffer:
+            return
+        self.log.info("Debug trace (%s): last %d cycles", reason, len(self.buffer))
+        for cycle, values in self.buffer:
+            self._log_cycle(cycle, values)
+
+    def _log_cycle(self, cycle, values):
+        self.log.info("Cycle %d", cycle)
+        for (label, fmt), value in zip(self.labels, values):
+            try:
+                text = fmt % value
+            except (TypeError, ValueError): # unresolved bits (x, z) cannot be printed as hex
+                text = str(value)
+            self.log.info("%s=%s", label, text)
+        self.log.info("")
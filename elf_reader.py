@@ -1,67 +1,126 @@
+import os
+import pickle
+
 from elftools.elf.elffile import ELFFile
 
-def load_memory(memory_size, filename="program.elf"):
+import cache_utils
+import sparse_memory
+
+IMAGE_CACHE_VERSION = 1 # bump when ProgramImage changes
+
+class ProgramImage:
     """
-    Load the memory contents from the .text and .data sections of an ELF file.
-    Args:
-        filename (str): Path to the ELF file.
-    Returns:
-        list: A list of integers representing the memory contents. Each word is 4 bytes.
+    What the testbench needs from an ELF file, read in a single pass.
+
+    Attributes:
+        segments (list): (address, bytes) of every loadable segment, the zero-filled part
+            (.bss) included.
+        text_start, text_end (int): Bounds of the .text (or .text.init) section.
+        tohost (int): Address of the 'tohost' symbol.
+        entry (int): Entry point.
     """
-    memory = [0x13] * memory_size # nop
+    def __init__(self, segments, text_start, text_end, tohost, entry):
+        self.segments = segments
+        self.text_start = text_start
+        self.text_end = text_end
+        self.tohost = tohost
+        self.entry = entry
+
+    def memory(self, fill_word=sparse_memory.DEFAULT_FILL_WORD):
+        """
+        A new memory with the segments at their addresses.
+        Args:
+            fill_word (int): Contents of the rest of the memory, repeated every 4 bytes. Defaults to nop.
+        Returns:
+            SparseMemory: The memory.
+        """
+        memory = sparse_memory.SparseMemory(fill_word)
+        for address, data in self.segments:
+            memory.load(address, data)
+        return memory
+
+def read_program(filename="program.elf"):
+    """
+    Parse an ELF file into a ProgramImage, opening it once.
 
+    The PT_LOAD segments are loaded at their physical address, as spike does. Files without
+    program headers fall back to the .text (or .text.init) and .data sections.
+    """
     with open(filename, 'rb') as file:
         elffile = ELFFile(file)
 
-        text_section = elffile.get_section_by_name('.text')
-        textinit_section = elffile.get_section_by_name('.text.init')
-
-        if not text_section and not textinit_section:
+        text_section = elffile.get_section_by_name('.text') or elffile.get_section_by_name('.text.init')
+        if not text_section:
             raise ValueError("No .text nor .text.init section found in the ELF file.")
 
-        text_data = text_section.data() if text_section else textinit_section.data()
-        text_start_address = text_section['sh_addr'] if text_section else textinit_section['sh_addr']
-
-        pointer = (text_start_address % memory_size) // 4
-        for i in range(0, len(text_data), 4):
-            word = text_data[i:i+4]
-            if len(word) < 4:
-                word = word.ljust(4, b'\x00')
-            memory[pointer] = int.from_bytes(word, byteorder='little')
-            pointer += 1
-
-        data_section = elffile.get_section_by_name('.data')
-        if data_section:
-            data_data = data_section.data()
-            data_start_address = data_section['sh_addr']
-            pointer = (data_start_address % memory_size) // 4
-            for i in range(0, len(data_data), 4):
-                word = data_data[i:i+4]
-                if len(word) < 4:
-                    word = word.ljust(4, b'\x00')
-                memory[pointer] = int.from_bytes(word, byteorder='little')
-                pointer += 1
-
-    return memory
-
-def load_data_memory(memory_size, filename="program.elf"):
-    data_memory = [0x13] * memory_size # nop
-    with open(filename, 'rb') as file:
-        elffile = ELFFile(file)
+        symtab = elffile.get_section_by_name('.symtab')
+        if not symtab:
+            raise ValueError("No symbol table found in the ELF file.")
+        tohost_symbol = symtab.get_symbol_by_name('tohost')
+        if not tohost_symbol:
+            raise ValueError("Symbol 'tohost' not found in the ELF file.")
 
-        data_section = elffile.get_section_by_name('.data')
-        if data_section:
-            data_data = data_section.data()
-            data_start_address = data_section['sh_addr']
-            pointer = (data_start_address % memory_size) // 4
-            for i in range(0, len(data_data), 4):
-                word = data_data[i:i+4]
-                if len(word) < 4:
-                    word = word.ljust(4, b'\x00')
-                data_memory[pointer] = int.from_bytes(word, byteorder='little')
-                pointer += 1
+        segments = []
+        for segment in elffile.iter_segments():
+            if segment['p_type'] == 'PT_LOAD' and segment['p_memsz']:
+                data = segment.data()
+                segments.append((segment['p_paddr'], data + bytes(segment['p_memsz'] - len(data))))
+        if not segments:
+            sections = [text_section, elffile.get_section_by_name('.data')]
+            segments = [(section['sh_addr'], section.data()) for section in sections if section]
+        # the last word is zero padded
+        segments = [(address, data + bytes(-len(data) % 4)) for address, data in segments]
+
+        return ProgramImage(segments, text_section['sh_addr'], text_section['sh_addr'] + text_section['sh_size'],
+                            tohost_symbol[0]['st_value'], elffile['e_entry'])
+
+def load_program(filename="program.elf"):
+    """
+    Same as read_program, through the on-disk cache of program images (see cache_utils),
+    keyed by the SHA-256 of the ELF file: an ELF already seen is loaded without pyelftools.
+    The least recently used images are evicted as in the spike trace cache.
+    """
+    directory = cache_utils.cache_dir("elf")
+    if directory is None:
+        return read_program(filename)
+
+    cache_file = os.path.join(directory, f"{cache_utils.file_digest(filename)}.pickle")
+    try:
+        with open(cache_file, "rb") as f:
+            version, image = pickle.load(f)
+        if version == IMAGE_CACHE_VERSION:
+            cache_utils.touch(cache_file)
+            return image
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+        pass # not cached yet, or unreadable
+
+    image = read_program(filename)
+    try:
+        cache_utils.atomic_write(cache_file, pickle.dumps((IMAGE_CACHE_VERSION, image)))
+        cache_utils.evict(directory, cache_utils.max_cache_bytes())
+    except OSError:
+        pass # read-only cache, nothing saved
+    return image
+
+def load_memory(memory_size=None, filename="program.elf", fill_word=sparse_memory.DEFAULT_FILL_WORD):
+    """
+    Load the memory contents from the loadable segments of an ELF file.
+    Args:
+        memory_size (int): Ignored, kept for the callers of the list memory: the sparse
+            memory covers the whole address space.
+        filename (str): Path to the ELF file.
+        fill_word (int): Contents of the rest of the memory, repeated every 4 bytes. Defaults to nop.
+    Returns:
+        SparseMemory: The memory, with the segments at their addresses.
+    """
+    return load_program(filename).memory(fill_word)
 
-    return data_memory
+def load_data_memory(memory_size=None, filename="program.elf", fill_word=sparse_memory.DEFAULT_FILL_WORD):
+    """
+    Load the data memory of the two-ported model: a memory of its own, with the same
+    contents as load_memory (the loadable segments).
+    """
+    return load_memory(memory_size, filename, fill_word)
 
 def get_tohost_address(filename="program.elf"):
     """
@@ -71,34 +130,11 @@ def get_tohost_address(filename="program.elf"):
     Returns:
         int: The address of the 'tohost' symbol.
     """
-    with open(filename, 'rb') as file:
-        elffile = ELFFile(file)
-
-        symtab = elffile.get_section_by_name('.symtab')
-        if not symtab:
-            raise ValueError("No symbol table found in the ELF file.")
-
-        tohost_symbol = symtab.get_symbol_by_name('tohost')
-        if not tohost_symbol:
-            raise ValueError("Symbol 'tohost' not found in the ELF file.")
-
-        tohost_addr = tohost_symbol[0]['st_value']
-        return tohost_addr
+    return load_program(filename).tohost
 
 def get_text_section_addr(filename="program.elf"):
     """
-    Get the end address of the .text or .text.init section in the ELF file.
+    Get the start and end addresses of the .text or .text.init section in the ELF file.
     """
-    with open(filename, 'rb') as file:
-        elffile = ELFFile(file)
-
-        text_section = elffile.get_section_by_name('.text')
-        textinit_section = elffile.get_section_by_name('.text.init')
-        if text_section:
-            start = text_section['sh_addr']
-            end = text_section['sh_addr'] + text_section['sh_size']
-        elif textinit_section:
-            start = textinit_section['sh_addr']
-            end = textinit_section['sh_addr'] + textinit_section['sh_size']
-
-    return start, end
\ No newline at end of file
+    image = load_program(filename)
+    return image.text_start, image.text_end
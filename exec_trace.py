@@ -18,178 +18,142 @@ import os, time
 import json
 import argparse
 import subprocess
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 # custom functions
+import cache_utils
 import elf_reader
+import compare_traces
 import config_loader
+import trace_format
+import trace_index
+import debug_trace
+import metrics
+import regfile_monitor
+import results_db
+import sparse_memory
 
 # Simulation parameters
-MEM_SIZE = 524288 # 512K words of 4 bytes = 1024KB
 SIMULATION_TIMEOUT_CYCLES = 60000
+TRACE_FLUSH_CYCLES = 1024 # cycles of the fragmented trace lost at most if the simulator crashes
+LOCKSTEP_CHECK_CYCLES = 64 # cycles between two comparisons with spike in lockstep mode
 
 
+# Byte lanes written for each value of the 4-bit write strobe (sel), lane 0 in bit 0
+STROBE_MASKS = tuple(sum(0xFF << (8 * lane) for lane in range(4) if sel >> lane & 1) for sel in range(16))
+
+def store(dut, memory, address, data, sel):
+    """
+    Writes the byte lanes of `data` selected by the write strobe handle `sel`.
+
+    Returns:
+        int: The new word, or None if no lane is written.
+    """
+    try:
+        mask = STROBE_MASKS[sel.value.integer & 0xF]
+    except ValueError:
+        dut._log.warning("Unresolved write strobe %s at 0x%08x, store ignored", sel.value, address)
+        return None
+    if not mask:
+        return None
+    return memory.write_masked(address, data, mask)
+
 async def instruction_memory_model(dut, memory, fetches, start_of_text_section, end_of_text_section):
+    clk, rst_n = dut.sys_clk, dut.rst_n
+    cyc, stb, we, ack = dut.core_cyc, dut.core_stb, dut.core_we, dut.core_ack
+    addr, data_in, data_out = dut.core_addr, dut.core_data_in, dut.core_data_out
     while True:
-        await RisingEdge(dut.sys_clk)  
+        await RisingEdge(clk)
         await ReadWrite() # wait for signals to propagate after the clock edge
 
-        if dut.core_cyc.value == 1 and dut.core_stb.value == 1: # active transaction
+        if cyc.value == 1 and stb.value == 1: # active transaction
             
-            raw_addr = dut.core_addr.value.integer
-            simulated_addr = (raw_addr // 4) % MEM_SIZE
+            raw_addr = addr.value.integer
 
-            if dut.core_we == 0:
+            if we.value == 0:
                 # always read data, even for write operations
-                dut.core_data_in.value = memory[simulated_addr] # each position in inst_memory has 4 bytes
+                data_in.value = memory.read_word(raw_addr)
                 
                 # wait for reset release
                 await NextTimeStep()
                 await ReadWrite()
                 # it is only a fetch if it is reading the .text section
-                if dut.rst_n.value == 1 and raw_addr >= start_of_text_section and raw_addr < end_of_text_section:
-                    fetches.append((raw_addr, memory[simulated_addr]))
+                if rst_n.value == 1 and raw_addr >= start_of_text_section and raw_addr < end_of_text_section:
+                    fetches.append((raw_addr, memory.read_word(raw_addr)))
             else:
-                write_value = dut.core_data_out.value.integer
-                memory[simulated_addr] = write_value
+                memory.write_word(raw_addr, data_out.value.integer)
                 dut._log.info("Write to the instruction memory. Possible error.")
   
-            dut.core_ack.value = 1
+            ack.value = 1
         else:
-            dut.core_ack.value = 0
+            ack.value = 0
 
 async def data_memory_model(dut, memory, mem_access, byte_aligned_memory_access):
+    clk = dut.sys_clk
+    cyc, stb, we, sel, ack = dut.data_mem_cyc, dut.data_mem_stb, dut.data_mem_we, dut.data_mem_sel, dut.data_mem_ack
+    addr, data_in, data_out = dut.data_mem_addr, dut.data_mem_data_in, dut.data_mem_data_out
     while True:
-        await RisingEdge(dut.sys_clk)  
+        await RisingEdge(clk)
         await ReadWrite() # wait for signals to propagate after the clock edge
 
-        if dut.data_mem_cyc.value == 1 and dut.data_mem_stb.value == 1: # active transaction
+        if cyc.value == 1 and stb.value == 1: # active transaction
 
-            raw_addr = dut.data_mem_addr.value.integer
-            simulated_addr = (raw_addr // 4) % MEM_SIZE
+            raw_addr = addr.value.integer
 
             # always read data, even for write operations
-            # each position in inst_memory has 4 bytes
             if byte_aligned_memory_access: # lb and lh instructions expect data at LSB
                 shift_amount = (raw_addr % 4) * 8
-                dut.data_mem_data_in.value = memory[simulated_addr] >> shift_amount
+                data_in.value = memory.read_word(raw_addr) >> shift_amount
             else:
-                dut.data_mem_data_in.value = memory[simulated_addr]
+                data_in.value = memory.read_word(raw_addr)
             await NextTimeStep()
             await ReadWrite()
 
-            if dut.data_mem_we == 1:
+            if we.value == 1:
                 # Write operation, depends on write strobe
-                if dut.data_mem_sel.value == "1111":
-                    write_value = dut.data_mem_data_out.value.integer
-                    memory[simulated_addr] = write_value
-                elif dut.data_mem_sel.value == "0011":
-                    write_value = (memory[simulated_addr] & 0xFFFF0000) | (dut.data_mem_data_out.value.integer & 0x0000FFFF)
-                    memory[simulated_addr] = write_value
-                elif dut.data_mem_sel.value == "1100":
-                    write_value = (memory[simulated_addr] & 0x0000FFFF) | (dut.data_mem_data_out.value.integer & 0xFFFF0000)
-                    memory[simulated_addr] = write_value
-                elif dut.data_mem_sel.value == "0001":
-                    write_value = (memory[simulated_addr] & 0xFFFFFF00) | (dut.data_mem_data_out.value.integer & 0x000000FF)
-                    memory[simulated_addr] = write_value
-                elif dut.data_mem_sel.value == "0010":
-                    write_value = (memory[simulated_addr] & 0xFFFF00FF) | (dut.data_mem_data_out.value.integer & 0x0000FF00)
-                    memory[simulated_addr] = write_value
-                elif dut.data_mem_sel.value == "0100":
-                    write_value = (memory[simulated_addr] & 0xFF00FFFF) | (dut.data_mem_data_out.value.integer & 0x00FF0000)
-                    memory[simulated_addr] = write_value
-                elif dut.data_mem_sel.value == "1000":
-                    write_value = (memory[simulated_addr] & 0x00FFFFFF) | (dut.data_mem_data_out.value.integer & 0xFF000000)
-                    memory[simulated_addr] = write_value
-
-                mem_access.append((raw_addr, write_value))
-
-            dut.data_mem_ack.value = 1
+                write_value = store(dut, memory, raw_addr, data_out.value.integer, sel)
+                if write_value is not None:
+                    mem_access.append((raw_addr, write_value))
+
+            ack.value = 1
         else:
-            dut.data_mem_ack.value = 0
+            ack.value = 0
 
 async def memory_model(dut, memory, fetches, mem_access, start_of_text_section, end_of_text_section, byte_aligned_memory_access):
+    clk, rst_n = dut.sys_clk, dut.rst_n
+    cyc, stb, we, sel, ack = dut.core_cyc, dut.core_stb, dut.core_we, dut.core_sel, dut.core_ack
+    addr, data_in, data_out = dut.core_addr, dut.core_data_in, dut.core_data_out
     while True:
-        await RisingEdge(dut.sys_clk)  
+        await RisingEdge(clk)
         await ReadWrite() # wait for signals to propagate after the clock edge
 
-        if dut.core_cyc.value == 1 and dut.core_stb.value == 1: # active transaction
+        if cyc.value == 1 and stb.value == 1: # active transaction
             
-            raw_addr = dut.core_addr.value.integer
-            simulated_addr = (raw_addr // 4) % MEM_SIZE
+            raw_addr = addr.value.integer
 
             if byte_aligned_memory_access: # lb and lh instructions expect data at LSB
                 shift_amount = (raw_addr % 4) * 8
-                dut.core_data_in.value = memory[simulated_addr] >> shift_amount
+                data_in.value = memory.read_word(raw_addr) >> shift_amount
             else:
-                dut.core_data_in.value = memory[simulated_addr]
+                data_in.value = memory.read_word(raw_addr)
 
             await NextTimeStep()
             await ReadWrite()
             
-            if dut.core_we == 0:
+            if we.value == 0:
                 # it is only a fetch if it is reading the .text section
-                if dut.rst_n.value == 1 and raw_addr >= start_of_text_section and raw_addr < end_of_text_section:
-                    fetches.append((raw_addr, memory[simulated_addr]))
+                if rst_n.value == 1 and raw_addr >= start_of_text_section and raw_addr < end_of_text_section:
+                    fetches.append((raw_addr, memory.read_word(raw_addr)))
             else:
                 # Write operation, depends on write strobe
-                if dut.core_sel.value == "1111":
-                    write_value = dut.core_data_out.value.integer
-                    memory[simulated_addr] = write_value
-                elif dut.core_sel.value == "0011":
-                    write_value = (memory[simulated_addr] & 0xFFFF0000) | (dut.core_data_out.value.integer & 0x0000FFFF)
-                    memory[simulated_addr] = write_value
-                elif dut.core_sel.value == "1100":
-                    write_value = (memory[simulated_addr] & 0x0000FFFF) | (dut.core_data_out.value.integer & 0xFFFF0000)
-                    memory[simulated_addr] = write_value
-                elif dut.core_sel.value == "0001":
-                    write_value = (memory[simulated_addr] & 0xFFFFFF00) | (dut.core_data_out.value.integer & 0x000000FF)
-                    memory[simulated_addr] = write_value
-                elif dut.core_sel.value == "0010":
-                    write_value = (memory[simulated_addr] & 0xFFFF00FF) | (dut.core_data_out.value.integer & 0x0000FF00)
-                    memory[simulated_addr] = write_value
-                elif dut.core_sel.value == "0100":
-                    write_value = (memory[simulated_addr] & 0xFF00FFFF) | (dut.core_data_out.value.integer & 0x00FF0000)
-                    memory[simulated_addr] = write_value
-                elif dut.core_sel.value == "1000":
-                    write_value = (memory[simulated_addr] & 0x00FFFFFF) | (dut.core_data_out.value.integer & 0xFF000000)
-                    memory[simulated_addr] = write_value
-
-                mem_access.append((raw_addr, write_value))
-
-            dut.core_ack.value = 1
+                write_value = store(dut, memory, raw_addr, data_out.value.integer, sel)
+                if write_value is not None:
+                    mem_access.append((raw_addr, write_value))
+
+            ack.value = 1
         else:
-            dut.core_ack.value = 0
-
-        
-def show_signals_of_interest(dut, TWO_MEMORIES):
-    if TWO_MEMORIES:
-        dut._log.info("CORE_STB=%s", dut.core_stb.value)
-        dut._log.info("CORE_ACK=%s", dut.core_ack.value)
-        dut._log.info("CORE_ADDR=%x", dut.core_addr.value)
-        dut._log.info("CORE_DATA_IN=%x", dut.core_data_in.value)
-        dut._log.info("CORE_DATA_OUT=%s", dut.core_data_out.value)
-        dut._log.info("DATA_MEM_STB=%s", dut.data_mem_stb.value)
-        dut._log.info("DATA_MEM_ACK=%s", dut.data_mem_ack.value)
-        dut._log.info("DATA_MEM_ADDR=%s", dut.data_mem_addr.value)
-        dut._log.info("DATA_MEM_DATA_IN=%s", dut.data_mem_data_in.value)
-        dut._log.info("DATA_MEM_WE=%s", dut.data_mem_we.value)
-        dut._log.info("DATA_MEM_DATA_OUT=%s", dut.data_mem_data_out.value)
-        dut._log.info("DATA_MEM_SEL=%s", dut.data_mem_sel.value)
-        dut._log.info("")
-        # for i in range(32):
-        #     reg_value = dut.Processor.regFile.REGISTERS[i].value
-        #     dut._log.info("REG[%02d]=%x", i, reg_value)
-    else:
-        dut._log.info("CORE_STB=%s", dut.core_stb.value)
-        dut._log.info("CORE_ACK=%s", dut.core_ack.value)
-        dut._log.info("CORE_ADDR=%x", dut.core_addr.value)
-        dut._log.info("CORE_DATA_IN=%x", dut.core_data_in.value)
-        dut._log.info("CORE_WE=%s", dut.core_we.value)
-        dut._log.info("CORE_DATA_OUT=%s", dut.core_data_out.value)
-        dut._log.info("CORE_SEL=%s", dut.core_sel.value)
-        dut._log.info("")
+            ack.value = 0
 
 async def wait_cycles(signal, num_cycles):
     for _ in range(num_cycles):
@@ -234,160 +198,433 @@ async def custom_clock(clk):
         await Timer(0.5, units="ns")
 
 
+def create_regfile_monitor(dut, config_data):
+    """
+    Creates the register file monitor selected by REGFILE_MONITOR in the manual flags:
+    "poll" (default) or "edge" read the register file array, "write_port" watches the
+    regfile_interface signals. Without REGFILE_ARRAY_AVAILABLE the write port is used.
+    "edge" needs value change callbacks on the array elements, not available in every
+    simulator: a program whose register changes were missed fails. Missed changes are
+    caught by polling during the first regfile_monitor.EDGE_CHECK_CYCLES cycles, and
+    after that only if they change the final register values, so "edge" is opt-in.
+    """
+    interface = config_data.get('regfile_interface')
+    if not config_data.get('REGFILE_ARRAY_AVAILABLE'):
+        return regfile_monitor.WritePortMonitor(resolve_path(dut, interface['write_enable']),
+                                                resolve_path(dut, interface['write_addr']),
+                                                resolve_path(dut, interface['write_data']))
+
+    # First, determine which registers exist by checking if they can be accessed
+    # rvx, for example, does not have x0
+    reg_file = resolve_path(dut, config_data.get('regfile_candidates')[0])
+    available_regs = []
+    for i in range(32):
+        try:
+            # Test if register exists by trying to access it
+            _ = reg_file[i].value
+            available_regs.append(i)
+        except (IndexError, AttributeError):
+            # Register doesn't exist, skip it
+            continue
+
+    # Cocotb is unable to initialize the register file most of the time. Use with caution
+    for i in available_regs:
+        reg_file[i].value = 0
+
+    monitor = config_data.get('REGFILE_MONITOR', "poll")
+    if monitor == "write_port" and interface:
+        return regfile_monitor.WritePortMonitor(resolve_path(dut, interface['write_enable']),
+                                                resolve_path(dut, interface['write_addr']),
+                                                resolve_path(dut, interface['write_data']),
+                                                reg_file, available_regs)
+    if monitor == "edge":
+        return regfile_monitor.EdgeMonitor(reg_file, available_regs)
+    return regfile_monitor.PollingMonitor(reg_file, available_regs)
+
+def write_status(status_file, statuses):
+    """
+    Writes the outcome of the simulated programs for the process that launched the
+    simulator (exec_trace.py batch mode), which cannot rely on the simulator exit code.
+
+    Args:
+        status_file (str): Path of the JSON file, nothing is written if empty.
+        statuses (list): One dictionary per program, as returned by run_program.
+    """
+    if not status_file:
+        return
+    temporary_file = status_file + ".tmp"
+    with open(temporary_file, "w") as f:
+        json.dump(statuses, f, indent=2)
+    os.replace(temporary_file, status_file) # never leave a half-written status
+
 @cocotb.test()
 async def execution_trace(dut):
 
-    # cocotb.start_soon(debug_print(dut))
-    fetches = []
-    regfile_commits = []
-    mem_access = []
-
     # Read configuration files and environment variables
     reg_file_json_path = os.environ.get('REGFILE_JSON')
     manual_flags_path = os.environ.get('MANUAL_FLAGS_JSON')
-    config_data = config_loader.ConfigLoader([reg_file_json_path, manual_flags_path], ['OUTPUT_DIR', 'ELF_PATH'])
-    
+    config_data = config_loader.ConfigLoader([reg_file_json_path, manual_flags_path], ['OUTPUT_DIR', 'ELF_PATH', 'ELF_LIST', 'TRACE_FORMAT', 'STATUS_FILE', 'DEBUG_LEVEL', 'DEBUG_DEPTH', 'SPIKE_TRACE_DIR'])
+
+    # cocotb.start_soon(Clock(dut.sys_clk, 1, units="ns", start_high=False).start())
+    cocotb.start_soon(custom_clock(dut.sys_clk))
+
+    # Signals of interest, kept in a ring buffer dumped on timeout or error (DEBUG_LEVEL 1),
+    # logged every cycle (2) or not recorded (0)
+    debug = debug_trace.DebugTrace(dut, config_data.get('TWO_PORTED_MEMORY_MODEL'),
+                                   int(config_data.get('DEBUG_LEVEL', debug_trace.DEBUG_RING)),
+                                   int(config_data.get('DEBUG_DEPTH', debug_trace.DEFAULT_DEBUG_DEPTH)))
+
+    # Every program of the list runs in this simulation, one after another, with a reset in between
+    processor_name = config_data.get('PROCESSOR_NAME')
+    inputs_digest = cache_utils.text_digest(*(cache_utils.file_digest(path) if path and os.path.isfile(path) else ""
+                                              for path in (reg_file_json_path, manual_flags_path)))
+    statuses = []
+    for elf_path in program_list(config_data):
+        tasks = []
+        start = time.time()
+        try:
+            status = await run_program(dut, config_data, elf_path, tasks, debug)
+        except Exception as e:
+            dut._log.error(f"{os.path.basename(elf_path)} failed: {type(e).__name__}: {e}")
+            debug.dump("error")
+            status = {"elf": elf_path, "status": "error", "message": f"{type(e).__name__}: {e}"}
+        finally:
+            for task in tasks: # the memory models of this program
+                task.kill()
+        status["seconds"] = time.time() - start
+        statuses.append(status)
+        write_status(config_data.get('STATUS_FILE'), statuses) # after every program, in case the simulator dies
+        record_status(status, processor_name, inputs_digest)
+
+    failed = [status for status in statuses if status["status"] != "passed"]
+    assert not failed, "; ".join(f"{os.path.basename(status['elf'])}: {status['message']}" for status in failed)
+
+def record_status(status, processor_name, inputs_digest):
+    """
+    Adds the status of a program to the results database (see results_db). The inputs are
+    the ELF file (elf_digest) and the register file and manual flags JSON (inputs_digest).
+    """
+    if results_db.database_path() is None:
+        return
+    elf_path = status["elf"]
+    results_db.record_run("exec_trace", elf_path, status["status"], processor=processor_name,
+                          elf_digest=cache_utils.file_digest(elf_path) if os.path.isfile(elf_path) else None,
+                          inputs_digest=inputs_digest, message=status.get("message"),
+                          first_index=status.get("first_index"), first_pc=status.get("first_pc"),
+                          cycles=status.get("cycles"), instructions=status.get("instructions"),
+                          seconds=status["seconds"], timings=status.get("timings") or {"simulation": status["seconds"]})
+
+def program_list(config_data):
+    """
+    ELF files to run in this simulation: the lines of the ELF_LIST file, or ELF_PATH.
+    """
+    if config_data.get('ELF_LIST'):
+        with open(config_data.get('ELF_LIST'), "r") as f:
+            return [line.strip() for line in f if line.strip()]
+    return [config_data.get('ELF_PATH')]
+
+async def run_program(dut, config_data, elf_path, tasks, debug):
+    """
+    Resets the DUT, loads the program in the memory model, runs it and writes its
+    fragmented trace.
+
+    Args:
+        dut: cocotb handle of the top-level.
+        config_data (ConfigLoader): Configuration of the processor.
+        elf_path (str): ELF file to run.
+        tasks (list): The coroutines started for this program (memory models) are appended
+            to it, to be killed by the caller when the program is over.
+        debug (DebugTrace): Records the signals of interest every cycle.
+    Returns:
+        dict: status of the program: elf, status ("passed", "timeout" or "mismatch"),
+        message, trace (path of the fragmented trace), cycles, instructions (fetches,
+        speculative ones included), first_index and first_pc (the first divergence from
+        spike in lockstep mode, else None) and timings (stage -> seconds, see metrics).
+
+    With SPIKE_TRACE_DIR (lockstep mode), the fragments are aligned and compared with the
+    spike trace of the program every LOCKSTEP_CHECK_CYCLES cycles while it runs (see
+    compare_traces.LockstepChecker), and the simulation stops at the first mismatch.
+    """
+    # cocotb.start_soon(debug_print(dut))
+
     # Initialize and reset core
     processor_name = config_data.get('PROCESSOR_NAME')
     dut._log.info(f"Initializing trace execution for {processor_name}...")
 
-    # cocotb.start_soon(Clock(dut.sys_clk, 1, units="ns", start_high=False).start())
-    cocotb.start_soon(custom_clock(dut.sys_clk))
+    dut._log.info(f"Running {os.path.basename(elf_path)}")
+    debug.clear()
 
     dut.core_data_in.value = 0
+    dut.core_ack.value = 0
+    if config_data.get('TWO_PORTED_MEMORY_MODEL'):
+        dut.data_mem_ack.value = 0
     dut.rst_n.value = 0
     await wait_cycles(dut.sys_clk, 5)
 
-    # Start memory, reset register file, get tohost symbol ###########################################################
-    if config_data.get('TWO_PORTED_MEMORY_MODEL'):
-        # Initialize instruction memory from ELF
-        instruction_memory = elf_reader.load_memory(MEM_SIZE, config_data.get('ELF_PATH'))
-        data_memory = elf_reader.load_data_memory(MEM_SIZE, config_data.get('ELF_PATH'))
-
-        start_of_text_section, end_of_text_section = elf_reader.get_text_section_addr(config_data.get('ELF_PATH'))
-
-
-        cocotb.start_soon(instruction_memory_model(dut, instruction_memory, fetches, start_of_text_section, end_of_text_section))
-        cocotb.start_soon(data_memory_model(dut, data_memory, mem_access, config_data.get('BYTE_ALIGNED_MEMORY_ACCESS')))
-    else:
-        # Initialize memory from ELF
-        memory = elf_reader.load_memory(MEM_SIZE, config_data.get('ELF_PATH'))
-
-        start_of_text_section, end_of_text_section = elf_reader.get_text_section_addr(config_data.get('ELF_PATH'))
-
-        cocotb.start_soon(memory_model(dut, memory, fetches, mem_access, start_of_text_section, end_of_text_section, config_data.get('BYTE_ALIGNED_MEMORY_ACCESS')))
-
-    # get tohost symbol to detect end of program
-    tohost_addr_raw = elf_reader.get_tohost_address(config_data.get('ELF_PATH'))
-    tohost_addr = (tohost_addr_raw // 4) % MEM_SIZE
-
-    if config_data.get('REGFILE_ARRAY_AVAILABLE'):
-        # First, determine which registers exist by checking if they can be accessed
-        # rvx, for example, does not have x0
-        reg_file = resolve_path(dut, config_data.get('regfile_candidates')[0])
-        available_regs = []
-        for i in range(32):
-            try:
-                # Test if register exists by trying to access it
-                _ = reg_file[i].value
-                available_regs.append(i)
-            except (IndexError, AttributeError):
-                # Register doesn't exist, skip it
-                continue
-        
-        # Cocotb is unable to initialize the register file most of the time. Use with caution
-        for i in available_regs:
-            reg_file[i].value = 0
-
-    # Use regfile interface, instead
-    else:
-        reg_file_write_enable = resolve_path(dut, config_data.get('regfile_interface')['write_enable'])
-        reg_file_write_addr = resolve_path(dut, config_data.get('regfile_interface')['write_addr'])
-        reg_file_write_data = resolve_path(dut, config_data.get('regfile_interface')['write_data'])
-        
-        # regfile is now a python object, mimetizing the cocotb handle
-        class Register:
-            def __init__(self, value=0):
-                self.value = value
-        reg_file = {i: Register(0) for i in range(32)}
+    # The fragments are streamed to the binary trace as they are captured: memory stays
+    # bounded, and after a timeout or a crash the file holds everything up to the last flush.
+    # A JSON trace is exported from it at the end.
+    output_dir = config_data.get("OUTPUT_DIR")
+    os.makedirs(output_dir, exist_ok=True)
 
-        # assume all registers are available
-        available_regs = list(range(32))
+    elf_name_without_ext = os.path.splitext(os.path.basename(elf_path))[0]
+    trace_output_format = config_data.get('TRACE_FORMAT') or "binary"
+    trace_file_path = trace_format.trace_path(output_dir, elf_name_without_ext, "fragmented", trace_output_format)
+    binary_trace_path = trace_format.trace_path(output_dir, elf_name_without_ext, "fragmented")
 
-    ##############################################################################################
+    writer = trace_format.TraceWriter(binary_trace_path, trace_format.KIND_FRAGMENTED,
+                                      {"comment": f"Trace for {os.path.basename(elf_path)} on {processor_name}",
+                                       "processor": processor_name})
+    fetches = writer.table("fetches")
+    regfile_commits = writer.table("regfile_commits")
+    mem_access = writer.table("memory_accesses")
 
-    await wait_cycles(dut.sys_clk, 5)
-    dut.rst_n.value = 1
-    await ReadWrite()  # Wait for the signals to propagate after reset
+    timings = {} # stage -> seconds, see metrics
+    try:
+        lockstep = None
+        spike_trace_dir = config_data.get('SPIKE_TRACE_DIR')
+        if spike_trace_dir:
+            spike_trace_path = trace_format.find_trace(spike_trace_dir, elf_name_without_ext, "spike")
+            if spike_trace_path is None:
+                dut._log.warning(f"No spike trace of {elf_name_without_ext} in {spike_trace_dir}, lockstep comparison disabled.")
+            else:
+                lockstep = compare_traces.LockstepChecker(compare_traces.read_entries(spike_trace_path), elf_name_without_ext)
+                fetches = lockstep.tap("fetches", fetches)
+                regfile_commits = lockstep.tap("regfile_commits", regfile_commits)
+                mem_access = lockstep.tap("memory_accesses", mem_access)
+
+        # Start memory, reset register file, get tohost symbol ###########################################################
+        # The two-ported model has separate instruction and data memories, both loaded with the
+        # program: stores of the data port are not seen by the fetches
+        with metrics.Stage("elf_load", elf_path, timings):
+            program = elf_reader.load_program(elf_path)
+            fill_word = config_data.get('MEMORY_FILL_WORD', sparse_memory.DEFAULT_FILL_WORD)
+            fill_word = int(fill_word, 0) if isinstance(fill_word, str) else fill_word
+            memory = program.memory(fill_word) # the data memory of the two-ported model, where tohost is
+            if config_data.get('TWO_PORTED_MEMORY_MODEL'):
+                instruction_memory = program.memory(fill_word)
+        start_of_text_section, end_of_text_section = program.text_start, program.text_end
 
-    # This is used to check for register file changes
-    # Initialize with DUT's values
-    old_regfile = {}
-    for i in available_regs:
-        old_regfile[i] = reg_file[i].value
-
-    show_signals_of_interest(dut, config_data.get('TWO_PORTED_MEMORY_MODEL'))
-
-    # Main simulation loop
-    successful_simulation = False
-    for _ in range(SIMULATION_TIMEOUT_CYCLES):
-        
-        if config_data.get('REGFILE_ARRAY_AVAILABLE'):
-            for i in available_regs:
-                if reg_file[i].value != old_regfile[i] and i != 0: # x0 should be always zero
-                    regfile_commits.append((i, reg_file[i].value.integer))
-        else:
-            # Use regfile interface to detect writes
-            if reg_file_write_enable.value == 1 and reg_file_write_addr.value.integer != 0:
-                write_addr = reg_file_write_addr.value.integer
-                write_data = reg_file_write_data.value.integer
-                reg_file[write_addr].value = write_data
-                regfile_commits.append((write_addr, write_data))
-
-        stop_condition = False
         if config_data.get('TWO_PORTED_MEMORY_MODEL'):
-            stop_condition = data_memory[tohost_addr] == 1
+            tasks.append(cocotb.start_soon(instruction_memory_model(dut, instruction_memory, fetches, start_of_text_section, end_of_text_section)))
+            tasks.append(cocotb.start_soon(data_memory_model(dut, memory, mem_access, config_data.get('BYTE_ALIGNED_MEMORY_ACCESS'))))
         else:
-            stop_condition = memory[tohost_addr] == 1
-        if stop_condition:
-            dut._log.info("ToHost write detected. Stop simulation.")
-            successful_simulation = True
-            break
-
-        for i in available_regs:
-            old_regfile[i] = reg_file[i].value
-
-        await RisingEdge(dut.sys_clk)
-        await ReadWrite() # Wait for the memory to react
-        show_signals_of_interest(dut, config_data.get('TWO_PORTED_MEMORY_MODEL'))
-
-
-    # finished simulation, write trace to file
-
-    output_dir = config_data.get("OUTPUT_DIR")
-    os.makedirs(output_dir, exist_ok=True)
-
-    elf_basename = os.path.basename(config_data.get('ELF_PATH'))
-    elf_name_without_ext = os.path.splitext(elf_basename)[0]
-    trace_file_path = os.path.join(output_dir, f"{elf_name_without_ext}.fragmented.json")  
+            tasks.append(cocotb.start_soon(memory_model(dut, memory, fetches, mem_access, start_of_text_section, end_of_text_section, config_data.get('BYTE_ALIGNED_MEMORY_ACCESS'))))
+
+        # get tohost symbol to detect end of program
+        tohost_addr = program.tohost
+
+        regfile = create_regfile_monitor(dut, config_data)
+
+        ##############################################################################################
+
+        await wait_cycles(dut.sys_clk, 5)
+        dut.rst_n.value = 1
+        await ReadWrite()  # Wait for the signals to propagate after reset
+
+        # This is used to check for register file changes
+        # Initialize with DUT's values
+        regfile.start(tasks)
+
+        debug.record(0)
+
+        # Main simulation loop
+        successful_simulation = False
+        divergence = None
+        cycles = 0
+        with metrics.Stage("simulation", elf_path, timings) as simulation:
+            for cycles in range(SIMULATION_TIMEOUT_CYCLES):
+
+                regfile.sample(regfile_commits)
+
+                if memory.read_word(tohost_addr) == 1:
+                    dut._log.info("ToHost write detected. Stop simulation.")
+                    successful_simulation = True
+                    break
+
+                if lockstep is not None and cycles % LOCKSTEP_CHECK_CYCLES == 0:
+                    divergence = lockstep.check()
+                    if divergence is not None:
+                        dut._log.error("Mismatch with the spike trace. Stop simulation.")
+                        break
+
+                await RisingEdge(dut.sys_clk)
+                await ReadWrite() # Wait for the memory to react
+                debug.record(cycles + 1)
+
+                if cycles % TRACE_FLUSH_CYCLES == 0:
+                    writer.flush() # readable up to here if the simulator dies
+
+            simulation.count("cycles", cycles)
+            simulation.count("instructions", writer.count("fetches"))
+
+        if successful_simulation and lockstep is not None:
+            divergence = lockstep.finish()
+            successful_simulation = divergence is None
+        if divergence is not None:
+            debug.dump("mismatch")
+            for line in compare_traces.format_divergence(elf_name_without_ext, divergence):
+                dut._log.error(line)
+        elif not successful_simulation:
+            debug.dump("timeout")
+        regfile_complete = regfile.verify(dut._log)
+    finally:
+        writer.close() # also on error, the partial trace shows where the DUT stopped
+
+    if trace_output_format == "json":
+        with metrics.trace_stage(trace_file_path, "json_export") as stage:
+            stage.count("entries", trace_format.export_json(binary_trace_path, trace_file_path))
+        os.remove(binary_trace_path)
+    else:
+        trace_index.build_index(binary_trace_path)
+
+    first_index = first_pc = None
+    if not regfile_complete:
+        # the trace lacks register commits, a mismatch would not be the DUT's
+        status, message = "error", "Register file changes were missed by the \"edge\" monitor, set REGFILE_MONITOR to \"poll\"."
+    elif divergence is not None:
+        mismatch = divergence["mismatches"][0]
+        first_index, first_pc = mismatch["index"], mismatch["spike"]["pc"]
+        status, message = "mismatch", f"Diverges from spike at entry {first_index} (pc {compare_traces.format_entry(mismatch['spike'])['pc']})."
+    elif successful_simulation:
+        status, message = "passed", ""
+    else:
+        status, message = "timeout", "Simulation timed out before reaching ToHost write."
+    return {
+        "elf": elf_path,
+        "status": status,
+        "message": message,
+        "trace": trace_file_path,
+        "cycles": cycles,
+        "instructions": writer.count("fetches"),
+        "first_index": first_index,
+        "first_pc": first_pc,
+        "timings": timings,
+    }
+
+def run_simulation(make_command, env, job_dir, elf_files, verbose=False):
+    """
+    Runs the testbench for a list of ELF files, all in one simulator launch, in its own
+    directory. The simulator working files (waveforms included), results.xml, the list of
+    programs, the status file and the make log are kept there, so several simulations can
+    run at the same time.
+
+    Args:
+        make_command (list): make command line, with MODULE and SIM_BUILD.
+        env (dict): Environment of the testbench, without ELF_PATH.
+        job_dir (str): Directory of this simulation.
+        elf_files (list): Absolute paths of the ELF files to run.
+        verbose (bool): Show the output of make instead of writing it to sim.log.
+    Returns:
+        list: One status per ELF, as written by the testbench (see run_program), or an
+        "error" status for the programs the testbench did not report.
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    status_file = os.path.join(job_dir, "status.json")
+    results_file = os.path.join(job_dir, "results.xml")
+    list_file = os.path.join(job_dir, "elf_list.txt")
+    log_file = os.path.join(job_dir, "sim.log")
+    for stale_file in (status_file, results_file):
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+    with open(list_file, "w") as f:
+        f.write("".join(f"{elf_file}\n" for elf_file in elf_files))
+
+    job_env = dict(env, ELF_LIST=list_file, STATUS_FILE=status_file, COCOTB_RESULTS_FILE=results_file)
+    command = make_command + [f"COCOTB_RESULTS_FILE={results_file}"]
+    start = time.time()
+    if verbose:
+        returncode = subprocess.run(command, env=job_env, cwd=job_dir).returncode
+    else:
+        with open(log_file, "w") as log:
+            returncode = subprocess.run(command, env=job_env, cwd=job_dir, stdout=log, stderr=subprocess.STDOUT).returncode
+    seconds = time.time() - start
 
-    processor_name = config_data.get('PROCESSOR_NAME')
+    try:
+        with open(status_file, "r") as f:
+            statuses = {status["elf"]: status for status in json.load(f)}
+    except (OSError, ValueError):
+        statuses = {}
+    missing = {"status": "error", "seconds": seconds,
+               "message": f"no status reported by the testbench (make exited with code {returncode}), see {log_file}"}
+    # the time make spent outside the programs: build, simulator start-up and shutdown
+    metrics.record("simulator_startup", os.path.splitext(os.path.basename(elf_files[0]))[0],
+                   seconds - sum(status.get("seconds", 0.0) for status in statuses.values()), counts={"programs": len(statuses)})
+    return [statuses.get(elf_file, dict(missing, elf=elf_file)) for elf_file in elf_files]
+
+def run_batch(elf_files, make_command, env, sim_dir, jobs=1, shared_build=True, verbose=False, programs_per_sim=1):
+    """
+    Runs the testbench for every ELF, `jobs` simulations at a time, each in its own
+    directory under sim_dir/jobs and each running `programs_per_sim` ELF files (0 splits
+    them evenly between the jobs). With a shared build, a first simulation of a single ELF
+    builds the simulator in sim_dir/build and the others reuse it; otherwise each job
+    builds its own.
+
+    Returns:
+        list: The statuses of run_simulation, in completion order.
+    """
+    statuses = []
+
+    def simulate(group):
+        name = os.path.splitext(os.path.basename(group[0]))[0]
+        job_dir = os.path.join(sim_dir, "jobs", name if len(group) == 1 else f"{name}+{len(group) - 1}")
+        build_dir = os.path.join(sim_dir, "build") if shared_build else os.path.join(job_dir, "sim_build")
+        return run_simulation(make_command + [f"SIM_BUILD={build_dir}"], env, job_dir, group, verbose)
+
+    def report(group_statuses):
+        for status in group_statuses:
+            statuses.append(status)
+            color = "\033[96m" if status["status"] == "passed" else "\033[91m"
+            message = f": {status['message']}" if status.get("message") else ""
+            print(f"{color}[{len(statuses)}/{len(elf_files)}] {os.path.basename(status['elf'])} {status['status']}"
+                  f"{message} ({status['seconds']:.1f}s)\033[0m", flush=True)
+
+    remaining = list(elf_files)
+    if shared_build and remaining:
+        report(simulate(remaining[:1])) # builds the simulator once
+        remaining = remaining[1:]
+    if programs_per_sim <= 0:
+        programs_per_sim = -(-len(remaining) // max(jobs, 1))
+    groups = [remaining[i:i + programs_per_sim] for i in range(0, len(remaining), max(programs_per_sim, 1))]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor: # the work happens in the simulator processes
+        for future in as_completed([executor.submit(simulate, group) for group in groups]):
+            report(future.result())
+    return statuses
+
+def testbench_environment(reg_file_json, manual_flags_json, output_dir, trace_output_format="binary",
+                          debug_level=1, debug_depth=64, spike_trace_dir=""):
+    """
+    Environment of the make command running the testbench, which reads its arguments from
+    environment variables (see execution_trace). ELF_PATH or ELF_LIST are added per run.
+    """
+    env = os.environ.copy()
+    # Force colored output for tools that support it
+    env['FORCE_COLOR'] = '1'
+    env['CLICOLOR_FORCE'] = '1'
+    env['TERM'] = 'xterm-256color'
 
-    with open(trace_file_path, "w") as trace_file:
-        program_name = os.path.basename(config_data.get('ELF_PATH'))
-        trace_data = {
-            "comment": f"Trace for {program_name} on {processor_name}",
-            "fetches": fetches,
-            "regfile_commits": regfile_commits,
-            "memory_accesses": mem_access
-        }
-    
-        json_str = json.dumps(trace_data, indent=1, separators=(',', ': '))
-        # Remove line breaks inside small lists like [0,\n 5244307]
-        json_str = re.sub(r'\[\s*([0-9]+),\s*([0-9]+)\s*\]', r'[\1,\2]', json_str)
-        trace_file.write(json_str)
+    # make sure make command will have access to the cocotb_verification files even if called from another directory
+    exec_trace_path = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+    env['PYTHONPATH'] = exec_trace_path
 
-    assert successful_simulation, "Simulation timed out before reaching ToHost write."
+    # Prepare environment variables that will be passed to Cocotb
+    env['REGFILE_JSON'] = os.path.abspath(reg_file_json)
+    env['MANUAL_FLAGS_JSON'] = os.path.abspath(manual_flags_json)
+    env['OUTPUT_DIR'] = os.path.abspath(output_dir)
+    env['TRACE_FORMAT'] = trace_output_format
+    env['DEBUG_LEVEL'] = str(debug_level)
+    env['DEBUG_DEPTH'] = str(debug_depth)
+    if spike_trace_dir:
+        env['SPIKE_TRACE_DIR'] = os.path.abspath(spike_trace_dir)
+    return env
+
+def make_commands(makefile):
+    """The make commands (clean, run) of the testbench, without SIM_BUILD."""
+    clean_command = ["make", "-f", makefile, "clean"]
+    # In-line variables override makefile.
+    # Could not use env["MODULE"]="exec_trace" because make would not pick it up
+    make_command = ["make", "-f", makefile, "MODULE=exec_trace"]
+    return clean_command, make_command
 
 # Since cocotb cannot receive arguments,
 # __main__ reads arguments and writes them to a fixed-location, temporary file
@@ -404,62 +641,54 @@ if __name__ == "__main__":
     parser.add_argument("--manual_flags_json","-f", required=False, type=str, default="", help="Path to the manual flags (array, memory-alignment, etc) JSON file.")
     parser.add_argument("--output_dir","-o", required=True, type=str, help="Directory to store the trace files.")
     parser.add_argument("--verbose","-v", action="store_true", help="If set, the output of the make command will be shown in real-time.")
-
+    parser.add_argument("--format","-F", type=str, choices=["binary", "json"], default="binary", help="Fragmented trace format (default: binary, JSON for export).")
+    parser.add_argument("--debug-level", type=int, choices=[0, 1, 2], default=1, help="Signals of interest: 0 not recorded, 1 last cycles dumped on timeout or error (default), 2 logged every cycle.")
+    parser.add_argument("--debug-depth", type=int, default=64, help="Number of cycles kept for --debug-level 1 (default: 64).")
+    parser.add_argument("--jobs","-j", type=int, default=1, help="Number of simulations run in parallel in batch mode (default: 1).")
+    parser.add_argument("--programs-per-sim","-P", type=int, default=1, help="Number of ELF files run by each simulator launch in batch mode, 0 to split them evenly between the jobs (default: 1).")
+    parser.add_argument("--separate-builds", action="store_true", help="Build the simulator once per ELF in batch mode, for simulators whose build cannot be shared by concurrent runs.")
+    parser.add_argument("--lockstep", type=str, default="", help="Folder of the spike traces (spike_trace.py output): compare with them while simulating and stop at the first mismatch.")
+
+    parser.add_argument("--metrics", type=str, help="Append the wall time, CPU time, peak RSS and counts of every stage to this JSON lines file (see metrics.py).")
+    parser.add_argument("--profile", action="store_true", help="Run every stage under cProfile and write <elf>.<stage>.prof next to the traces (the testbench stages).")
+    parser.add_argument("--results-db", type=str, help="Record the result of every simulation in this SQLite database (see results_db.py).")
     args = parser.parse_args()
-    makefile = args.makefile
+    metrics.enable(args.metrics, args.output_dir if args.profile else None) # inherited by the testbench
+    results_db.enable(args.results_db)
+    makefile = os.path.abspath(args.makefile)
     elf_file = args.elf_file
     elf_folder = args.elf_folder
     reg_file_json = args.reg_file_json
     manual_flags_json = args.manual_flags_json
-    output_dir = args.output_dir
+    output_dir = os.path.abspath(args.output_dir)
 
     if args.verbose:
         verbose = None  # inherit parent's stdout/stderr
     else:
         verbose = subprocess.DEVNULL  # suppress output
 
-    env = os.environ.copy()
-    # Force colored output for tools that support it
-    env['FORCE_COLOR'] = '1'
-    env['CLICOLOR_FORCE'] = '1'
-    env['TERM'] = 'xterm-256color'
-
-    # make sure make command will have access to the cocotb_verification files even if called from another directory
-    exec_trace_path = os.path.abspath(os.path.join(os.path.dirname(__file__)))
-    env['PYTHONPATH'] = exec_trace_path
-    
-    # Prepare environment variables that will be passed to Cocotb
-    env['REGFILE_JSON'] = os.path.abspath(args.reg_file_json)
-    env['MANUAL_FLAGS_JSON'] = os.path.abspath(args.manual_flags_json)
-    env['OUTPUT_DIR'] = output_dir
+    env = testbench_environment(args.reg_file_json, args.manual_flags_json, output_dir, args.format,
+                                args.debug_level, args.debug_depth, args.lockstep)
     # ELF_PATH will be set later, in the loop or for single file mode
-    
-    
-    clean_command = ["make", "-f", makefile, "clean"]
-    # In-line variables override makefile.
-    # Could not use env["MODULE"]="exec_trace" because make would not pick it up
-    make_command = ["make", "-f", makefile, "MODULE=exec_trace"]
+
+    clean_command, make_command = make_commands(makefile)
     try:
         if args.elf_folder: # batch mode
-            subprocess.run(clean_command, check=True, env=env)
-            for test_file in os.listdir(elf_folder):
-                elf_file = os.path.join(elf_folder, test_file)
-                if os.path.isfile(elf_file) and elf_file.endswith(".elf"):  
-                    env['ELF_PATH'] = elf_file
-                    
-                    # Run make commands
-                    result = subprocess.run(make_command, check=True, env=env, 
-                       stdout=verbose, stderr=verbose)
-
-                    # careful, this is hardcoded ############################################################
-                    with open("results.xml", "r") as f:
-                        content = f.read()
-                        successful_simulation = "failure" not in content and "error" not in content
-
-                    if successful_simulation:
-                        print(f"\033[96mSuccessfully processed {os.path.basename(elf_file)}\033[0m")
-                    else:
-                        print(f"\033[91mFailed to process {os.path.basename(elf_file)}\033[0m")
+            # each simulation runs in its own directory of sim_dir, sharing the simulator build
+            sim_dir = os.path.join(output_dir, "sim")
+            subprocess.run(clean_command + [f"SIM_BUILD={os.path.join(sim_dir, 'build')}"], check=True, env=env,
+                           stdout=verbose, stderr=verbose)
+            elf_files = [os.path.abspath(os.path.join(elf_folder, test_file)) for test_file in sorted(os.listdir(elf_folder))]
+            elf_files = [elf_file for elf_file in elf_files if os.path.isfile(elf_file) and elf_file.endswith(".elf")]
+
+            statuses = run_batch(elf_files, make_command, env, sim_dir, args.jobs, not args.separate_builds, args.verbose,
+                                 args.programs_per_sim)
+            failed = [status for status in statuses if status["status"] != "passed"]
+            print(f"{len(statuses) - len(failed)}/{len(statuses)} simulations passed")
+            for status in failed:
+                print(f"\033[91mFailed to process {os.path.basename(status['elf'])}: {status['status']}\033[0m")
+            if failed:
+                exit(1)
         else:
             # Set ELF file in environment
             env['ELF_PATH'] = elf_file
@@ -0,0 +1,175 @@
+# This module contains the stage metrics of the verification flow: wall time, CPU time,
+# peak RSS and item counts of each stage (spike, ELF loading, simulation, comparison, JSON
+# I/O, ...) per ELF, and the optional cProfile of each stage.
+#
+# The scripts enable them with --metrics FILE and --profile, which set NTV_METRICS (a JSON
+# lines file every process appends its records to) and NTV_PROFILE (the directory of the
+# <elf>.<stage>.prof files), so the worker processes and the testbench inherit them.
+
+import argparse
+import cProfile
+import csv
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+import trace_format
+
+_local = threading.local() # the profiler running in this thread, if any
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024 # bytes on macOS, kB elsewhere
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def enable(metrics_file=None, profile_dir=None):
+    """Enables the metrics and profiles for this process and the processes it starts."""
+    if metrics_file:
+        os.environ["NTV_METRICS"] = os.path.abspath(metrics_file)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        os.environ["NTV_PROFILE"] = os.path.abspath(profile_dir)
+
+def record(stage, elf=None, wall=0.0, cpu=None, counts=None):
+    """
+    Appends the record of a stage to the metrics file, with the rate of each count
+    (<count>_per_s). Does nothing without NTV_METRICS.
+
+    Returns:
+        dict: The record.
+    """
+    entry = {"time": time.time(), "pid": os.getpid(), "stage": stage, "elf": elf,
+             "wall_s": round(wall, 6), "cpu_s": None if cpu is None else round(cpu, 6),
+             "peak_rss_mb": round(_peak_rss_mb(), 1)}
+    for name, value in (counts or {}).items():
+        entry[name] = value
+        entry[f"{name}_per_s"] = round(value / wall, 1) if wall > 0 else None
+    path = os.environ.get("NTV_METRICS")
+    if path:
+        # one write per record in append mode: the lines of concurrent processes do not mix
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+    return entry
+
+class Stage:
+    """
+    Context manager measuring a stage of one ELF: wall time, CPU time (of this process and
+    of the child processes it waited for, e.g. spike) and the peak RSS of the process so far.
+    Item counts are added with `count`. With NTV_PROFILE the stage runs under cProfile,
+    unless a stage it is nested in already does.
+
+    Args:
+        name (str): The stage, e.g. "simulation".
+        elf (str): The ELF name (or path, only the name is kept).
+        timings (dict): Optional, receives name -> wall time (see results_db).
+    """
+    def __init__(self, name, elf=None, timings=None):
+        self.name = name
+        self.elf = os.path.splitext(os.path.basename(elf))[0] if elf else None
+        self.timings = timings
+        self.counts = {}
+        self.seconds = None
+        self._profiler = None
+
+    def count(self, name, value=1):
+        """Adds `value` to the count `name` (lines, entries, cycles, ...)."""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def __enter__(self):
+        if os.environ.get("NTV_PROFILE") and getattr(_local, "profiler", None) is None:
+            self._profiler = _local.profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._cpu = _cpu_seconds()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        cpu = _cpu_seconds() - self._cpu
+        if self._profiler is not None:
+            self._profiler.disable()
+            _local.profiler = None
+            self._profiler.dump_stats(os.path.join(os.environ["NTV_PROFILE"], f"{self.elf or 'all'}.{self.name}.prof"))
+        if self.timings is not None:
+            self.timings[self.name] = self.timings.get(self.name, 0.0) + self.seconds
+        record(self.name if exc_type is None else f"{self.name} (failed)", self.elf, self.seconds, cpu, self.counts)
+
+def trace_stage(path, action):
+    """Stage of an operation on a trace file, e.g. "spike_json_load" for 000_addi.spike.json."""
+    elf_name, stage = trace_format.split_trace_name(os.path.basename(path))
+    return Stage(f"{stage}_{action}" if stage else action, elf_name)
+
+def load(path):
+    """Records of a metrics file, skipping a line cut by a killed process."""
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def write_csv(path, records):
+    """Writes records as CSV, one column per field found in any record."""
+    fields = []
+    for entry in records:
+        fields.extend(name for name in entry if name not in fields)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(records)
+
+def summarize(records):
+    """
+    Totals per stage: number of records, wall and CPU time, largest peak RSS, counts and
+    their rates over the total wall time.
+
+    Returns:
+        dict: stage -> totals, in order of first appearance.
+    """
+    totals = {}
+    for entry in records:
+        total = totals.setdefault(entry["stage"], {"runs": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0, "counts": {}})
+        total["runs"] += 1
+        total["wall_s"] += entry["wall_s"]
+        total["cpu_s"] += entry["cpu_s"] or 0.0
+        total["peak_rss_mb"] = max(total["peak_rss_mb"], entry["peak_rss_mb"])
+        for name, value in entry.items():
+            if name.endswith("_per_s") or f"{name}_per_s" not in entry:
+                continue
+            total["counts"][name] = total["counts"].get(name, 0) + value
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize or export the stage metrics written with --metrics")
+    parser.add_argument("metrics_file", help="Metrics file (JSON lines)")
+    parser.add_argument("--csv", type=str, help="Export the records to this CSV file")
+    parser.add_argument("--json", type=str, help="Export the records to this JSON file (one array)")
+    parser.add_argument("--elf", type=str, help="Only the records of this ELF")
+    args = parser.parse_args()
+
+    records = load(args.metrics_file)
+    if args.elf:
+        records = [entry for entry in records if entry["elf"] == args.elf]
+    if args.csv:
+        write_csv(args.csv, records)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(records, f, indent=1)
+
+    print(f"{'stage':<28} {'runs':>5} {'wall (s)':>10} {'cpu (s)':>10} {'peak RSS (MB)':>14}  counts")
+    for stage, total in summarize(records).items():
+        rates = ", ".join(f"{value} {name} ({value / total['wall_s']:.0f}/s)" if total["wall_s"] > 0 else f"{value} {name}"
+                          for name, value in total["counts"].items())
+        print(f"{stage:<28} {total['runs']:>5} {total['wall_s']:>10.2f} {total['cpu_s']:>10.2f} {total['peak_rss_mb']:>14.1f}  {rates}")
@@ -0,0 +1,395 @@
+# This module contains the per-ELF verification pipeline: the spike trace, the DUT
+# simulation and the comparison of every ELF are scheduled on their own worker pools, so
+# that spike and the comparisons of other tests run while the DUT simulates, and the
+# result of each test is known as soon as its two traces exist.
+#
+# The stages of an ELF form a small graph: ELF -> spike trace, ELF + makefile + testbench
+# configuration -> fragmented trace, both traces -> comparison. Each stage has a key, the
+# digest of its inputs and of the code that runs it, saved with its result in
+# <output>/pipeline_state.json. A stage whose key did not change since the last run, and
+# whose outputs are still there, is not run again.
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cache_utils
+import compare_traces
+import exec_trace
+import metrics
+import results_db
+import spike_trace
+import trace_format
+
+STATE_FILE = "pipeline_state.json"
+STATE_VERSION = 3 # bump when the keys or the results change
+STATE_SAVE_INTERVAL = 5.0 # seconds between two writes of the state file, see PipelineState.flush
+COMPARE_FIELDS = ("status", "mismatches", "first_pc", "seconds") # saved results of the comparisons
+REPORT_EXTENSION = ".compare.txt"
+
+# Modules whose code makes the output of a stage, part of its key
+DUT_SOURCES = ("exec_trace.py", "elf_reader.py", "sparse_memory.py", "regfile_monitor.py", "debug_trace.py",
+               "trace_format.py", "compare_traces.py", "rv_decode.py")
+COMPARE_SOURCES = ("compare_traces.py", "rv_decode.py", "trace_format.py")
+
+def sources_digest(sources):
+    """Digest of modules of this folder, e.g. DUT_SOURCES."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return cache_utils.text_digest(*(cache_utils.file_digest(os.path.join(directory, source)) for source in sources))
+
+def file_stamp(path):
+    """Size and modification time of a file, to tell if it changed since a stage wrote it."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+class PipelineState:
+    """
+    Keys, outputs and results of the stages run so far, in a JSON file of the output folder.
+
+    Args:
+        path (str): The state file.
+        force (bool): Ignore the saved state, every stage runs again.
+    """
+    def __init__(self, path, force=False):
+        self.path = path
+        self.nodes = {}
+        self._written = time.time()
+        self._dirty = False
+        if force:
+            return
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                self.nodes = state["nodes"]
+        except (OSError, ValueError, KeyError):
+            pass # first run, or unreadable state: everything runs
+
+    def lookup(self, node, key):
+        """
+        The result saved for `node` ("<elf>/<stage>") if its key is `key` and its outputs
+        were not changed since, else None.
+        """
+        saved = self.nodes.get(node)
+        if saved is None or saved["key"] != key:
+            return None
+        for path, stamp in saved["outputs"].items():
+            try:
+                if file_stamp(path) != stamp:
+                    return None
+            except OSError:
+                return None
+        return saved["result"]
+
+    def save(self, node, key, outputs, result):
+        """
+        Record that `node` ran with `key`, wrote the files `outputs` and gave `result`. The
+        file is written at most every STATE_SAVE_INTERVAL seconds, and by flush.
+        """
+        self.nodes[node] = {"key": key, "outputs": {path: file_stamp(path) for path in outputs if os.path.exists(path)},
+                            "result": result}
+        self._dirty = True
+        if time.time() - self._written >= STATE_SAVE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Writes the state file if a stage was saved since the last write."""
+        if not self._dirty:
+            return
+        cache_utils.atomic_write(self.path, json.dumps({"version": STATE_VERSION, "nodes": self.nodes}).encode("utf-8"))
+        self._written = time.time()
+        self._dirty = False
+
+def elf_list(elf_file=None, elf_folder=None):
+    """Absolute paths of the ELF file, or of the *.elf files of the folder, sorted."""
+    if elf_file:
+        return [os.path.abspath(elf_file)]
+    elf_files = [os.path.abspath(os.path.join(elf_folder, name)) for name in sorted(os.listdir(elf_folder))]
+    return [elf_file for elf_file in elf_files if os.path.isfile(elf_file) and elf_file.endswith(".elf")]
+
+class Pipeline:
+    """
+    Verifies a list of ELF files, each one going through spike, the DUT simulation (one
+    simulator launch per ELF, see exec_trace.run_simulation) and the comparison
+    (compare_traces.compare_job). Spike and the DUT of an ELF run at the same time, and its
+    comparison starts as soon as both are over; the comparison of a test whose DUT timed
+    out still runs, to show where it diverged. With lockstep, the DUT of an ELF starts once
+    its spike trace exists and is compared with it while it runs.
+
+    Stages whose key is unchanged (see PipelineState) are skipped and give their saved
+    result; failures of the tools themselves ("error") are not saved, they always run again.
+
+    Args:
+        elf_files (list): Absolute paths of the ELF files.
+        makefile (str): Makefile of the processor.
+        reg_file_json, manual_flags_json (str): Testbench configuration files.
+        output_dir (str): Directory of the traces, the simulations are run in output_dir/sim.
+        jobs (int): Simulations run at the same time.
+        spike_jobs, compare_jobs (int): Worker processes of spike and of the comparisons.
+        force (bool): Run every stage, even the up to date ones.
+    """
+    def __init__(self, elf_files, makefile, reg_file_json, manual_flags_json, output_dir, jobs=1, spike_jobs=1,
+                 compare_jobs=1, spike_path="spike", trace_output_format="binary", use_cache=True, lockstep=False,
+                 shared_build=True, verbose=False, debug_level=1, debug_depth=64, force=False):
+        self.elf_files = elf_files
+        self.makefile = os.path.abspath(makefile)
+        self.reg_file_json = reg_file_json
+        self.manual_flags_json = manual_flags_json
+        self.debug_level, self.debug_depth = debug_level, debug_depth
+        self.output_dir = os.path.abspath(output_dir)
+        self.sim_dir = os.path.join(self.output_dir, "sim")
+        self.jobs, self.spike_jobs, self.compare_jobs = max(jobs, 1), max(spike_jobs, 1), max(compare_jobs, 1)
+        self.spike_path = spike_path
+        self.trace_output_format = trace_output_format
+        self.use_cache = use_cache
+        self.lockstep = lockstep
+        self.shared_build = shared_build
+        self.verbose = verbose
+        self.env = exec_trace.testbench_environment(reg_file_json, manual_flags_json, self.output_dir, trace_output_format,
+                                                    debug_level, debug_depth, self.output_dir if lockstep else "")
+        self.clean_command, self.make_command = exec_trace.make_commands(self.makefile)
+        self.state = PipelineState(os.path.join(self.output_dir, STATE_FILE), force)
+        self.results = []
+        self._digests = {}
+
+    def digest(self, path):
+        """Digest of an input file, computed once per run (as the keys); empty for a missing optional file."""
+        if path not in self._digests:
+            self._digests[path] = cache_utils.file_digest(path) if path and os.path.isfile(path) else ""
+        return self._digests[path]
+
+    def spike_key(self, elf_file):
+        if (elf_file, "spike") not in self._digests:
+            self._digests[(elf_file, "spike")] = cache_utils.text_digest("spike", spike_trace.spike_cache_key(elf_file, self.spike_path),
+                                                                         self.trace_output_format)
+        return self._digests[(elf_file, "spike")]
+
+    def dut_key(self, elf_file):
+        return cache_utils.text_digest("dut", self.digest(elf_file), self.digest(self.makefile), self.digest(self.reg_file_json),
+                                       self.digest(self.manual_flags_json), sources_digest(DUT_SOURCES),
+                                       self.trace_output_format, self.debug_level, self.debug_depth,
+                                       self.spike_key(elf_file) if self.lockstep else "")
+
+    def compare_key(self, spike_path, dut_path):
+        # the contents of the traces: a trace written again with the same entries keeps its key
+        return cache_utils.text_digest("compare", cache_utils.file_digest(spike_path), cache_utils.file_digest(dut_path),
+                                       sources_digest(COMPARE_SOURCES), self.trace_output_format)
+
+    def simulate(self, elf_file):
+        """DUT simulation of one ELF in its own job directory. Returns its status."""
+        name = os.path.splitext(os.path.basename(elf_file))[0]
+        job_dir = os.path.join(self.sim_dir, "jobs", name)
+        build_dir = os.path.join(self.sim_dir, "build") if self.shared_build else os.path.join(job_dir, "sim_build")
+        return exec_trace.run_simulation(self.make_command + [f"SIM_BUILD={build_dir}"], self.env, job_dir, [elf_file],
+                                         self.verbose)[0]
+
+    def result(self, elf_file, spike, dut, comparison):
+        """
+        Status of one ELF from the outcome of its stages: "passed" if the DUT reached tohost
+        and its trace matches spike, else "mismatch", the DUT status ("timeout", "error")
+        or "error" if spike failed.
+        """
+        if spike["error"] is not None:
+            status, message = "error", f"spike: {spike['error']}"
+        elif comparison is not None and comparison["status"] != "passed":
+            status = comparison["status"]
+            message = comparison.get("message") or f"{comparison['mismatches']} mismatch(es), first at pc 0x{comparison['first_pc']:08x}"
+        elif dut["status"] != "passed":
+            status, message = dut["status"], dut.get("message", "")
+        else:
+            status, message = "passed", ""
+        return {
+            "elf": elf_file,
+            "status": status,
+            "message": message,
+            "spike_seconds": spike["seconds"],
+            "dut_seconds": dut["seconds"] if dut else None,
+            "compare_seconds": comparison["seconds"] if comparison else None,
+            "mismatches": comparison["mismatches"] if comparison else None,
+            "first_pc": comparison["first_pc"] if comparison else None,
+        }
+
+    def report_path(self, elf_file):
+        """File of the report (the printed mismatches) of the comparison of an ELF."""
+        return os.path.join(self.output_dir, os.path.splitext(os.path.basename(elf_file))[0] + REPORT_EXTENSION)
+
+    def report(self, result, comparison, up_to_date=False):
+        """
+        Prints the result of one ELF, with the mismatches found by its comparison, read
+        back from its report file (see report_path).
+        """
+        result["up_to_date"] = up_to_date
+        self.results.append(result)
+        if comparison is not None and comparison["status"] != "passed" and os.path.exists(self.report_path(result["elf"])):
+            with open(self.report_path(result["elf"]), "r") as f:
+                shutil.copyfileobj(f, sys.stdout)
+        color = "\033[96m" if result["status"] == "passed" else "\033[91m"
+        message = f": {result['message']}" if result["message"] else ""
+        print(f"{color}[{len(self.results)}/{len(self.elf_files)}] {os.path.basename(result['elf'])} {result['status']}"
+              f"{message}{' (up to date)' if up_to_date else ''}\033[0m", flush=True)
+
+    def run(self):
+        """
+        Runs every stage of every ELF that is not up to date. Prints each result as soon as
+        it is known.
+
+        Returns:
+            list: The result of each ELF (see result), in completion order, with up_to_date
+            True if no stage of the ELF ran.
+        """
+        try:
+            return self._run()
+        finally:
+            self.state.flush() # the stages saved since the last write, also after an error
+
+    def _run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not self.state.nodes: # first run or --force: build the simulator from scratch
+            subprocess.run(self.clean_command + [f"SIM_BUILD={os.path.join(self.sim_dir, 'build')}"], check=True, env=self.env,
+                           stdout=None if self.verbose else subprocess.DEVNULL, stderr=None if self.verbose else subprocess.DEVNULL)
+
+        spike = {}      # elf file -> {"error", "seconds"}
+        dut = {}        # elf file -> status of run_simulation
+        keys = {}       # (elf file, stage) -> key of the stage
+        skipped = {}    # elf file -> number of stages up to date
+        stage = {}      # future -> (stage, elf file)
+        waiting_dut = list(self.elf_files) # not submitted to the simulators yet
+        build_pending = self.shared_build  # the first simulation builds the simulator alone
+
+        def node(elf_file, name):
+            return f"{os.path.splitext(os.path.basename(elf_file))[0]}/{name}"
+
+        def cached(elf_file, name, key):
+            keys[(elf_file, name)] = key
+            result = self.state.lookup(node(elf_file, name), key)
+            if result is not None:
+                skipped[elf_file] = skipped.get(elf_file, 0) + 1
+            return result
+
+        with ProcessPoolExecutor(max_workers=self.spike_jobs) as spike_pool, \
+             ThreadPoolExecutor(max_workers=self.jobs) as dut_pool, \
+             ProcessPoolExecutor(max_workers=self.compare_jobs) as compare_pool:
+
+            def submit_dut():
+                running = sum(1 for name, _ in stage.values() if name == "dut")
+                for elf_file in list(waiting_dut):
+                    if running >= (1 if build_pending else self.jobs):
+                        break
+                    if self.lockstep and elf_file not in spike:
+                        continue
+                    waiting_dut.remove(elf_file)
+                    if self.lockstep and spike[elf_file]["error"] is not None:
+                        # nothing to compare with, reported as a spike error
+                        dut[elf_file] = {"elf": elf_file, "status": "error", "message": "not simulated", "seconds": 0.0}
+                        submit_compare(elf_file)
+                        continue
+                    result = cached(elf_file, "dut", self.dut_key(elf_file))
+                    if result is not None:
+                        dut[elf_file] = result
+                        if elf_file in spike:
+                            submit_compare(elf_file)
+                        continue
+                    stage[dut_pool.submit(self.simulate, elf_file)] = ("dut", elf_file)
+                    running += 1
+
+            def submit_compare(elf_file):
+                name = os.path.splitext(os.path.basename(elf_file))[0]
+                spike_path = trace_format.find_trace(self.output_dir, name, "spike")
+                dut_path = trace_format.find_trace(self.output_dir, name, "fragmented")
+                if spike[elf_file]["error"] is not None or dut_path is None or dut[elf_file]["status"] == "error":
+                    self.report(self.result(elf_file, spike[elf_file], dut[elf_file], None), None)
+                    return
+                comparison = cached(elf_file, "compare", self.compare_key(spike_path, dut_path))
+                if comparison is not None:
+                    self.report(self.result(elf_file, spike[elf_file], dut[elf_file], comparison), comparison,
+                                skipped[elf_file] == 3)
+                    return
+                stage[compare_pool.submit(compare_traces.compare_job, spike_path, dut_path, name, self.output_dir,
+                                          self.trace_output_format)] = ("compare", elf_file)
+
+            for elf_file in self.elf_files:
+                result = cached(elf_file, "spike", self.spike_key(elf_file))
+                if result is not None:
+                    spike[elf_file] = result
+                    continue
+                stage[spike_pool.submit(spike_trace.spike_job, elf_file, self.output_dir, self.spike_path,
+                                        self.trace_output_format, False, self.use_cache)] = ("spike", elf_file)
+            submit_dut()
+
+            while stage:
+                done, _ = wait(list(stage), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, elf_file = stage.pop(future)
+                    trace_name = os.path.splitext(os.path.basename(elf_file))[0]
+                    if name == "spike":
+                        _, output_file, error, seconds = future.result()
+                        spike[elf_file] = {"error": error, "seconds": seconds}
+                        if error is None:
+                            self.state.save(node(elf_file, name), keys[(elf_file, name)], [output_file], spike[elf_file])
+                    elif name == "dut":
+                        dut[elf_file] = future.result()
+                        build_pending = False
+                        if dut[elf_file]["status"] != "error":
+                            self.state.save(node(elf_file, name), keys[(elf_file, name)],
+                                            [trace_format.trace_path(self.output_dir, trace_name, "fragmented", self.trace_output_format)],
+                                            dut[elf_file])
+                    else:
+                        comparison = future.result()
+                        with open(self.report_path(elf_file), "w") as f:
+                            f.write(comparison.pop("output"))
+                        if comparison["status"] != "error":
+                            self.state.save(node(elf_file, name), keys[(elf_file, name)],
+                                            [trace_format.trace_path(self.output_dir, trace_name, "final", self.trace_output_format),
+                                             self.report_path(elf_file)],
+                                            {field: comparison[field] for field in COMPARE_FIELDS})
+                        self.report(self.result(elf_file, spike[elf_file], dut[elf_file], comparison), comparison)
+                        continue
+                    if elf_file in spike and elf_file in dut:
+                        submit_compare(elf_file)
+                submit_dut()
+        return self.results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run spike, the DUT simulation and the trace comparison of every ELF, overlapped.")
+    parser.add_argument("--makefile", "-m", required=True, type=str, help="Path to the makefile to use.")
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--elf_file", "-e", type=str, help="Path to a single ELF file to verify.")
+    group.add_argument("--elf_folder", "-E", type=str, help="Path to the folder containing ELF files to verify.")
+
+    parser.add_argument("--reg_file_json", "-r", required=True, type=str, help="Path to the register file JSON generated by regfile_finder.py.")
+    parser.add_argument("--manual_flags_json", "-f", required=False, type=str, default="", help="Path to the manual flags (array, memory-alignment, etc) JSON file.")
+    parser.add_argument("--output_dir", "-o", required=True, type=str, help="Directory to store the traces.")
+    parser.add_argument("--spike_path", "-s", type=str, default="spike", help="Path to the Spike binary (default: 'spike').")
+    parser.add_argument("--format", "-F", type=str, choices=["binary", "json"], default="binary", help="Trace format (default: binary).")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of simulations run in parallel (default: 1).")
+    parser.add_argument("--spike-jobs", type=int, default=1, help="Number of spike processes run in parallel (default: 1).")
+    parser.add_argument("--compare-jobs", type=int, default=1, help="Number of comparisons run in parallel (default: 1).")
+    parser.add_argument("--no-cache", action="store_true", help="Always run spike, without using the trace cache.")
+    parser.add_argument("--lockstep", action="store_true", help="Compare with spike while simulating; the simulation of an ELF waits for its spike trace.")
+    parser.add_argument("--separate-builds", action="store_true", help="Build the simulator once per ELF, for simulators whose build cannot be shared by concurrent runs.")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show the output of the make commands.")
+    parser.add_argument("--force", action="store_true", help="Run every stage, even the ones whose inputs did not change since the last run.")
+    parser.add_argument("--metrics", type=str, help="Append the wall time, CPU time, peak RSS and counts of every stage to this JSON lines file (see metrics.py).")
+    parser.add_argument("--profile", action="store_true", help="Run every stage under cProfile and write <elf>.<stage>.prof next to the traces.")
+    parser.add_argument("--results-db", type=str, help="Record the result of every simulation and comparison in this SQLite database (see results_db.py).")
+    args = parser.parse_args()
+    metrics.enable(args.metrics, args.output_dir if args.profile else None) # before the workers and simulations start
+    results_db.enable(args.results_db)
+
+    start = time.time()
+    pipeline = Pipeline(elf_list(args.elf_file, args.elf_folder), args.makefile, args.reg_file_json, args.manual_flags_json,
+                        args.output_dir, args.jobs, args.spike_jobs, args.compare_jobs, args.spike_path, args.format,
+                        not args.no_cache, args.lockstep, not args.separate_builds, args.verbose, force=args.force)
+    results = pipeline.run()
+    failed = [result for result in results if result["status"] != "passed"]
+    up_to_date = sum(1 for result in results if result["up_to_date"])
+    print(f"{len(results) - len(failed)}/{len(results)} tests passed in {time.time() - start:.1f}s ({up_to_date} up to date)")
+    if failed:
+        exit(1)
@@ -0,0 +1,133 @@
+# This module contains the register file monitors of the exec_trace.py testbench. Every
+# cycle the testbench calls sample(), which appends the register writes of the cycle to
+# the regfile commits of the fragmented trace.
+
+import cocotb
+from cocotb.triggers import Edge
+
+EDGE_CHECK_CYCLES = 2000 # first cycles in which EdgeMonitor also polls every register
+
+class PollingMonitor:
+    """
+    Reads every register of the register file array each cycle and commits the ones
+    whose value changed since the previous cycle, in register order.
+
+    Args:
+        reg_file: cocotb handle of the register file array.
+        available_regs (list): Indexes of the registers present in the array.
+    """
+    def __init__(self, reg_file, available_regs):
+        self.reg_file = reg_file
+        self.available_regs = available_regs
+        self.old_regfile = {}
+
+    def start(self, tasks):
+        """Take the reference values, after the reset."""
+        for i in self.available_regs:
+            self.old_regfile[i] = self.reg_file[i].value
+
+    def sample(self, regfile_commits):
+        for i in self.available_regs:
+            value = self.reg_file[i].value
+            if value != self.old_regfile[i]:
+                if i != 0: # x0 should be always zero
+                    regfile_commits.append((i, value.integer))
+                self.old_regfile[i] = value
+
+    def verify(self, log):
+        return True
+
+class EdgeMonitor(PollingMonitor):
+    """
+    Same commits as PollingMonitor, but a value-change trigger on each register marks
+    it as changed, and sample() only reads those. Needs simulator support for value
+    change callbacks on the array elements. To tell if the simulator gives them, the
+    first `check_cycles` samples also poll every register, and a change found there but
+    not notified is a missed commit; at the end, verify() also compares the array with
+    the last committed values. Either way, the testbench then fails the program.
+
+    Past the checked cycles, a missed write is only detected if it changes the final
+    value of its register: a missed intermediate value goes unnoticed.
+    """
+    def __init__(self, reg_file, available_regs, check_cycles=EDGE_CHECK_CYCLES):
+        super().__init__(reg_file, [i for i in available_regs if i != 0]) # x0 never commits
+        self.changed = set()
+        self.check_cycles = check_cycles
+        self.missed = set()
+
+    def start(self, tasks):
+        super().start(tasks)
+        for i in self.available_regs:
+            tasks.append(cocotb.start_soon(self._watch(i)))
+
+    async def _watch(self, i):
+        handle = self.reg_file[i]
+        while True:
+            await Edge(handle)
+            self.changed.add(i)
+
+    def sample(self, regfile_commits):
+        if self.check_cycles:
+            self.check_cycles -= 1
+            for i in self.available_regs:
+                if i not in self.changed and self.reg_file[i].value != self.old_regfile[i]:
+                    self.missed.add(i)
+                    self.changed.add(i) # committed anyway
+        if not self.changed:
+            return
+        for i in sorted(self.changed):
+            value = self.reg_file[i].value
+            if value != self.old_regfile[i]:
+                regfile_commits.append((i, value.integer))
+                self.old_regfile[i] = value
+        self.changed.clear()
+
+    def verify(self, log):
+        """
+        Tells if no commit was missed in the checked cycles, and compares the array with
+        the last committed values, once at the end of the program.
+        """
+        missed = sorted(self.missed.union(i for i in self.available_regs if self.reg_file[i].value != self.old_regfile[i]))
+        if missed:
+            log.warning("Register changes of %s were not notified by the simulator, "
+                        "set REGFILE_MONITOR to \"poll\"", ", ".join(f"x{i}" for i in missed))
+        return not missed
+
+class WritePortMonitor:
+    """
+    Watches the write port of the register file (enable, address and data): one handle
+    read per cycle while no register is written. A write is seen in the cycle it is
+    requested, one cycle before it shows in the array.
+
+    Args:
+        write_enable, write_addr, write_data: cocotb handles of the write port.
+        reg_file: cocotb handle of the register file array, if available. A write is then
+            committed only if it changes the register, as the array monitors do; otherwise
+            every write is committed.
+        available_regs (list): Indexes of the registers present in the array.
+    """
+    def __init__(self, write_enable, write_addr, write_data, reg_file=None, available_regs=()):
+        self.write_enable = write_enable
+        self.write_addr = write_addr
+        self.write_data = write_data
+        self.reg_file = reg_file
+        self.available_regs = available_regs
+        self.shadow = {}
+
+    def start(self, tasks):
+        self.shadow = {i: 0 for i in range(32)}
+        if self.reg_file is not None:
+            for i in self.available_regs:
+                self.shadow[i] = self.reg_file[i].value.integer
+
+    def sample(self, regfile_commits):
+        if self.write_enable.value == 1:
+            write_addr = self.write_addr.value.integer
+            if write_addr != 0:
+                write_data = self.write_data.value.integer
+                if self.reg_file is None or self.shadow[write_addr] != write_data:
+                    regfile_commits.append((write_addr, write_data))
+                self.shadow[write_addr] = write_data
+
+    def verify(self, log):
+        return True
@@ -0,0 +1,219 @@
+# This module contains the local database of verification results (SQLite): every DUT
+# simulation (exec_trace.py) and every comparison (compare_traces.py) of an ELF adds a row,
+# so the history of a test suite can be queried without running it again.
+#
+# Nothing is recorded unless a database is given: the scripts take --results-db FILE,
+# which sets NTV_RESULTS_DB, so the worker processes and the testbench inherit it.
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,          -- end of the run, seconds since the epoch
+    tool TEXT NOT NULL,          -- "exec_trace" or "compare_traces"
+    processor TEXT,
+    elf TEXT NOT NULL,           -- ELF name, without folder and extension
+    elf_digest TEXT,             -- SHA-256 of the ELF, when the tool reads it
+    inputs_digest TEXT,          -- SHA-256 of the other inputs of the run
+    status TEXT NOT NULL,        -- passed, mismatch, timeout or error
+    message TEXT,
+    mismatches INTEGER,
+    first_index INTEGER,         -- first divergence: spike entry and its pc
+    first_pc INTEGER,
+    cycles INTEGER,
+    instructions INTEGER,
+    seconds REAL,
+    timings TEXT                 -- JSON object, stage -> seconds
+);
+CREATE INDEX IF NOT EXISTS runs_processor_elf ON runs (processor, elf, time);
+CREATE INDEX IF NOT EXISTS runs_elf ON runs (elf, time);
+CREATE INDEX IF NOT EXISTS runs_status ON runs (status, time);
+CREATE INDEX IF NOT EXISTS runs_inputs ON runs (inputs_digest);
+"""
+
+COLUMNS = ("time", "tool", "processor", "elf", "elf_digest", "inputs_digest", "status", "message", "mismatches",
+           "first_index", "first_pc", "cycles", "instructions", "seconds", "timings")
+
+_connections = {} # (path, pid, thread) -> connection of record_run, opened once
+
+def enable(path):
+    """Records the runs of this process and of the processes it starts in `path`."""
+    if path:
+        os.environ["NTV_RESULTS_DB"] = os.path.abspath(path)
+
+def database_path():
+    """
+    Path of the results database.
+
+    Returns:
+        str: $NTV_RESULTS_DB, or None if no runs are recorded.
+    """
+    return os.environ.get("NTV_RESULTS_DB") or None
+
+def connect(path=None):
+    """
+    Opens the results database (database_path by default), creating it if needed.
+
+    Returns:
+        sqlite3.Connection: The connection, rows are sqlite3.Row.
+    """
+    path = path or database_path()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # the simulations and comparisons of a batch write at the same time
+    connection = sqlite3.connect(path, timeout=60)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        connection.close()
+        raise ValueError(f"{path} uses results database version {version}, newer than supported {SCHEMA_VERSION}.")
+    with connection:
+        connection.executescript(SCHEMA)
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return connection
+
+def _shared_connection(path):
+    """The connection of this thread to `path`, opened and initialized on first use."""
+    # sqlite connections cannot be shared with another thread, nor with a forked worker
+    key = (path, os.getpid(), threading.get_ident())
+    if key not in _connections:
+        _connections[key] = connect(path)
+    return _connections[key]
+
+def record_run(tool, elf, status, **fields):
+    """
+    Adds the result of a run to the database. The run itself never fails because of the
+    database: errors are printed and the row is dropped.
+
+    Args:
+        tool (str): "exec_trace" or "compare_traces".
+        elf (str): The ELF name, or path (only the name is kept).
+        status (str): passed, mismatch, timeout or error.
+        fields: The other columns (see SCHEMA), missing ones are NULL and unknown ones
+            are printed and dropped. timings is a dictionary.
+    Returns:
+        bool: True if the row was added.
+    """
+    path = database_path()
+    if path is None:
+        return False
+    row = dict(fields, tool=tool, elf=os.path.splitext(os.path.basename(elf))[0], status=status)
+    row.setdefault("time", time.time())
+    try:
+        unknown = set(row) - set(COLUMNS)
+        if unknown:
+            print(f"Unknown results database columns dropped from the result of {row['elf']}: {', '.join(sorted(unknown))}")
+        if row.get("timings") is not None:
+            row["timings"] = json.dumps(row["timings"], sort_keys=True)
+        connection = _shared_connection(path)
+        with connection:
+            connection.execute(f"INSERT INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                               [row.get(column) for column in COLUMNS])
+    except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+        print(f"Could not record the result of {row['elf']} in {path}: {e}")
+        return False
+    return True
+
+def query_runs(connection, elf=None, processor=None, status=None, tool=None, limit=50):
+    """
+    Latest runs, optionally filtered by ELF name, processor, status and tool.
+
+    Returns:
+        list: sqlite3.Row rows, most recent first.
+    """
+    conditions, parameters = [], []
+    for column, value in (("elf", elf), ("processor", processor), ("status", status), ("tool", tool)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return connection.execute(f"SELECT * FROM runs {where} ORDER BY time DESC LIMIT ?", parameters + [limit]).fetchall()
+
+def slowest_elfs(connection, tool="exec_trace", processor=None, limit=20):
+    """
+    ELF files by the duration of their latest run with `tool`, slowest first.
+
+    Returns:
+        list: (elf, processor, seconds) tuples.
+    """
+    condition, parameters = ("AND processor = ?", [processor]) if processor is not None else ("", [])
+    return connection.execute(f"""
+        SELECT elf, processor, seconds FROM runs AS latest
+        WHERE tool = ? {condition} AND seconds IS NOT NULL
+          AND time = (SELECT MAX(time) FROM runs WHERE tool = latest.tool AND elf = latest.elf
+                      AND processor IS latest.processor)
+        ORDER BY seconds DESC LIMIT ?""", [tool] + parameters + [limit]).fetchall()
+
+def status_changes(connection, processor=None, limit=50):
+    """
+    Runs whose status differs from the previous run of the same tool, processor and ELF,
+    e.g. the tests that started failing (or passing) and when.
+
+    Returns:
+        list: sqlite3.Row rows with the previous status as previous_status, most recent first.
+    """
+    condition, parameters = ("WHERE processor = ?", [processor]) if processor is not None else ("", [])
+    return connection.execute(f"""
+        SELECT * FROM (
+            SELECT *, LAG(status) OVER (PARTITION BY tool, processor, elf ORDER BY time) AS previous_status
+            FROM runs {condition})
+        WHERE previous_status IS NOT NULL AND previous_status != status
+        ORDER BY time DESC LIMIT ?""", parameters + [limit]).fetchall()
+
+def format_run(row):
+    """One line describing a run, for printing."""
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["time"]))
+    details = []
+    if row["mismatches"]:
+        details.append(f"{row['mismatches']} mismatches")
+    if row["first_pc"] is not None:
+        index = f"entry {row['first_index']}, " if row["first_index"] is not None else ""
+        details.append(f"first divergence {index}pc 0x{row['first_pc']:08x}")
+    if row["cycles"] is not None:
+        details.append(f"{row['cycles']} cycles")
+    if row["instructions"] is not None:
+        details.append(f"{row['instructions']} instructions")
+    if row["seconds"] is not None:
+        details.append(f"{row['seconds']:.1f}s")
+    if row["message"]:
+        details.append(row["message"])
+    return f"{when} {row['tool']:<14} {row['processor'] or '-':<12} {row['elf']:<24} {row['status']:<8} {', '.join(details)}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the history of verification results")
+    parser.add_argument("--database", type=str, help="Database file (default: $NTV_RESULTS_DB)")
+    parser.add_argument("--elf", type=str, help="Only the runs of this ELF (name without extension)")
+    parser.add_argument("--processor", "-p", type=str, help="Only the runs on this processor")
+    parser.add_argument("--status", type=str, help="Only the runs with this status")
+    parser.add_argument("--tool", type=str, choices=["exec_trace", "compare_traces"], help="Only the runs of this tool")
+    parser.add_argument("--changes", action="store_true", help="Show the runs whose status changed since the previous run of the same test")
+    parser.add_argument("--slowest", action="store_true", help="Show the ELF files by the duration of their latest run, slowest first")
+    parser.add_argument("--limit", "-n", type=int, default=50, help="Number of rows shown (default: 50)")
+    args = parser.parse_args()
+
+    path = args.database or database_path()
+    if path is None:
+        parser.error("No results database, pass --database or set NTV_RESULTS_DB")
+    if not os.path.exists(path):
+        parser.error(f"No results recorded yet ({path} does not exist)")
+    connection = connect(path)
+    if args.slowest:
+        for elf, processor, seconds in slowest_elfs(connection, args.tool or "exec_trace", args.processor, args.limit):
+            print(f"{seconds:10.1f}s {processor or '-':<12} {elf}")
+    elif args.changes:
+        for row in status_changes(connection, args.processor, args.limit):
+            print(f"{format_run(row)} (was {row['previous_status']})")
+    else:
+        for row in query_runs(connection, args.elf, args.processor, args.status, args.tool, args.limit):
+            print(format_run(row))
+    connection.close()
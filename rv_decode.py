@@ -0,0 +1,100 @@
+# This module contains the instruction classification used to align the traces: a decode
+# table indexed by opcode and funct3 gives the class of an instruction and the width of
+# its store. A whole array of fetched instructions is classified with one NumPy lookup.
+
+"""
+Decode table
+
+The index of a 32-bit instruction is opcode << 3 | funct3 (bits [6:0] and [14:12]). Their
+opcode always ends in 0b11, so the indexes of opcodes 0, 1 and 2 are free for compressed
+instructions, indexed by quadrant << 3 | funct3 (bits [1:0] and [15:13]).
+
+Each entry holds a class and, for stores, the number of bytes written. An extension is a
+list of rows (opcode or quadrant, funct3 or None for all of them, class, store bytes)
+given to DecodeTable; no code changes are needed. The M extension shares the OP opcode of
+RV32I (funct7 = 1), so it is already classified as CLASS_REG.
+"""
+
+import numpy as np
+
+CLASS_UNKNOWN = 0
+CLASS_LOAD = 1
+CLASS_STORE = 2
+CLASS_BRANCH = 3
+CLASS_JUMP = 4
+CLASS_REG = 5   # integer computation writing rd
+CLASS_FENCE = 6
+CLASS_CSR = 7
+CLASS_NAMES = ("unknown", "load", "store", "branch", "jump", "reg", "fence", "csr")
+
+# Classes whose instructions write rd, so the DUT commits a register unless rd is x0
+WRITES_RD = (False, True, False, False, True, True, False, True)
+
+TABLE_SIZE = 1 << 10
+
+RV32I = (
+    (0b0000011, None, CLASS_LOAD, 0),   # lb, lh, lw, lbu, lhu
+    (0b0100011, 0b000, CLASS_STORE, 1), # sb
+    (0b0100011, 0b001, CLASS_STORE, 2), # sh
+    (0b0100011, 0b010, CLASS_STORE, 4), # sw
+    (0b1100011, None, CLASS_BRANCH, 0), # beq, bne, blt, bge, bltu, bgeu
+    (0b1101111, None, CLASS_JUMP, 0),   # jal
+    (0b1100111, None, CLASS_JUMP, 0),   # jalr
+    (0b0110111, None, CLASS_REG, 0),    # lui
+    (0b0010111, None, CLASS_REG, 0),    # auipc
+    (0b0010011, None, CLASS_REG, 0),    # addi, slti, sltiu, xori, ori, andi, slli, srli, srai
+    (0b0110011, None, CLASS_REG, 0),    # add, sub, sll, slt, sltu, xor, srl, sra, or, and (and M)
+    (0b0001111, None, CLASS_FENCE, 0),  # fence
+)
+
+ZICSR = tuple((0b1110011, funct3, CLASS_CSR, 0) for funct3 in (0b001, 0b010, 0b011, 0b101, 0b110, 0b111)) # csrrw ... csrrci
+
+EXTENSIONS = {"zicsr": ZICSR}
+
+def index(instruction):
+    """Table index of one instruction."""
+    if instruction & 0b11 == 0b11:
+        return (instruction & 0x7F) << 3 | (instruction >> 12) & 0b111
+    return (instruction & 0b11) << 3 | (instruction >> 13) & 0b111
+
+class DecodeTable:
+    """
+    Class and store width of every instruction index.
+
+    Args:
+        extensions (iterable): Names of EXTENSIONS, or tables of rows, decoded on top of RV32I.
+    """
+    def __init__(self, extensions=()):
+        self.classes = np.zeros(TABLE_SIZE, dtype=np.uint8)
+        self.store_bytes = np.zeros(TABLE_SIZE, dtype=np.uint8)
+        self.add(RV32I)
+        for extension in extensions:
+            self.add(EXTENSIONS[extension] if isinstance(extension, str) else extension)
+
+    def add(self, rows):
+        """Add rows (opcode or quadrant, funct3 or None, class, store bytes) to the table."""
+        for opcode, funct3, instruction_class, store_bytes in rows:
+            for f3 in range(8) if funct3 is None else (funct3,):
+                self.classes[opcode << 3 | f3] = instruction_class
+                self.store_bytes[opcode << 3 | f3] = store_bytes
+
+    def classify(self, instruction):
+        """Class of one instruction."""
+        return int(self.classes[index(instruction)])
+
+    def decode(self, instructions):
+        """
+        Classify an array of instructions in one vectorized lookup.
+
+        Args:
+            instructions: Array-like of 32-bit instructions.
+        Returns:
+            tuple: (classes, store_bytes, rd) NumPy arrays, one element per instruction.
+        """
+        instructions = np.asarray(instructions, dtype=np.uint32)
+        indexes = np.where(instructions & 0b11 == 0b11,
+                           (instructions & 0x7F) << 3 | (instructions >> 12) & 0b111,
+                           (instructions & 0b11) << 3 | (instructions >> 13) & 0b111)
+        return self.classes[indexes], self.store_bytes[indexes], (instructions >> 7) & 0b11111
+
+RV32I_TABLE = DecodeTable()
@@ -0,0 +1,83 @@
+# This module contains the memory of the exec_trace.py memory models: a sparse,
+# byte-addressable 32-bit address space made of bytearray pages, allocated the first
+# time they are written. Pages never written read as the default contents.
+
+PAGE_BITS = 12 # 4 KiB pages
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+ADDRESS_MASK = 0xFFFFFFFF
+
+DEFAULT_FILL_WORD = 0x00000013 # nop
+
+class SparseMemory:
+    """
+    Sparse memory of the 32-bit address space. Addresses are not folded: 0x0 and
+    0x80000000 are different locations.
+
+    Args:
+        fill_word (int): 32-bit little-endian word repeated over the memory that was never
+            written. Defaults to nop.
+    """
+    def __init__(self, fill_word=DEFAULT_FILL_WORD):
+        self.fill_word = fill_word & ADDRESS_MASK
+        self.fill_page = bytes(self.fill_word.to_bytes(4, "little") * (PAGE_SIZE // 4))
+        self.pages = {}
+
+    def _page(self, address):
+        """The page of `address`, allocated on first touch."""
+        number = (address & ADDRESS_MASK) >> PAGE_BITS
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = bytearray(self.fill_page)
+        return page
+
+    def read_word(self, address):
+        """Read the aligned 32-bit word containing `address`."""
+        page = self.pages.get((address & ADDRESS_MASK) >> PAGE_BITS)
+        if page is None:
+            return self.fill_word
+        offset = address & PAGE_MASK & ~3
+        return int.from_bytes(page[offset:offset + 4], "little")
+
+    def write_word(self, address, value):
+        """Write the aligned 32-bit word containing `address`."""
+        offset = address & PAGE_MASK & ~3
+        self._page(address)[offset:offset + 4] = (value & ADDRESS_MASK).to_bytes(4, "little")
+
+    def write_masked(self, address, value, mask):
+        """
+        Write the bits of `value` selected by `mask` in the aligned word containing `address`.
+
+        Returns:
+            int: The new word.
+        """
+        page = self._page(address)
+        offset = address & PAGE_MASK & ~3
+        word = (int.from_bytes(page[offset:offset + 4], "little") & ~mask) | (value & mask)
+        page[offset:offset + 4] = word.to_bytes(4, "little")
+        return word
+
+    def read(self, address, size):
+        """Read `size` bytes from `address`."""
+        data = bytearray()
+        while size > 0:
+            offset = address & PAGE_MASK
+            chunk = min(size, PAGE_SIZE - offset)
+            page = self.pages.get((address & ADDRESS_MASK) >> PAGE_BITS)
+            data += (page if page is not None else self.fill_page)[offset:offset + chunk]
+            address += chunk
+            size -= chunk
+        return bytes(data)
+
+    def load(self, address, data):
+        """Copy `data` to the memory from `address`, one slice per page."""
+        data = memoryview(data)
+        while data:
+            offset = address & PAGE_MASK
+            chunk = min(len(data), PAGE_SIZE - offset)
+            self._page(address)[offset:offset + chunk] = data[:chunk]
+            address += chunk
+            data = data[chunk:]
+
+    def allocated_bytes(self):
+        return len(self.pages) * PAGE_SIZE
@@ -1,8 +1,48 @@
 import re
 import subprocess
 import os
+import sys
+import time
 import argparse
-import json
+import binascii
+import functools
+import shutil
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+import cache_utils
+import metrics
+import trace_format
+import trace_index
+
+# Spike is always executed with the same ISA and memory map
+SPIKE_ARGS = ["--isa=rv32i", "--log-commits", "-m0x0:0x01FFF000,0x80000000:0x81000000"]
+
+# debug_rom region where spike starts execution
+DEBUG_START = 0x08000000
+DEBUG_SIZE = 0x2000
+
+# riscv-arch-test cleanup section markers
+LI_RA_1 = 1048723          # li ra, 1
+AUIPC_T2 = (5015, 919)     # auipc t2,0x1 / auipc t2,0x0
+
+SPIKE_CHUNK_SIZE = 1 << 24 # bytes of spike output parsed per batch
+SPIKE_CACHE_VERSION = 1 # bump when the parser output changes, to invalidate the cached traces
+SPIKE_FIELDS = ("pc", "instr", "target_reg", "reg_val", "mem_addr", "mem_val")
+
+SPIKE_LINE_RE = re.compile(
+    r"core\s+\d+:\s+\d+\s+" # Match the prefix: "core 0: 3 " (core, core id, colon, cycle)
+    r"(?P<pc>0x[0-9a-fA-F]+)\s+" # Capture program counter (PC): first hex starting with 0x
+    r"\((?P<instr>0x[0-9a-fA-F]+)\)" # Capture instruction: hex value inside parentheses
+    r"(?:\s+(?P<target_reg>x\d+)\s+(?P<reg_val>0x[0-9a-fA-F]+))?" # Optionally capture target register and its value. Example: " x5 0x00001000"
+    r"(?:\s+mem\s+(?P<mem_addr>0x[0-9a-fA-F]+)(?:\s+(?P<mem_val>0x[0-9a-fA-F]+))?)?" # Optionally capture memory access. Example: " mem 0x00001018 0x00000005"
+)
+
+def spike_command(elf_file, spike_path="spike"):
+    # For some reason, --instructions=<n> makes spike stop after the last instruction in the elf, even if less than <n>.
+    # Do not use the -l option
+    return [spike_path] + SPIKE_ARGS + [elf_file]
 
 def generate_spike_trace(elf_file, output_dir, spike_path="spike"):
     """
@@ -19,14 +59,358 @@ def generate_spike_trace(elf_file, output_dir, spike_path="spike"):
         os.makedirs(output_dir)
 
     trace_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(elf_file))[0]}.trace")
-    # For some reason, --instructions=<n> makes spike stop after the last instruction in the elf, even if less than <n>.
-    # Do not use the -l option
     print(f"Generating Spike trace for {elf_file} at {trace_file}...")
-    command = f"{spike_path} --isa=rv32i --log-commits -m0x0:0x01FFF000,0x80000000:0x81000000 {elf_file} > {trace_file} 2>&1" # spike writes to stderr
-    subprocess.run(command, shell=True, check=True)
+    with open(trace_file, "w") as f:
+        subprocess.run(spike_command(elf_file, spike_path), stdout=f, stderr=subprocess.STDOUT, check=True) # spike writes to stderr
 
     return trace_file
 
+def iter_line_chunks(stream, chunk_size=SPIKE_CHUNK_SIZE):
+    """
+    Reads a binary stream and yields chunks of whole lines (each chunk ends with a newline).
+    """
+    pending = b""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        data = pending + data
+        cut = data.rfind(b"\n") + 1
+        pending = data[cut:]
+        if cut:
+            yield data[:cut]
+    if pending:
+        yield pending + b"\n"
+
+def iter_spike_output(elf_file, spike_path="spike", raw_trace_file=None, chunk_size=SPIKE_CHUNK_SIZE):
+    """
+    Executes spike and yields its commit log in chunks of whole lines, read from a pipe.
+    Nothing is written to disk unless raw_trace_file is given, in which case the output is
+    also copied to it. If the consumer stops early, spike is killed (or, when the raw trace
+    is kept, its remaining output is drained to the raw trace file).
+
+    Raises:
+        subprocess.CalledProcessError: spike exited with a non-zero code after a complete run.
+    """
+    process = subprocess.Popen(spike_command(elf_file, spike_path), stdout=subprocess.PIPE, stderr=subprocess.STDOUT) # spike writes to stderr
+    raw = open(raw_trace_file, "wb") if raw_trace_file else None
+    completed = False
+    try:
+        for chunk in iter_line_chunks(process.stdout, chunk_size):
+            if raw:
+                raw.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if not completed:
+            if raw:
+                for chunk in iter(lambda: process.stdout.read(chunk_size), b""):
+                    raw.write(chunk)
+            else:
+                process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+        if raw:
+            raw.close()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+def parse_spike_lines(lines):
+    """
+    Generator version of the parsing step of parse_spike_trace.
+    Skips warning lines and yields one dictionary per instruction in the commit log.
+    """
+    for line in lines:
+        if line.lstrip().lower().startswith("warning:"):
+            continue
+        m = SPIKE_LINE_RE.search(line)
+        if m:
+            yield {
+                "pc": int(m.group("pc"), 16),
+                "instr": int(m.group("instr"), 16),
+                "target_reg": int(m.group("target_reg")[1:]) if m.group("target_reg") else None,
+                "reg_val": int(m.group("reg_val"), 16) if m.group("reg_val") else None,
+                "mem_addr": int(m.group("mem_addr"), 16) if m.group("mem_addr") else None,
+                "mem_val": int(m.group("mem_val"), 16) if m.group("mem_val") else None,
+            }
+
+def filter_spike_entries(entries):
+    """
+    Removes the debug_rom part where spike starts execution and stops after the cleanup
+    section of riscv-arch-test (li ra, 1 followed by auipc t2, then the sw instruction).
+    Works on any iterable of entries, keeping a single entry of lookahead.
+    """
+    def outside_debug_rom(entry):
+        return not (entry["pc"] >= DEBUG_START and entry["pc"] < DEBUG_START + DEBUG_SIZE)
+
+    entries = filter(outside_debug_rom, entries)
+    previous = None
+    for entry in entries:
+        if previous is not None:
+            yield previous
+            if previous["instr"] == LI_RA_1 and entry["instr"] in AUIPC_T2:
+                yield entry
+                # mark the sw instruction
+                for sw_entry in entries:
+                    yield sw_entry
+                    break
+                return
+        previous = entry
+    if previous is not None:
+        yield previous
+
+######################## Fast batch parser ########################
+# Spike prints every commit with fixed-width fields:
+#   "core %3d: %1d 0x%08x (0x%08x)" then " x%-2d 0x%08x" per register write,
+#   " mem 0x%08x" per load and " mem 0x%08x 0x%0*x" per store (2, 4 or 8 digits).
+# parse_spike_chunk copies the first _LINE_WIDTH bytes of every line of a chunk into a
+# NumPy matrix, checks the fixed characters of each shape column by column and decodes
+# the hex fields of all the lines of a shape with a single binascii call. Lines with any
+# other shape go through the regex of parse_spike_lines, so the result is the same as
+# parse_spike_trace.
+
+_LINE_WIDTH = 80 # the longest shape (register write and word store) has 76 characters
+_HEX_OK = np.zeros(256, dtype=bool)
+_HEX_OK[list(b"0123456789abcdefABCDEF")] = True
+_STORE_DIGITS = (2, 4, 8)
+
+def _is(matrix, offset, literal):
+    """Check that every line has `literal` (up to 8 characters) at `offset`."""
+    if not len(matrix):
+        return np.zeros(0, dtype=bool)
+    words = np.ndarray((len(matrix),), dtype="<u8", buffer=matrix, offset=offset, strides=(matrix.strides[0],))
+    mask = np.uint64((1 << (8 * len(literal))) - 1)
+    return (words & mask) == np.uint64(int.from_bytes(literal, "little"))
+
+def _is_digit(matrix, offset):
+    return (matrix[:, offset] - ord("0")) < 10
+
+def _hex_values(fields):
+    """
+    Decode rows of up to 8 hex characters.
+
+    Args:
+        fields (np.ndarray): (rows, digits) array of characters.
+
+    Returns:
+        tuple: (values, ok), the uint32 values and whether each row only had hex digits.
+    """
+    rows, digits = fields.shape
+    if digits < 8:
+        fields = np.concatenate((np.full((rows, 8 - digits), ord("0"), dtype=np.uint8), fields), axis=1)
+    try:
+        ok = np.ones(rows, dtype=bool)
+        raw = binascii.a2b_hex(fields.tobytes())
+    except binascii.Error: # not a hex digit somewhere, decode the good rows only
+        ok = _HEX_OK[fields].all(axis=1)
+        raw = bytearray(4 * rows)
+        np.frombuffer(raw, dtype=np.uint8).reshape(rows, 4)[ok] = \
+            np.frombuffer(binascii.a2b_hex(fields[ok].tobytes()), dtype=np.uint8).reshape(-1, 4)
+    return np.frombuffer(raw, dtype=">u4").astype(np.uint32), ok
+
+def _empty_batch(rows=0):
+    columns = {name: np.zeros(rows, dtype=np.uint8 if name == "target_reg" else np.uint32) for name in SPIKE_FIELDS}
+    valid = {name: np.zeros(rows, dtype=bool) for name in ("target_reg", "reg_val", "mem_addr", "mem_val")}
+    return columns, valid
+
+def _check_width(entry, line):
+    """Raise a ValueError if a field of an entry parsed by the regex does not fit its column."""
+    for name in SPIKE_FIELDS:
+        limit = 0xff if name == "target_reg" else 0xffffffff
+        if entry[name] is not None and entry[name] > limit:
+            raise ValueError(f"Spike trace value wider than 32 bits ({name}) in line {line.strip()!r}: "
+                             "only RV32 commit logs are supported.")
+
+def parse_spike_chunk(chunk):
+    """
+    Parses a chunk of whole lines of spike's commit log.
+
+    Returns:
+        tuple: (columns, valid). `columns` maps each field of SPIKE_FIELDS to a NumPy array
+        (uint8 for target_reg, uint32 otherwise, 0 when absent) and `valid` maps the optional
+        fields to boolean arrays.
+
+    Raises:
+        ValueError: a line has a value wider than 32 bits (RV64 commit log), which the
+            columns and the trace format cannot hold.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord("\n"))
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    ends -= (ends > starts) & (buf[ends - 1] == ord("\r")) # CRLF
+    size = ends - starts
+    rows = len(starts)
+
+    # only the last lines can be closer than _LINE_WIDTH to the end of the chunk
+    matrix = np.empty((rows, _LINE_WIDTH), dtype=np.uint8)
+    inside = int(np.searchsorted(starts, len(buf) - _LINE_WIDTH, side="right")) if len(buf) >= _LINE_WIDTH else 0
+    if inside:
+        matrix[:inside] = np.lib.stride_tricks.sliding_window_view(buf, _LINE_WIDTH)[starts[:inside]]
+    if inside < rows:
+        tail_start = int(starts[inside])
+        tail = np.zeros(len(buf) - tail_start + _LINE_WIDTH, dtype=np.uint8)
+        tail[:len(buf) - tail_start] = buf[tail_start:]
+        matrix[inside:] = np.lib.stride_tricks.sliding_window_view(tail, _LINE_WIDTH)[starts[inside:] - tail_start]
+
+    columns, valid = _empty_batch(rows)
+    fast = np.zeros(rows, dtype=bool)
+
+    # "core   0: 3 0x%08x (0x%08x)"
+    common = np.flatnonzero(_is(matrix, 0, b"core   ") & _is_digit(matrix, 7) & _is(matrix, 8, b": ") &
+                            _is_digit(matrix, 10) & _is(matrix, 11, b" 0x") & _is(matrix, 22, b" (0x") &
+                            (matrix[:, 34] == ord(")")))
+    pc, pc_ok = _hex_values(np.take(matrix[:, 14:22], common, axis=0))
+    instr, instr_ok = _hex_values(np.take(matrix[:, 26:34], common, axis=0))
+    ok = pc_ok & instr_ok
+    common = common[ok]
+    columns["pc"][common] = pc[ok]
+    columns["instr"][common] = instr[ok]
+    is_common = np.zeros(rows, dtype=bool)
+    is_common[common] = True
+
+    # " x%-2d 0x%08x" at 35
+    one_digit = matrix[:, 38] == ord(" ")
+    reg = np.flatnonzero(is_common & _is(matrix, 35, b" x") & _is_digit(matrix, 37) &
+                         (one_digit | _is_digit(matrix, 38)) & _is(matrix, 39, b" 0x"))
+    reg_val, ok = _hex_values(np.take(matrix[:, 42:50], reg, axis=0))
+    reg = reg[ok]
+    tens = matrix[reg, 37] - ord("0")
+    columns["target_reg"][reg] = np.where(one_digit[reg], tens, tens * 10 + matrix[reg, 38] - ord("0"))
+    columns["reg_val"][reg] = reg_val[ok]
+    valid["target_reg"][reg] = True
+    is_reg = np.zeros(rows, dtype=bool)
+    is_reg[reg] = True
+    fast[common] = size[common] == 35
+    fast[reg] = size[reg] == 50
+
+    # " mem 0x%08x" at 35, or at 50 after a register write, then " 0x%0*x" for stores
+    for has_reg, offset in ((False, 35), (True, 50)):
+        mem = np.flatnonzero(is_common & (is_reg == has_reg) & _is(matrix, offset, b" mem 0x"))
+        mem_addr, ok = _hex_values(np.take(matrix[:, offset + 7:offset + 15], mem, axis=0))
+        mem = mem[ok]
+        columns["mem_addr"][mem] = mem_addr[ok]
+        valid["mem_addr"][mem] = True
+        fast[mem] = size[mem] == offset + 15
+        value_start = offset + 18
+        stores = mem[_is(matrix, offset + 15, b" 0x")[mem]]
+        for digits in _STORE_DIGITS:
+            store = stores[size[stores] == value_start + digits]
+            mem_val, ok = _hex_values(np.take(matrix[:, value_start:value_start + digits], store, axis=0))
+            store = store[ok]
+            columns["mem_val"][store] = mem_val[ok]
+            valid["mem_val"][store] = True
+            fast[store] = True
+    valid["reg_val"] = valid["target_reg"].copy()
+    for name in valid:
+        valid[name] &= fast
+
+    # every other line goes through the regex
+    present = fast.copy()
+    extra = []
+    for line in np.flatnonzero(~fast).tolist():
+        text = chunk[starts[line]:ends[line]].decode("utf-8", errors="replace")
+        # text mode also splits lines on a lone carriage return
+        for entry in parse_spike_lines(text.split("\r")):
+            if present[line]:
+                extra.append((line, entry))
+                continue
+            present[line] = True
+            _check_width(entry, text)
+            for name in SPIKE_FIELDS:
+                columns[name][line] = entry[name] or 0
+                if name in valid:
+                    valid[name][line] = entry[name] is not None
+
+    if not present.all():
+        columns = {name: col[present] for name, col in columns.items()}
+        valid = {name: col[present] for name, col in valid.items()}
+    if extra: # several entries on one line (lone carriage returns), rare
+        order = np.flatnonzero(present)
+        for position, (line, entry) in enumerate(extra):
+            _check_width(entry, chunk[starts[line]:ends[line]].decode("utf-8", errors="replace"))
+            at = int(np.searchsorted(order, line, side="right")) + position
+            for name in SPIKE_FIELDS:
+                columns[name] = np.insert(columns[name], at, entry[name] or 0)
+                if name in valid:
+                    valid[name] = np.insert(valid[name], at, entry[name] is not None)
+    return columns, valid
+
+def filter_spike_batches(batches):
+    """
+    Column version of filter_spike_entries: removes the debug_rom rows and stops after the
+    cleanup section of riscv-arch-test, across batch boundaries.
+    """
+    previous_instr = None
+    remaining = None # rows still to be emitted after the cleanup section was found
+    for columns, valid in batches:
+        keep = (columns["pc"] < DEBUG_START) | (columns["pc"] >= DEBUG_START + DEBUG_SIZE)
+        if not keep.all():
+            columns = {name: col[keep] for name, col in columns.items()}
+            valid = {name: col[keep] for name, col in valid.items()}
+        instr = columns["instr"]
+        rows = len(instr)
+        if rows == 0:
+            continue
+
+        if remaining is None:
+            auipc = np.isin(instr, AUIPC_T2)
+            hits = np.flatnonzero((instr[:-1] == LI_RA_1) & auipc[1:])
+            if previous_instr == LI_RA_1 and auipc[0]:
+                remaining = 2 # li ra, 1 was the last row of the previous batch
+            elif len(hits):
+                remaining = int(hits[0]) + 3 # li ra, 1, auipc and the sw instruction
+            previous_instr = int(instr[-1])
+
+        if remaining is not None:
+            take = min(remaining, rows)
+            remaining -= take
+            yield ({name: col[:take] for name, col in columns.items()},
+                   {name: col[:take] for name, col in valid.items()})
+            if remaining == 0:
+                return
+            continue
+
+        yield columns, valid
+
+def batch_entries(columns, valid):
+    """Yield the dictionaries of parse_spike_trace from a batch of columns."""
+    fields = []
+    for name in SPIKE_FIELDS:
+        values = columns[name].tolist()
+        if name in valid:
+            values = [v if ok else None for v, ok in zip(values, valid[name].tolist())]
+        fields.append(values)
+    for row in zip(*fields):
+        yield dict(zip(SPIKE_FIELDS, row))
+
+def parse_spike_batches(chunks):
+    """Parse and filter chunks of spike's output, yielding batches of columns."""
+    return filter_spike_batches(parse_spike_chunk(chunk) for chunk in chunks)
+
+def fast_parse_spike_trace(trace_file):
+    """
+    Same result as parse_spike_trace, using the batch parser.
+    """
+    with metrics.Stage("parse_spike_trace", trace_file) as stage, open(trace_file, "rb") as f:
+        entries = [entry for batch in parse_spike_batches(_count_lines(iter_line_chunks(f), stage)) for entry in batch_entries(*batch)]
+        stage.count("entries", len(entries))
+        return entries
+
+def write_spike_batches(output_file, batches, trace_output_format="binary"):
+    """
+    Write batches of columns to a spike trace without going through dictionaries (binary)
+    or streaming them entry by entry (json).
+    """
+    if trace_output_format == "json":
+        entries = (entry for batch in batches for entry in batch_entries(*batch))
+        trace_format.save_trace(output_file, trace_format.KIND_SPIKE, entries, "json")
+        return
+    with trace_format.TraceWriter(output_file, trace_format.KIND_SPIKE) as writer:
+        for columns, valid in batches:
+            writer.write_columns("entries", columns, {name: mask.tobytes() for name, mask in valid.items()})
 
 def parse_spike_trace(trace_file):
     """
@@ -55,54 +439,190 @@ def parse_spike_trace(trace_file):
 
     Returns a list of dictionaries.
     """
-    results = []
-    line_re = re.compile(
-    r"core\s+\d+:\s+\d+\s+" # Match the prefix: "core 0: 3 " (core, core id, colon, cycle)
-    r"(?P<pc>0x[0-9a-fA-F]+)\s+" # Capture program counter (PC): first hex starting with 0x
-    r"\((?P<instr>0x[0-9a-fA-F]+)\)" # Capture instruction: hex value inside parentheses
-    r"(?:\s+(?P<target_reg>x\d+)\s+(?P<reg_val>0x[0-9a-fA-F]+))?" # Optionally capture target register and its value. Example: " x5 0x00001000"
-    r"(?:\s+mem\s+(?P<mem_addr>0x[0-9a-fA-F]+)(?:\s+(?P<mem_val>0x[0-9a-fA-F]+))?)?" # Optionally capture memory access. Example: " mem 0x00001018 0x00000005"
-    )
+    with metrics.Stage("parse_spike_trace", trace_file) as stage, open(trace_file, "r", encoding="utf-8", errors="replace") as f:
+        lines = f.readlines() # counted once, not line by line
+        stage.count("lines", len(lines))
+        entries = list(filter_spike_entries(parse_spike_lines(lines)))
+        stage.count("entries", len(entries))
+        return entries
 
-    with open(trace_file, "r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            if line.lstrip().lower().startswith("warning:"):
-                continue
-            m = line_re.search(line)
-            if m:
-                entry = {
-                    "pc": int(m.group("pc"), 16),
-                    "instr": int(m.group("instr"), 16),
-                    "target_reg": int(m.group("target_reg")[1:]) if m.group("target_reg") else None,
-                    "reg_val": int(m.group("reg_val"), 16) if m.group("reg_val") else None,
-                    "mem_addr": int(m.group("mem_addr"), 16) if m.group("mem_addr") else None,
-                    "mem_val": int(m.group("mem_val"), 16) if m.group("mem_val") else None,
-                }
-                results.append(entry)
-
-    # Remove the debug_rom part where spike starts execution
-    DEBUG_START = 0x08000000
-    DEBUG_SIZE = 0x2000
-    filtered_results = []
-    for entry in results:
-        if entry["pc"] >= DEBUG_START and entry["pc"] < DEBUG_START + DEBUG_SIZE:
-            continue
-        else:
-            filtered_results.append(entry)
-
-    # detect cleanup section of riscv-arch-test
-    index = 0
-    while index < len(filtered_results):
-        if (filtered_results[index]["instr"] == 1048723 and # li ra, 1
-        (filtered_results[index+1]["instr"] == 5015 or      # auipc	t2,0x1
-         filtered_results[index+1]["instr"] == 919)         # auipc	t2,0x0
-        ):
-            break
-        index += 1
-    index += 2 # mark the sw instruction
-    filtered_results = filtered_results[:index+1]
+def _count_lines(chunks, stage):
+    """Passes the chunks of spike's output through, adding their lines to the stage."""
+    for chunk in chunks:
+        stage.count("lines", chunk.count(b"\n"))
+        yield chunk
 
-    return filtered_results
+def _count_entries(batches, stage):
+    """Passes the batches of columns through, adding their entries to the stage."""
+    for columns, valid in batches:
+        stage.count("entries", len(columns["pc"]))
+        yield columns, valid
+
+def _write_spike_trace(elf_file, output_file, spike_path, trace_output_format, raw_trace_file):
+    """
+    Runs spike and writes the parsed trace, removing the file if anything fails. Spike
+    runs while its output is parsed, they are measured as a single "spike" stage.
+    """
+    with metrics.Stage("spike", elf_file) as stage:
+        spike_output = iter_spike_output(elf_file, spike_path, raw_trace_file)
+        try:
+            write_spike_batches(output_file, _count_entries(parse_spike_batches(_count_lines(spike_output, stage)), stage),
+                                trace_output_format)
+        except BaseException:
+            if os.path.exists(output_file): # do not leave a partial trace behind
+                os.remove(output_file)
+            raise
+        finally:
+            spike_output.close() # stops spike once the cleanup section was found
+
+@functools.lru_cache(maxsize=None)
+def _binary_digest(path, mtime, size):
+    return cache_utils.file_digest(path)
+
+def spike_cache_key(elf_file, spike_path="spike"):
+    """
+    Key of the spike trace of an ELF in the trace cache: the trace only depends on the ELF,
+    the spike binary, the spike arguments and the parser.
+    """
+    spike_binary = shutil.which(spike_path) or spike_path
+    try:
+        stat = os.stat(spike_binary)
+        spike_digest = _binary_digest(os.path.realpath(spike_binary), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        spike_digest = spike_path # spike fails to start anyway
+    return cache_utils.text_digest(SPIKE_CACHE_VERSION, trace_format.FORMAT_VERSION, cache_utils.file_digest(elf_file),
+                                   spike_digest, *SPIKE_ARGS)
+
+def stream_spike_trace(elf_file, output_dir, spike_path="spike", trace_output_format="binary", keep_raw=False, use_cache=True):
+    """
+    Executes spike and streams its commit log through the parser straight into the trace
+    writer, without the intermediate .trace text file. Memory stays bounded regardless of
+    the program length.
+
+    The parsed traces are kept in a content-addressed cache (see cache_utils and
+    spike_cache_key), so spike only runs for ELFs, spike binaries or arguments not seen
+    before. Binary traces also get their sidecar index (see trace_index).
+
+    Args:
+        elf_file (str): The ELF file to generate the trace from.
+        output_dir (str): Directory to save the trace file.
+        spike_path (str): Path to the Spike binary. Defaults to "spike".
+        trace_output_format (str): "binary" or "json".
+        keep_raw (bool): Also keep spike's raw output as <elf>.trace, for debugging. Spike
+            always runs.
+        use_cache (bool): Look up and store the trace in the cache.
+    Returns:
+        str: Path to the generated spike trace.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    elf_name = os.path.splitext(os.path.basename(elf_file))[0]
+    raw_trace_file = os.path.join(output_dir, f"{elf_name}.trace") if keep_raw else None
+    output_file = trace_format.trace_path(output_dir, elf_name, "spike", trace_output_format)
+
+    directory = cache_utils.cache_dir("spike") if use_cache else None
+    if directory is None:
+        print(f"Generating Spike trace for {elf_file} at {output_file}...")
+        _write_spike_trace(elf_file, output_file, spike_path, trace_output_format, raw_trace_file)
+        trace_index.build_index_if_binary(output_file)
+        return output_file
+
+    cached_file = os.path.join(directory, spike_cache_key(elf_file, spike_path) + trace_format.TRACE_EXTENSION)
+    if not keep_raw:
+        try:
+            cache_utils.touch(cached_file)
+            _install_cached_trace(cached_file, output_file, trace_output_format)
+            print(f"Spike trace for {elf_file} found in the cache, copied to {output_file}")
+            return output_file
+        except FileNotFoundError:
+            pass # not cached, or evicted meanwhile
+
+    print(f"Generating Spike trace for {elf_file} at {output_file}...")
+    temporary_file = f"{cached_file}.{os.getpid()}.tmp"
+    _write_spike_trace(elf_file, temporary_file, spike_path, "binary", raw_trace_file)
+    os.replace(temporary_file, cached_file)
+    _install_cached_trace(cached_file, output_file, trace_output_format)
+    cache_utils.evict(directory, cache_utils.max_cache_bytes())
+    return output_file
+
+def _install_cached_trace(cached_file, output_file, trace_output_format):
+    if trace_output_format == "json":
+        with metrics.trace_stage(output_file, "json_export") as stage:
+            stage.count("entries", trace_format.export_json(cached_file, output_file))
+    else:
+        with metrics.trace_stage(output_file, "cache_copy") as stage:
+            shutil.copyfile(cached_file, output_file)
+            stage.count("bytes", os.path.getsize(output_file))
+        trace_index.build_index(output_file)
+
+def spike_job(elf_file, output_dir, spike_path, trace_output_format, keep_raw, use_cache):
+    """
+    Runs stream_spike_trace for one ELF of a batch (batch_spike_traces, pipeline.py) in a
+    worker process. Errors are returned instead of raised, so a failing ELF does not stop
+    the others.
+
+    Returns:
+        tuple: (elf_file, output_file or None, error message or None, seconds)
+    """
+    start = time.time()
+    try:
+        output_file = stream_spike_trace(elf_file, output_dir, spike_path, trace_output_format, keep_raw, use_cache)
+        return elf_file, output_file, None, time.time() - start
+    except subprocess.CalledProcessError as e:
+        error = f"spike exited with code {e.returncode}"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return elf_file, None, error, time.time() - start
+
+def batch_spike_traces(elf_files, output_dir, spike_path="spike", trace_output_format="binary", keep_raw=False, jobs=1, use_cache=True):
+    """
+    Generates the spike traces of several ELF files, `jobs` at a time in worker processes.
+    At most `jobs` ELFs are in flight, each with the bounded memory of stream_spike_trace.
+    Prints one progress line per ELF.
+
+    Args:
+        elf_files (list): ELF files to run.
+        output_dir (str): Directory to save the trace files.
+        spike_path (str): Path to the Spike binary.
+        trace_output_format (str): "binary" or "json".
+        keep_raw (bool): Also keep spike's raw output as <elf>.trace.
+        jobs (int): Number of worker processes. 1 runs everything in this process.
+        use_cache (bool): Use the spike trace cache.
+    Returns:
+        dict: Maps each ELF file to None on success or to its error message.
+    """
+    results = {}
+    total = len(elf_files)
+
+    def report(result):
+        elf_file, output_file, error, seconds = result
+        results[elf_file] = error
+        status = f"OK {output_file}" if error is None else f"FAILED {error}"
+        print(f"[{len(results)}/{total}] {os.path.basename(elf_file)}: {status} ({seconds:.1f}s)", flush=True)
+
+    if jobs <= 1:
+        for elf_file in elf_files:
+            report(spike_job(elf_file, output_dir, spike_path, trace_output_format, keep_raw, use_cache))
+        return results
+
+    pending = iter(elf_files)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        running = set()
+        try:
+            while True:
+                for elf_file in pending: # keep at most `jobs` ELFs submitted
+                    running.add(executor.submit(spike_job, elf_file, output_dir, spike_path, trace_output_format, keep_raw, use_cache))
+                    if len(running) >= jobs:
+                        break
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report(future.result())
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate and parse Spike trace files into a json format.")
@@ -113,19 +633,24 @@ if __name__ == "__main__":
 
     parser.add_argument("--output_dir", "-o", required=True, type=str, help="Directory to save the Spike trace files.")
     parser.add_argument("--spike_path", "-s", type=str, default="spike", help="Path to the Spike binary (default: 'spike').")
+    parser.add_argument("--format", "-F", type=str, choices=["binary", "json"], default="binary", help="Output trace format (default: binary, JSON for export).")
+    parser.add_argument("--keep-raw", "-k", action="store_true", help="Also keep spike's raw output as <elf>.trace (for debugging).")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of ELF files processed in parallel with --elf_folder (default: 1).")
+    parser.add_argument("--no-cache", action="store_true", help="Always run spike, without reading or filling the trace cache.")
+    parser.add_argument("--metrics", type=str, help="Append the wall time, CPU time, peak RSS and counts of every stage to this JSON lines file (see metrics.py).")
+    parser.add_argument("--profile", action="store_true", help="Run every stage under cProfile and write <elf>.<stage>.prof next to the traces.")
     args = parser.parse_args()
+    metrics.enable(args.metrics, args.output_dir if args.profile else None)
 
     if args.elf_folder:
-        for test_file in os.listdir(args.elf_folder):
-            if test_file.endswith(".elf"):
-                elf_path = os.path.join(args.elf_folder, test_file)
-                trace_file = generate_spike_trace(elf_path, args.output_dir, args.spike_path)
-                trace_dictionary = parse_spike_trace(trace_file)
-                with open(os.path.join(args.output_dir, f"{os.path.splitext(os.path.basename(trace_file))[0]}.spike.json"), "w") as f:
-                    json.dump(trace_dictionary, f, indent=2)
+        elf_files = [os.path.join(args.elf_folder, test_file) for test_file in sorted(os.listdir(args.elf_folder))
+                     if test_file.endswith(".elf")]
+        results = batch_spike_traces(elf_files, args.output_dir, args.spike_path, args.format, args.keep_raw, args.jobs, not args.no_cache)
+        failed = [elf_file for elf_file, error in results.items() if error is not None]
+        print(f"{len(results) - len(failed)}/{len(results)} spike traces generated")
+        for elf_file in failed:
+            print(f"FAILED {elf_file}: {results[elf_file]}")
+        if failed:
+            sys.exit(1)
     else:
-        trace_file = generate_spike_trace(args.elf_file, args.output_dir, args.spike_path)
-        trace_dictionary = parse_spike_trace(trace_file)
-
-        with open(os.path.join(args.output_dir, f"{os.path.splitext(os.path.basename(trace_file))[0]}.spike.json"), "w") as f:
-            json.dump(trace_dictionary, f, indent=2)
\ No newline at end of file
+        stream_spike_trace(args.elf_file, args.output_dir, args.spike_path, args.format, args.keep_raw, not args.no_cache)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache_utils
+
+def test_unusable_cache_directory_disables_the_cache(monkeypatch, tmp_path):
+    root = tmp_path / "not a directory"
+    root.write_text("")
+    monkeypatch.delenv("NTV_NO_CACHE", raising=False)
+    monkeypatch.setenv("NTV_CACHE_DIR", str(root))
+    assert cache_utils.cache_dir("elf") is None
+
+@pytest.mark.skipif(os.name != "posix" or os.geteuid() == 0, reason="root can write to read-only directories")
+def test_read_only_cache_directory_disables_the_cache(monkeypatch, tmp_path):
+    (tmp_path / "elf").mkdir()
+    (tmp_path / "elf").chmod(0o500)
+    monkeypatch.delenv("NTV_NO_CACHE", raising=False)
+    monkeypatch.setenv("NTV_CACHE_DIR", str(tmp_path))
+    try:
+        assert cache_utils.cache_dir("elf") is None
+    finally:
+        (tmp_path / "elf").chmod(0o700)
+
+def test_evict_deletes_the_least_recently_used_entries(tmp_path):
+    for age, name in enumerate(("new", "used", "old")):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1000 - age, 1000 - age))
+    (tmp_path / "partial.123.tmp").write_bytes(b"x" * 1000) # being written by another process
+    cache_utils.touch(str(tmp_path / "used"))
+    assert cache_utils.evict(str(tmp_path), 150) == 2
+    assert sorted(os.listdir(tmp_path)) == ["partial.123.tmp", "used"]
+    assert cache_utils.evict(str(tmp_path), 150) == 0
@@ -0,0 +1,156 @@
+import copy
+import itertools
+import os
+import sys
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import compare_traces
+import trace_format
+
+def _spike_entry(pc, instr, target_reg, reg_val):
+    return {"pc": pc, "instr": instr, "target_reg": target_reg, "reg_val": reg_val, "mem_addr": None, "mem_val": None}
+
+SPIKE = [
+    _spike_entry(0x1000, 0x00500093, 1, 5),  # addi x1, x0, 5
+    _spike_entry(0x1004, 0x00a00113, 2, 10), # addi x2, x0, 10
+    _spike_entry(0x1008, 0x00f00193, 3, 15), # addi x3, x0, 15
+]
+
+def _dut_trace(reg_vals):
+    return {
+        "fetches": [[entry["pc"], entry["instr"]] for entry in SPIKE],
+        "regfile_commits": [[entry["target_reg"], value] for entry, value in zip(SPIKE, reg_vals)],
+        "memory_accesses": [],
+    }
+
+def _reference(dut_trace):
+    final_trace = compare_traces.generate_final_trace(SPIKE, dut_trace, "test")
+    return compare_traces.compare_traces(SPIKE, final_trace, "test")
+
+def test_stream_matches_reference():
+    for reg_vals in ((5, 10, 15), (5, 11, 15), (5, 10)):
+        dut_trace = _dut_trace(reg_vals)
+        expected = _reference(dut_trace)
+        assert compare_traces.compare_stream(iter(SPIKE), _dut_trace(reg_vals), "test") == expected
+
+def test_stream_reports_mismatch():
+    mismatches = compare_traces.compare_stream(iter(SPIKE), _dut_trace((5, 11, 15)), "test")
+    assert [(m["spike"]["pc"], m["dut"]["reg_val"]) for m in mismatches] == [(0x1004, 11)]
+
+def _final_entry(entry, speculative_fetch=False, **changes):
+    return dict(entry, speculative_fetch=speculative_fetch, speculative_commit=False, **changes)
+
+LOAD_SPIKE = SPIKE + [dict(_spike_entry(0x100c, 0x0000a203, 4, 7), mem_addr=0x80000000)] # lw x4, 0(x1)
+
+FINAL_TRACES = (
+    [_final_entry(entry) for entry in LOAD_SPIKE], # loads have no address in the DUT
+    [_final_entry(LOAD_SPIKE[0]), _final_entry(LOAD_SPIKE[1], reg_val=11), _final_entry(LOAD_SPIKE[1], True),
+     _final_entry(LOAD_SPIKE[2], mem_addr=4), _final_entry(LOAD_SPIKE[3], mem_addr=0x80000000)],
+    [_final_entry(LOAD_SPIKE[0]), _final_entry(LOAD_SPIKE[1], reg_val=None)], # ends early
+)
+
+def test_trace_files_match_reference(tmp_path):
+    spike = [dict(entry) for entry in LOAD_SPIKE]
+    for trace_output_format in ("binary", "json"):
+        spike_path = trace_format.trace_path(str(tmp_path), "test", "spike", trace_output_format)
+        trace_format.save_trace(spike_path, trace_format.KIND_SPIKE, spike, trace_output_format)
+        for final_trace in FINAL_TRACES:
+            final_path = trace_format.trace_path(str(tmp_path), "test", "final", trace_output_format)
+            trace_format.save_trace(final_path, trace_format.KIND_FINAL, final_trace, trace_output_format)
+            assert compare_traces.compare_trace_files(spike_path, final_path, "test") == \
+                compare_traces.compare_traces(spike, final_trace, "test")
+
+def test_compare_elf_takes_saved_final_traces(tmp_path):
+    spike_path = trace_format.trace_path(str(tmp_path), "test", "spike")
+    final_path = trace_format.trace_path(str(tmp_path), "test", "final")
+    trace_format.save_trace(spike_path, trace_format.KIND_SPIKE, LOAD_SPIKE)
+    trace_format.save_trace(final_path, trace_format.KIND_FINAL, FINAL_TRACES[1])
+    summary = compare_traces.compare_elf(spike_path, final_path, "test", max_mismatches=1)
+    assert (summary["status"], summary["mismatches"], summary["first_index"], summary["first_pc"]) == ("mismatch", 2, 1, 0x1004)
+
+# a repeated write, a byte store, a load, a taken branch with a speculative fetch after it
+# and two commits swapped by a superscalar DUT
+ALIGNMENT_SPIKE = [
+    _spike_entry(0x1000, 0x00500093, 1, 5), # addi x1, x0, 5
+    _spike_entry(0x1004, 0x00500093, 1, 5), # addi x1, x0, 5
+    dict(_spike_entry(0x1008, 0x001100a3, None, None), mem_addr=0x80000001, mem_val=5), # sb x1, 1(x2)
+    dict(_spike_entry(0x100c, 0x00012183, 3, 0x500), mem_addr=0x80000000), # lw x3, 0(x2)
+    _spike_entry(0x1010, 0x00000463, None, None), # beq x0, x0, 8
+    _spike_entry(0x1018, 0x00100213, 4, 1), # addi x4, x0, 1
+    _spike_entry(0x101c, 0x00200293, 5, 2), # addi x5, x0, 2
+]
+
+ALIGNMENT_DUT = {
+    "fetches": [[0x1000, 0x00500093], [0x1004, 0x00500093], [0x1008, 0x001100a3], [0x100c, 0x00012183],
+                [0x1010, 0x00000463], [0x1014, 0x00000013], [0x1018, 0x00100213], [0x101c, 0x00200293]],
+    "regfile_commits": [[1, 5], [3, 0x500], [5, 2], [4, 1]],
+    "memory_accesses": [[0x80000000, 0x500]],
+}
+
+def _aligned(pc, instr, target_reg=None, reg_val=None, mem_addr=None, mem_val=None, speculative_fetch=False, speculative_commit=False):
+    return {"pc": pc, "instr": instr, "target_reg": target_reg, "reg_val": reg_val, "mem_addr": mem_addr, "mem_val": mem_val,
+            "speculative_fetch": speculative_fetch, "speculative_commit": speculative_commit}
+
+# the final trace of the list-based generate_final_trace the TraceAligner replaced
+ALIGNMENT_FINAL = [
+    _aligned(0x1000, 0x00500093, 1, 5),
+    _aligned(0x1004, 0x00500093, 1, 5, speculative_commit=True),
+    _aligned(0x1008, 0x001100a3, mem_addr=0x80000001, mem_val=5),
+    _aligned(0x100c, 0x00012183, 3, 0x500),
+    _aligned(0x1010, 0x00000463),
+    _aligned(0x1014, 0x00000013, speculative_fetch=True),
+    _aligned(0x1018, 0x00100213, 4, 1),
+    _aligned(0x101c, 0x00200293, 5, 2),
+]
+
+def test_aligner_matches_baseline_alignment():
+    spike, dut_trace = copy.deepcopy(ALIGNMENT_SPIKE), copy.deepcopy(ALIGNMENT_DUT)
+    assert compare_traces.generate_final_trace(spike, dut_trace, "test") == ALIGNMENT_FINAL
+    assert (spike, dut_trace) == (ALIGNMENT_SPIKE, ALIGNMENT_DUT) # inputs not modified
+
+def test_aligner_fed_row_by_row():
+    aligner = compare_traces.TraceAligner(iter(copy.deepcopy(ALIGNMENT_SPIKE)), "test")
+    dut_trace = {fragment: iter(copy.deepcopy(rows)) for fragment, rows in ALIGNMENT_DUT.items()}
+    assert [entry for entry, _ in compare_traces.align_fragments(aligner, dut_trace, chunk=1)] == ALIGNMENT_FINAL
+
+def _lockstep(dut_trace, check_every):
+    """Runs a LockstepChecker as the testbench does, the fragments arriving interleaved."""
+    checker = compare_traces.LockstepChecker(iter(copy.deepcopy(ALIGNMENT_SPIKE)), "test")
+    sinks = {fragment: checker.tap(fragment, []) for fragment in compare_traces.FRAGMENTS}
+    rows = itertools.zip_longest(*([(fragment, row) for row in dut_trace[fragment]] for fragment in compare_traces.FRAGMENTS))
+    for cycle, (fragment, row) in enumerate(item for items in rows for item in items if item is not None):
+        sinks[fragment].append(row)
+        if cycle % check_every == 0 and checker.check() is not None:
+            return checker.result
+    return checker.finish()
+
+def test_lockstep_finds_the_first_mismatch_of_the_whole_traces():
+    bad_load = copy.deepcopy(ALIGNMENT_DUT)
+    bad_load["regfile_commits"][1] = [3, 0x501]
+    short = copy.deepcopy(ALIGNMENT_DUT)
+    short["fetches"] = short["fetches"][:5]
+    for dut_trace, first_index in ((ALIGNMENT_DUT, None), (bad_load, 3), (short, 5)):
+        expected = compare_traces.first_mismatches(copy.deepcopy(ALIGNMENT_SPIKE), copy.deepcopy(dut_trace), "test", 1, context=5)
+        assert [mismatch["index"] for mismatch in expected["mismatches"]] == ([first_index] if first_index is not None else [])
+        for check_every in (1, 3, 100):
+            result = _lockstep(dut_trace, check_every)
+            if first_index is None:
+                assert result is None
+            else:
+                assert (result["mismatches"], result["before"]) == (expected["mismatches"], expected["before"])
+
+def test_report_buffer_keeps_whole_lines_up_to_its_limit():
+    output = compare_traces.ReportBuffer(limit=10)
+    for line in ("abcd", "efgh", "ijkl", "mnop"):
+        print(line, file=output)
+    assert output.getvalue() == "abcd\nefgh\n... 2 more line(s) of the comparison left out of this report\n"
+
+def test_junit_report_is_truncated(tmp_path):
+    report = "".join(f"mismatch {i}\n" for i in range(10000))
+    result = {"elf": "t", "status": "mismatch", "mismatches": 10000, "first_pc": 0x1000, "seconds": 1.0, "report": report}
+    compare_traces.write_junit(str(tmp_path / "junit.xml"), [result], 1.0)
+    text = ElementTree.parse(str(tmp_path / "junit.xml")).find("testcase/failure").text
+    assert text.startswith("mismatch 0\n") and text.endswith("... (report truncated)\n")
+    assert len(text) <= compare_traces.JUNIT_REPORT_LIMIT + 100
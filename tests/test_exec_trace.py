@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import exec_trace
+import sparse_memory
+
+class _Value:
+    def __init__(self, integer):
+        self._integer = integer
+
+    @property
+    def integer(self):
+        if self._integer is None:
+            raise ValueError("unresolved")
+        return self._integer
+
+    def __str__(self):
+        return "x" if self._integer is None else str(self._integer)
+
+class _Handle:
+    def __init__(self, integer):
+        self.value = _Value(integer)
+
+class _Log:
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message, *args):
+        self.warnings.append(message % args)
+
+class _Dut:
+    def __init__(self):
+        self._log = _Log()
+
+def test_strobe_masks_select_byte_lanes():
+    assert exec_trace.STROBE_MASKS[0b0000] == 0
+    assert exec_trace.STROBE_MASKS[0b0001] == 0x000000FF
+    assert exec_trace.STROBE_MASKS[0b0110] == 0x00FFFF00
+    assert exec_trace.STROBE_MASKS[0b1100] == 0xFFFF0000
+    assert exec_trace.STROBE_MASKS[0b1111] == 0xFFFFFFFF
+
+def test_partial_stores_write_the_selected_lanes():
+    dut = _Dut()
+    memory = sparse_memory.SparseMemory(fill_word=0)
+    memory.write_word(0x80000000, 0x11223344)
+    assert exec_trace.store(dut, memory, 0x80000002, 0xAABBCCDD, _Handle(0b0100)) == 0x11BB3344 # sb
+    assert exec_trace.store(dut, memory, 0x80000000, 0x0000EEFF, _Handle(0b0011)) == 0x11BBEEFF # sh
+    assert exec_trace.store(dut, memory, 0x80000000, 0x12345678, _Handle(0b0000)) is None
+    assert memory.read_word(0x80000000) == 0x11BBEEFF
+
+def test_unresolved_strobe_is_ignored():
+    dut = _Dut()
+    memory = sparse_memory.SparseMemory(fill_word=0)
+    assert exec_trace.store(dut, memory, 0x80000000, 0xFFFFFFFF, _Handle(None)) is None
+    assert memory.read_word(0x80000000) == 0
+    assert dut._log.warnings
@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pipeline
+
+def _state(tmp_path):
+    return str(tmp_path / pipeline.STATE_FILE)
+
+def _output(tmp_path, text):
+    path = tmp_path / "test.spike.ntv"
+    path.write_text(text)
+    return str(path)
+
+def test_saved_result_is_reused(tmp_path):
+    output = _output(tmp_path, "trace")
+    state = pipeline.PipelineState(_state(tmp_path))
+    state.save("test/spike", "key", [output], {"error": None, "seconds": 1.0})
+    state.flush()
+    assert pipeline.PipelineState(_state(tmp_path)).lookup("test/spike", "key") == {"error": None, "seconds": 1.0}
+
+def test_invalidation(tmp_path):
+    output = _output(tmp_path, "trace")
+    state = pipeline.PipelineState(_state(tmp_path))
+    state.save("test/spike", "key", [output], {"error": None, "seconds": 1.0})
+    state.flush()
+    assert pipeline.PipelineState(_state(tmp_path)).lookup("test/spike", "other key") is None # inputs changed
+    assert pipeline.PipelineState(_state(tmp_path), force=True).lookup("test/spike", "key") is None
+    os.utime(output, ns=(0, 0)) # output rewritten since
+    assert pipeline.PipelineState(_state(tmp_path)).lookup("test/spike", "key") is None
+    os.remove(output)
+    assert pipeline.PipelineState(_state(tmp_path)).lookup("test/spike", "key") is None
+
+def test_other_state_version_is_ignored(tmp_path):
+    output = _output(tmp_path, "trace")
+    with open(_state(tmp_path), "w") as f:
+        json.dump({"version": pipeline.STATE_VERSION - 1, "nodes": {"test/spike": {"key": "key", "outputs": {output: pipeline.file_stamp(output)},
+                                                                                  "result": {}}}}, f)
+    assert pipeline.PipelineState(_state(tmp_path)).nodes == {}
+
+def test_saves_are_batched(tmp_path):
+    state = pipeline.PipelineState(_state(tmp_path))
+    for i in range(3):
+        state.save(f"test{i}/spike", "key", [], {"error": None, "seconds": 1.0})
+    assert not os.path.exists(_state(tmp_path)) # within STATE_SAVE_INTERVAL of the start
+    state.flush()
+    assert len(pipeline.PipelineState(_state(tmp_path)).nodes) == 3
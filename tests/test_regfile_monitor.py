@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import regfile_monitor
+
+class _Value(int):
+    @property
+    def integer(self):
+        return int(self)
+
+class _Register:
+    def __init__(self, value=0):
+        self.value = _Value(value)
+
+class _Log:
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message, *args):
+        self.warnings.append(message % args)
+
+def _edge_monitor(check_cycles):
+    reg_file = [_Register() for _ in range(4)]
+    monitor = regfile_monitor.EdgeMonitor(reg_file, range(4), check_cycles)
+    monitor.old_regfile = {i: reg_file[i].value for i in monitor.available_regs} # start() without its watchers
+    return reg_file, monitor
+
+def test_edge_monitor_detects_missed_intermediate_commits():
+    reg_file, monitor = _edge_monitor(check_cycles=2)
+    commits = []
+    reg_file[1].value = _Value(5) # notified
+    monitor.changed.add(1)
+    monitor.sample(commits)
+    reg_file[2].value = _Value(7) # not notified
+    monitor.sample(commits)
+    reg_file[2].value = _Value(0) # back to its final value
+    monitor.changed.add(2)
+    monitor.sample(commits)
+    assert commits == [(1, 5), (2, 7), (2, 0)]
+    log = _Log()
+    assert not monitor.verify(log)
+    assert "x2" in log.warnings[0]
+
+def test_edge_monitor_past_the_checked_cycles_reads_only_notified_registers():
+    reg_file, monitor = _edge_monitor(check_cycles=0)
+    commits = []
+    reg_file[2].value = _Value(7) # not notified
+    monitor.sample(commits)
+    assert commits == []
+    assert not monitor.verify(_Log()) # the final value differs
@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import results_db
+
+def test_nothing_recorded_without_database(monkeypatch):
+    monkeypatch.delenv("NTV_RESULTS_DB", raising=False)
+    assert results_db.record_run("exec_trace", "tests/000_addi.elf", "passed") is False
+
+def test_unknown_columns_are_dropped(monkeypatch, tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    monkeypatch.setenv("NTV_RESULTS_DB", path)
+    assert results_db.record_run("exec_trace", "tests/000_addi.elf", "passed", time=1.0, cycles=10, colour="blue")
+    assert results_db.record_run("compare_traces", "000_addi", "mismatch", time=2.0, mismatches=2, timings={"compare": 1.5})
+    connection = results_db.connect(path)
+    rows = results_db.query_runs(connection, elf="000_addi")
+    assert [(row["tool"], row["status"], row["cycles"], row["mismatches"]) for row in rows] == \
+        [("compare_traces", "mismatch", None, 2), ("exec_trace", "passed", 10, None)]
+    connection.close()
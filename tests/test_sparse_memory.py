@@ -0,0 +1,34 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sparse_memory
+
+def test_unwritten_memory_reads_the_fill_word():
+    memory = sparse_memory.SparseMemory(fill_word=0xDEADBEEF)
+    assert memory.read_word(0x80000000) == 0xDEADBEEF
+    assert memory.read(0x1002, 4) == bytes.fromhex("adde efbe")
+    assert memory.allocated_bytes() == 0 # reads do not allocate
+
+def test_words_are_aligned_and_addresses_not_folded():
+    memory = sparse_memory.SparseMemory()
+    memory.write_word(0x80000003, 0x12345678)
+    assert memory.read_word(0x80000000) == 0x12345678
+    assert memory.read_word(0x00000000) == sparse_memory.DEFAULT_FILL_WORD
+    assert memory.allocated_bytes() == sparse_memory.PAGE_SIZE
+
+def test_load_and_read_across_pages():
+    memory = sparse_memory.SparseMemory(fill_word=0)
+    data = bytes(range(256)) * 40 # 10 KiB over 4 pages
+    start = sparse_memory.PAGE_SIZE - 10
+    memory.load(start, data)
+    assert memory.read(start, len(data)) == data
+    assert memory.read_word(start + 2) == int.from_bytes(data[2:6], "little")
+    assert len(memory.pages) == 4
+
+def test_masked_writes_keep_the_other_bytes():
+    memory = sparse_memory.SparseMemory(fill_word=0)
+    memory.write_word(0x100, 0x11223344)
+    assert memory.write_masked(0x101, 0xAABBCCDD, 0x0000FF00) == 0x1122CC44
+    assert memory.read_word(0x100) == 0x1122CC44
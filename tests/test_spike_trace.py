@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import spike_trace
+
+LOG = (b"warning: tohost and fromhost symbols not in ELF; can't communicate with target\n"
+       b"core   0: 3 0x80000000 (0x00000297) x5  0x80000000\n"
+       b"core   0: 3 0x80000004 (0x0182a283) x5  0x00000000 mem 0x80000018\n"
+       b"core   0: 3 0x80000008 (0x02b02e23) mem 0x8000003c 0x00000005\n"
+       b"core   0: 3   0x8000000c   (0x00000013)\n") # not the usual widths, parsed by the regex
+
+def test_batch_parser_matches_regex(tmp_path):
+    path = tmp_path / "test.trace"
+    path.write_bytes(LOG)
+    assert spike_trace.fast_parse_spike_trace(str(path)) == spike_trace.parse_spike_trace(str(path))
+
+@pytest.mark.parametrize("line", [b"core   0: 3 0xffffffff80000000 (0x00000013)\n",
+                                  b"core   0: 3 0x80000000 (0x00000297) x5  0x180000000\n",
+                                  b"core   0: 3 0x80000000 (0x00000013)\rcore   0: 3 0x180000000 (0x00000013)\n"])
+def test_values_wider_than_32_bits(line):
+    with pytest.raises(ValueError, match="wider than 32 bits"):
+        spike_trace.parse_spike_chunk(LOG + line)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import trace_format
+
+ENTRY = {"pc": 0x1000, "instr": 0x00500093, "target_reg": 1, "reg_val": 5, "mem_addr": None, "mem_val": None}
+
+def _open_files():
+    return len(os.listdir("/proc/self/fd"))
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="counts the open file descriptors through /proc")
+def test_corrupt_block_header_closes_the_file(tmp_path):
+    path = str(tmp_path / "test.spike.ntv")
+    trace_format.save_trace(path, trace_format.KIND_SPIKE, [ENTRY], "binary")
+    with trace_format.TraceReader(path) as reader:
+        block_header = reader._blocks["entries"][0][1]["pc"] - trace_format._BLOCK_HEADER.size
+    with open(path, "r+b") as f:
+        f.seek(block_header)
+        f.write(bytes([200])) # table id
+    before = _open_files()
+    with pytest.raises(ValueError, match="corrupt block header"):
+        try:
+            trace_format.TraceReader(path)
+        finally:
+            assert _open_files() == before # while the traceback still keeps the reader alive
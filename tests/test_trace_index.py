@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import trace_format
+import trace_index
+
+FRAGMENTED = {
+    "comment": "Trace for test.elf on tinyriscv",
+    "fetches": [[0x1000, 0x00500093], [0x1004, 0x00102023], [0x1000, 0x00500093]],
+    "regfile_commits": [[1, 5], [1, 5]],
+    "memory_accesses": [[0x80001000, 1]],
+}
+
+SPIKE = [
+    {"pc": 0x1000, "instr": 0x00500093, "target_reg": 1, "reg_val": 5, "mem_addr": None, "mem_val": None},
+    {"pc": 0x1004, "instr": 0x00102023, "target_reg": None, "reg_val": None, "mem_addr": 0x80001002, "mem_val": 1},
+    {"pc": 0x1008, "instr": 0x0000a103, "target_reg": 2, "reg_val": 0, "mem_addr": 0x80001002, "mem_val": None},
+]
+
+def _traces(tmp_path, kind, data, stage):
+    paths = []
+    for trace_output_format in ("binary", "json"):
+        path = trace_format.trace_path(str(tmp_path), "test", stage, trace_output_format)
+        trace_format.save_trace(path, kind, data, trace_output_format)
+        paths.append(path)
+    return paths
+
+def _rows(results):
+    return [(table, row, dict(record)) for table, row, record in results]
+
+def test_fragmented_json_and_binary_queries_match(tmp_path):
+    binary, json_trace = _traces(tmp_path, trace_format.KIND_FRAGMENTED, FRAGMENTED, "fragmented")
+    for key, value, expected in (("pc", 0x1000, [("fetches", 0), ("fetches", 2)]),
+                                 ("reg", 1, [("regfile_commits", 0), ("regfile_commits", 1)]),
+                                 ("mem", 0x80001002, [("memory_accesses", 0)]), # word address
+                                 ("pc", 0x2000, [])):
+        json_results = trace_index.query_trace(json_trace, key, value)
+        assert [(table, row) for table, row, _ in json_results] == expected
+        assert _rows(trace_index.query_trace(binary, key, value)) == _rows(json_results)
+
+def test_spike_json_and_binary_queries_match(tmp_path):
+    binary, json_trace = _traces(tmp_path, trace_format.KIND_SPIKE, SPIKE, "spike")
+    for key, value, expected in (("pc", 0x1004, [1]), ("reg", 2, [2]), ("mem", 0x80001002, [1])): # loads are not stores
+        json_results = trace_index.query_trace(json_trace, key, value)
+        assert [row for _, row, _ in json_results] == expected
+        assert _rows(trace_index.query_trace(binary, key, value)) == _rows(json_results)
+    assert os.path.exists(trace_index.index_path(binary))
+
+def test_limit(tmp_path):
+    _, json_trace = _traces(tmp_path, trace_format.KIND_FRAGMENTED, FRAGMENTED, "fragmented")
+    assert len(trace_index.query_trace(json_trace, "pc", 0x1000, limit=1)) == 1
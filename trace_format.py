@@ -0,0 +1,724 @@
+# This module contains the columnar binary trace format shared by spike_trace.py,
+# exec_trace.py and compare_traces.py, plus the JSON export helpers
+
+"""
+NTV binary trace format (version 1)
+
+All integers are little-endian. A file is a small header followed by blocks:
+
+    header:  magic "NTVTRACE" | version u16 | kind u16 | metadata length u32
+             metadata (UTF-8 JSON object, zero padded to a multiple of 8 bytes)
+    block:   table id u16 | reserved u16 | rows u32
+             one column after the other, in schema order
+
+Each table of a trace kind has a fixed schema (see SCHEMAS). Inside a block a column is
+stored as fixed-width integers (uint32 or uint8). Optional columns are preceded by a
+validity bitmap (LSB first, bit set = value present), and flag columns are stored only as
+a bitmap. Every column is padded to a multiple of 4 bytes so that uint32 columns stay
+aligned, and a memory-mapped file can be viewed column by column without copies.
+
+Writers emit a block every `block_rows` rows, so memory stays bounded and a truncated
+file can still be read up to its last complete block.
+"""
+
+import argparse
+import array
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC = b"NTVTRACE"
+FORMAT_VERSION = 1
+TRACE_EXTENSION = ".ntv"
+DEFAULT_BLOCK_ROWS = 1 << 16
+
+KIND_SPIKE = 1
+KIND_FRAGMENTED = 2
+KIND_FINAL = 3
+KIND_NAMES = {KIND_SPIKE: "spike", KIND_FRAGMENTED: "fragmented", KIND_FINAL: "final"}
+
+# Column types
+U32 = "I"  # uint32
+U8 = "B"   # uint8
+BIT = "?"  # boolean flag, bitmap only
+
+_HEADER = struct.Struct("<8sHHI")
+_BLOCK_HEADER = struct.Struct("<HHI")
+
+# (name, type, optional)
+ENTRY_COLUMNS = (
+    ("pc", U32, False),
+    ("instr", U32, False),
+    ("target_reg", U8, True),
+    ("reg_val", U32, True),
+    ("mem_addr", U32, True),
+    ("mem_val", U32, True),
+)
+FINAL_COLUMNS = ENTRY_COLUMNS + (
+    ("speculative_fetch", BIT, False),
+    ("speculative_commit", BIT, False),
+)
+
+# kind -> ((table name, columns), ...). The table id is the position in the tuple.
+SCHEMAS = {
+    KIND_SPIKE: (
+        ("entries", ENTRY_COLUMNS),
+    ),
+    KIND_FRAGMENTED: (
+        ("fetches", (("pc", U32, False), ("instr", U32, False))),
+        ("regfile_commits", (("reg", U8, False), ("value", U32, False))),
+        ("memory_accesses", (("addr", U32, False), ("value", U32, False))),
+    ),
+    KIND_FINAL: (
+        ("entries", FINAL_COLUMNS),
+    ),
+}
+
+if array.array(U32).itemsize != 4:
+    raise ImportError("trace_format requires a platform where array('I') is 4 bytes wide.")
+
+
+def _pad4(size):
+    return (size + 3) & ~3
+
+
+def _bitmap_size(rows):
+    return _pad4((rows + 7) // 8)
+
+
+_BIT_CHARS = bytes.maketrans(b"\x00\x01", b"01")
+
+
+def _pack_bits(flags, rows):
+    """
+    Pack booleans into an LSB-first bitmap padded to 4 bytes.
+    `flags` is a sequence of booleans or a bytes object with one 0/1 byte per row.
+    """
+    if isinstance(flags, (bytes, bytearray)):
+        bits = flags.translate(_BIT_CHARS)[::-1]
+    else:
+        bits = "".join(["1" if flag else "0" for flag in reversed(flags)])
+    value = int(bits, 2) if bits else 0
+    return value.to_bytes(_bitmap_size(rows), byteorder="little")
+
+
+def _unpack_bits(bitmap, rows):
+    """Return a string of '0'/'1' characters, one per row, from an LSB-first bitmap."""
+    value = int.from_bytes(bitmap, byteorder="little")
+    return format(value, "b").zfill(rows)[::-1][:rows] if rows else ""
+
+
+def _column_size(col_type, optional, rows):
+    if col_type == BIT:
+        return _bitmap_size(rows)
+    size = _pad4(rows * array.array(col_type).itemsize)
+    if optional:
+        size += _bitmap_size(rows)
+    return size
+
+
+def _to_little_endian(values):
+    if sys.byteorder != "little" and values.itemsize > 1:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(col_type, data):
+    values = array.array(col_type)
+    values.frombytes(memoryview(data).cast("B"))
+    if sys.byteorder != "little" and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+def _as_array(col_type, values):
+    """Convert a list or a buffer of integers (array, NumPy array, ...) to array(col_type)."""
+    try:
+        view = memoryview(values)
+    except TypeError:
+        return array.array(col_type, values)
+    if view.itemsize == array.array(col_type).itemsize and view.c_contiguous:
+        out = array.array(col_type)
+        out.frombytes(view.cast("B"))
+        return out
+    return array.array(col_type, view.tolist())
+
+
+class TraceWriter:
+    """
+    Streaming writer for the binary trace format.
+    Rows are buffered per table and written as a block every `block_rows` rows.
+
+    Args:
+        path (str): Output file.
+        kind (int): One of KIND_SPIKE, KIND_FRAGMENTED or KIND_FINAL.
+        metadata (dict): Optional JSON-serializable metadata (comment, processor, ...).
+        block_rows (int): Rows per block.
+    """
+    def __init__(self, path, kind, metadata=None, block_rows=DEFAULT_BLOCK_ROWS):
+        if kind not in SCHEMAS:
+            raise ValueError(f"Unknown trace kind: {kind}")
+        self.path = path
+        self.kind = kind
+        self.block_rows = block_rows
+        self.rows_written = {}
+        self._tables = {}
+        self._pending = {}
+        for table_id, (name, columns) in enumerate(SCHEMAS[kind]):
+            self._tables[name] = (table_id, columns)
+            self._pending[name] = []
+            self.rows_written[name] = 0
+
+        meta = json.dumps(metadata or {}).encode("utf-8")
+        meta += b"\x00" * ((-(_HEADER.size + len(meta))) % 8)
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, kind, len(meta)))
+        self._file.write(meta)
+
+    def append(self, table, row):
+        """Append one row (a tuple in schema order, None for missing optional values)."""
+        pending = self._pending[table]
+        pending.append(row)
+        if len(pending) >= self.block_rows:
+            self._write_block(table)
+
+    def extend(self, table, rows):
+        for row in rows:
+            self.append(table, row)
+
+    def table(self, table):
+        """A TableSink appending to `table`, for producers that expect a list."""
+        return TableSink(self, table)
+
+    def count(self, table):
+        """Rows appended to `table` so far, written or buffered."""
+        return self.rows_written[table] + len(self._pending[table])
+
+    def write_columns(self, table, columns, validity=None):
+        """
+        Write a block straight from column data, for producers that already work on columns.
+        Buffered rows of the table are written first so the row order is preserved.
+
+        Args:
+            table (str): Table name.
+            columns (dict): Column name -> values (list, array.array or any buffer with the
+                column's item size, e.g. a NumPy array). Flag columns are omitted here.
+            validity (dict): Column name -> bytes with one 0/1 byte per row, for optional
+                and flag columns. Optional columns without an entry are all valid.
+        """
+        if self._pending[table]:
+            self._write_block(table)
+        validity = validity or {}
+        table_id, schema = self._tables[table]
+        count = None
+        out = []
+        for name, col_type, optional in schema:
+            if col_type == BIT:
+                flags = bytes(validity[name])
+                count = len(flags) if count is None else count
+                out.append(_pack_bits(flags, count))
+                continue
+            values = columns[name]
+            if not isinstance(values, array.array) or values.typecode != col_type:
+                values = _as_array(col_type, values)
+            if count is None:
+                count = len(values)
+            elif len(values) != count:
+                raise ValueError(f"Column {name} has {len(values)} rows, expected {count}.")
+            if optional:
+                flags = bytes(validity[name]) if name in validity else b"\x01" * count
+                out.append(_pack_bits(flags, count))
+            data = _to_little_endian(values)
+            out.append(data + b"\x00" * (_pad4(len(data)) - len(data)))
+
+        if not count:
+            return
+        self._file.write(_BLOCK_HEADER.pack(table_id, 0, count))
+        self._file.write(b"".join(out))
+        self.rows_written[table] += count
+
+    def flush(self):
+        """Write every buffered row and flush the file."""
+        for table in self._pending:
+            if self._pending[table]:
+                self._write_block(table)
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write_block(self, table):
+        rows = self._pending[table]
+        self._pending[table] = []
+        table_id, columns = self._tables[table]
+        count = len(rows)
+
+        out = [_BLOCK_HEADER.pack(table_id, 0, count)]
+        for position, values in enumerate(zip(*rows)):
+            _, col_type, optional = columns[position]
+            if col_type == BIT:
+                out.append(_pack_bits(values, count))
+                continue
+            if optional:
+                out.append(_pack_bits([v is not None for v in values], count))
+                values = [0 if v is None else v for v in values]
+            data = _to_little_endian(array.array(col_type, values))
+            out.append(data + b"\x00" * (_pad4(len(data)) - len(data)))
+
+        self._file.write(b"".join(out))
+        self.rows_written[table] += count
+
+
+class TableSink:
+    """
+    List-like append end of one table of a TraceWriter: code that appends rows to a list
+    can stream them to the file instead.
+    """
+    def __init__(self, writer, table):
+        self.writer = writer
+        self.table = table
+
+    def append(self, row):
+        self.writer.append(self.table, row)
+
+    def extend(self, rows):
+        self.writer.extend(self.table, rows)
+
+    def __len__(self):
+        return self.writer.count(self.table)
+
+
+class TraceReader:
+    """
+    Memory-mapped reader for the binary trace format.
+
+    Columns can be read as memoryviews per block (no copies), as whole arrays, or as rows.
+    A truncated last block (e.g. writer killed mid-run) is ignored and `truncated` is set.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < _HEADER.size:
+            self._file.close()
+            raise ValueError(f"{path} is not an NTV binary trace (file too short).")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.kind, meta_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an NTV binary trace (bad magic).")
+        if self.version > FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} uses trace format version {self.version}, newer than supported {FORMAT_VERSION}.")
+        if self.kind not in SCHEMAS:
+            self.close()
+            raise ValueError(f"{path} has an unknown trace kind {self.kind}.")
+
+        self._schema = SCHEMAS[self.kind]
+        self.tables = [name for name, _ in self._schema]
+        self._blocks = {name: [] for name in self.tables}
+        self._starts = {}
+        self.truncated = False
+        try:
+            meta = bytes(self._mm[_HEADER.size:_HEADER.size + meta_len]).rstrip(b"\x00")
+            self.metadata = json.loads(meta.decode("utf-8")) if meta else {}
+            self._scan_blocks(_HEADER.size + meta_len, size)
+        except BaseException: # corrupt metadata or block header, do not leak the map and file
+            self.close()
+            raise
+
+    def _scan_blocks(self, offset, size):
+        while offset < size:
+            if offset + _BLOCK_HEADER.size > size:
+                self.truncated = True
+                break
+            table_id, _, rows = _BLOCK_HEADER.unpack_from(self._mm, offset)
+            if table_id >= len(self._schema):
+                raise ValueError(f"{self.path}: corrupt block header at offset {offset}.")
+            name, columns = self._schema[table_id]
+            offset += _BLOCK_HEADER.size
+            layout = {}
+            for col_name, col_type, optional in columns:
+                layout[col_name] = offset
+                offset += _column_size(col_type, optional, rows)
+            if offset > size:
+                self.truncated = True
+                break
+            self._blocks[name].append((rows, layout))
+
+    def count(self, table):
+        return sum(rows for rows, _ in self._blocks[table])
+
+    def _columns(self, table):
+        for name, columns in self._schema:
+            if name == table:
+                return columns
+        raise KeyError(f"Trace kind {KIND_NAMES[self.kind]} has no table {table}.")
+
+    def blocks(self, table):
+        """
+        Yield (rows, columns) per block, where columns maps a column name to a tuple
+        (values, validity). `values` is a memoryview over the mapped file (None for flag
+        columns) and `validity` is the raw bitmap memoryview (None for required columns).
+        The views are only valid until the reader is closed.
+        """
+        columns = self._columns(table)
+        for rows, layout in self._blocks[table]:
+            block = {}
+            for col_name, col_type, optional in columns:
+                offset = layout[col_name]
+                validity = None
+                if col_type == BIT or optional:
+                    validity = memoryview(self._mm)[offset:offset + (rows + 7) // 8]
+                    offset += _bitmap_size(rows)
+                if col_type == BIT:
+                    block[col_name] = (None, validity)
+                    continue
+                width = array.array(col_type).itemsize
+                values = memoryview(self._mm)[offset:offset + rows * width]
+                if sys.byteorder == "little":
+                    values = values.cast(col_type)
+                block[col_name] = (values, validity)
+            yield rows, block
+
+    def column(self, table, name):
+        """Return a whole column as an array (missing values read as 0, flags as 0/1)."""
+        col_type = self._column_type(table, name)
+        if col_type == BIT:
+            return array.array(U8, [bit == "1" for bit in self.validity(table, name)])
+        out = array.array(col_type)
+        for rows, block in self.blocks(table):
+            values, _ = block[name]
+            out.extend(_from_little_endian(col_type, values))
+        return out
+
+    def validity(self, table, name):
+        """Return a '0'/'1' string with one character per row (all '1' for required columns)."""
+        parts = []
+        for rows, block in self.blocks(table):
+            values, bitmap = block[name]
+            parts.append("1" * rows if bitmap is None else _unpack_bits(bitmap, rows))
+        return "".join(parts)
+
+    def _column_type(self, table, name):
+        for col_name, col_type, _ in self._columns(table):
+            if col_name == name:
+                return col_type
+        raise KeyError(f"Table {table} has no column {name}.")
+
+    def rows(self, table):
+        """Yield rows as tuples in schema order, with None for missing values."""
+        columns = self._columns(table)
+        for rows, block in self.blocks(table):
+            per_column = []
+            for col_name, col_type, optional in columns:
+                values, bitmap = block[col_name]
+                if col_type == BIT:
+                    per_column.append([bit == "1" for bit in _unpack_bits(bitmap, rows)])
+                    continue
+                if sys.byteorder != "little":
+                    values = _from_little_endian(col_type, values)
+                values = values.tolist()
+                if optional:
+                    bits = _unpack_bits(bitmap, rows)
+                    values = [v if bit == "1" else None for v, bit in zip(values, bits)]
+                per_column.append(values)
+            yield from zip(*per_column)
+
+    def records(self, table="entries"):
+        """Yield rows as dictionaries keyed by column name."""
+        names = [c[0] for c in self._columns(table)]
+        for row in self.rows(table):
+            yield dict(zip(names, row))
+
+    def row(self, table, index):
+        """
+        Return row `index` of a table as a tuple in schema order (None for missing values),
+        reading only that row from the mapped file.
+        """
+        starts = self._starts.get(table)
+        if starts is None:
+            starts = [0]
+            for rows, _ in self._blocks[table]:
+                starts.append(starts[-1] + rows)
+            self._starts[table] = starts
+        if not 0 <= index < starts[-1]:
+            raise IndexError(f"Row {index} out of range for table {table} ({starts[-1]} rows).")
+        block_id = bisect.bisect_right(starts, index) - 1
+        rows, layout = self._blocks[table][block_id]
+        i = index - starts[block_id]
+
+        row = []
+        for col_name, col_type, optional in self._columns(table):
+            offset = layout[col_name]
+            present = True
+            if col_type == BIT or optional:
+                present = bool(self._mm[offset + i // 8] >> (i % 8) & 1)
+                offset += _bitmap_size(rows)
+            if col_type == BIT:
+                row.append(present)
+                continue
+            width = array.array(col_type).itemsize
+            value = int.from_bytes(self._mm[offset + i * width:offset + (i + 1) * width], "little")
+            row.append(value if present else None)
+        return tuple(row)
+
+    def record(self, table, index):
+        """Return row `index` of a table as a dictionary keyed by column name."""
+        names = [c[0] for c in self._columns(table)]
+        return dict(zip(names, self.row(table, index)))
+
+    def close(self):
+        if self._mm is not None:
+            try:
+                self._mm.close()
+                self._mm = None
+            except BufferError:
+                pass  # a memoryview is still alive, the map is released when it is collected
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def is_binary_trace(path):
+    """Check the magic bytes to tell a binary trace from a JSON one."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def trace_path(output_dir, elf_name, stage, trace_format="binary"):
+    """
+    Build the path of a trace file, e.g. output/000_addi.spike.ntv.
+    `stage` is "spike", "fragmented" or "final".
+    """
+    extension = TRACE_EXTENSION if trace_format == "binary" else ".json"
+    return os.path.join(output_dir, f"{elf_name}.{stage}{extension}")
+
+
+def find_trace(directory, elf_name, stage):
+    """Return the binary trace of a stage if present, else the JSON one, else None."""
+    for trace_format in ("binary", "json"):
+        path = trace_path(directory, elf_name, stage, trace_format)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def split_trace_name(filename):
+    """Split '000_addi.spike.ntv' into ('000_addi', 'spike'). Returns (None, None) otherwise."""
+    for extension in (TRACE_EXTENSION, ".json"):
+        if filename.endswith(extension):
+            parts = filename[:-len(extension)].rsplit(".", 1)
+            if len(parts) == 2:
+                return parts[0], parts[1]
+    return None, None
+
+
+def count_rows(data):
+    """Number of entries, or of fragments, of a trace returned by load_trace."""
+    if isinstance(data, list):
+        return len(data)
+    return sum(len(rows) for rows in data.values() if isinstance(rows, list))
+
+
+def load_trace(path):
+    """
+    Load a binary or JSON trace into the same Python objects json.load returns:
+    a list of entry dictionaries for spike and final traces, and a dictionary of
+    lists for fragmented traces.
+    """
+    if not is_binary_trace(path):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    with TraceReader(path) as reader:
+        if reader.kind == KIND_FRAGMENTED:
+            trace = {"comment": reader.metadata.get("comment", "")}
+            for table in reader.tables:
+                trace[table] = [list(row) for row in reader.rows(table)]
+            return trace
+        return list(reader.records("entries"))
+
+
+def iter_entries(path):
+    """
+    Yield the entries (dictionaries) of a spike or final trace. A binary trace is read one
+    block at a time, so memory stays bounded; a JSON trace is loaded first.
+    """
+    if not is_binary_trace(path):
+        yield from load_trace(path)
+        return
+    with TraceReader(path) as reader:
+        yield from reader.records("entries")
+
+
+def _iter_rows(path, table):
+    with TraceReader(path) as reader:
+        yield from reader.rows(table)
+
+
+def iter_fragments(path):
+    """
+    The fragment lists of a fragmented trace, like load_trace: for a binary trace each one
+    is an iterator reading its table one block at a time, so they can be consumed at
+    different paces with bounded memory.
+    """
+    if not is_binary_trace(path):
+        return load_trace(path)
+    with TraceReader(path) as reader:
+        trace = {"comment": reader.metadata.get("comment", "")}
+        tables = reader.tables
+    for table in tables:
+        trace[table] = _iter_rows(path, table)
+    return trace
+
+
+def write_trace(path, kind, data, metadata=None, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Write spike/final entries (iterable of dictionaries) or a fragmented trace
+    (dictionary with fetches, regfile_commits and memory_accesses) in binary format.
+    """
+    with TraceWriter(path, kind, metadata, block_rows) as writer:
+        if kind == KIND_FRAGMENTED:
+            for table in ("fetches", "regfile_commits", "memory_accesses"):
+                writer.extend(table, (tuple(row) for row in data[table]))
+        else:
+            names = [c[0] for c in SCHEMAS[kind][0][1]]
+            writer.extend("entries", (tuple(entry[n] for n in names) for entry in data))
+
+
+def _json_entry(entry, first):
+    """One entry of a JSON list written by _write_json_entries, separator included."""
+    return ("\n  " if first else ",\n  ") + json.dumps(entry, indent=2).replace("\n", "\n  ")
+
+
+def _write_json_entries(f, entries):
+    """Stream entries as a JSON list, byte-identical to json.dump(entries, f, indent=2)."""
+    first = True
+    f.write("[")
+    for entry in entries:
+        f.write(_json_entry(entry, first))
+        first = False
+    f.write("]" if first else "\n]")
+
+
+class EntryWriter:
+    """
+    Streaming writer of spike or final entries (dictionaries) in either format, for
+    producers that emit them one at a time instead of as an iterable (see save_trace).
+    The files are the same as save_trace writes.
+
+    Args:
+        path (str): Output file.
+        kind (int): KIND_SPIKE or KIND_FINAL.
+        trace_format (str): "binary" or "json".
+    """
+    def __init__(self, path, kind, trace_format="binary", metadata=None):
+        self.trace_format = trace_format
+        self.count = 0
+        if trace_format == "json":
+            self._file = open(path, "w")
+            self._file.write("[")
+        else:
+            self._writer = TraceWriter(path, kind, metadata)
+            self._names = [c[0] for c in SCHEMAS[kind][0][1]]
+
+    def append(self, entry):
+        if self.trace_format == "json":
+            self._file.write(_json_entry(entry, self.count == 0))
+        else:
+            self._writer.append("entries", tuple(entry[n] for n in self._names))
+        self.count += 1
+
+    def close(self):
+        if self.trace_format == "json":
+            if not self._file.closed:
+                self._file.write("]" if self.count == 0 else "\n]")
+                self._file.close()
+        else:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_json_trace(path, kind, data):
+    """
+    Write a trace in the JSON layout used before the binary format existed.
+    Spike and final entries may come from a generator, they are written one by one.
+    """
+    with open(path, "w") as f:
+        if kind == KIND_FRAGMENTED:
+            json_str = json.dumps(data, indent=1, separators=(',', ': '))
+            # Remove line breaks inside small lists like [0,\n 5244307]
+            json_str = re.sub(r'\[\s*([0-9]+),\s*([0-9]+)\s*\]', r'[\1,\2]', json_str)
+            f.write(json_str)
+        else:
+            _write_json_entries(f, data)
+
+
+def save_trace(path, kind, data, trace_format="binary"):
+    """
+    Save a trace in the requested format ("binary" or "json").
+    For spike and final traces `data` can be any iterable of entries, memory stays bounded.
+    """
+    if trace_format == "json":
+        write_json_trace(path, kind, data)
+    else:
+        metadata = {"comment": data.get("comment", "")} if kind == KIND_FRAGMENTED else None
+        write_trace(path, kind, data, metadata)
+
+
+def export_json(src, dst):
+    """
+    Convert a binary trace into its JSON representation.
+
+    Returns:
+        int: The number of entries, or of fragments, written.
+    """
+    with TraceReader(src) as reader:
+        kind = reader.kind
+    data = load_trace(src)
+    write_json_trace(dst, kind, data)
+    return count_rows(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect NTV binary traces or export them to JSON.")
+    parser.add_argument("trace", type=str, help="Path to a binary (.ntv) trace.")
+    parser.add_argument("--json", "-j", type=str, help="Export the trace to this JSON file.")
+    args = parser.parse_args()
+
+    if args.json:
+        export_json(args.trace, args.json)
+    else:
+        with TraceReader(args.trace) as reader:
+            print(f"{args.trace}: {KIND_NAMES[reader.kind]} trace, format version {reader.version}")
+            if reader.metadata:
+                print(f"metadata: {reader.metadata}")
+            for table in reader.tables:
+                print(f"{table}: {reader.count(table)} rows in {len(reader._blocks[table])} blocks")
+            if reader.truncated:
+                print("warning: last block is truncated")
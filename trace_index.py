@@ -0,0 +1,267 @@
+# This module contains the sidecar indexes of binary traces (pc, register and memory
+# address -> row numbers) and a command line tool to query traces through them.
+#
+# The index of <trace>.ntv is stored next to it as <trace>.ntv.idx (an uncompressed NumPy
+# .npz archive). It remembers the size and modification time of the trace, and is rebuilt
+# when they no longer match.
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+import metrics
+import trace_format
+
+INDEX_EXTENSION = ".idx"
+INDEX_VERSION = 1
+
+COLUMN_DTYPES = {trace_format.U32: "<u4", trace_format.U8: "u1"}
+
+# table -> key -> (column, column that must be present for the row to be indexed).
+# Memory addresses of spike and final entries only index stores (the entries with a
+# mem_val), fragmented traces only record stores anyway.
+INDEXED_COLUMNS = {
+    "entries": {"pc": ("pc", None), "reg": ("target_reg", None), "mem": ("mem_addr", "mem_val")},
+    "fetches": {"pc": ("pc", None)},
+    "regfile_commits": {"reg": ("reg", None)},
+    "memory_accesses": {"mem": ("addr", None)},
+}
+
+def _bitmap_array(bitmap, rows):
+    return np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8), bitorder="little")[:rows].astype(bool)
+
+def table_columns(path, table):
+    """
+    Columns of a table of a binary trace, read block by block from the memory-mapped file.
+
+    Returns:
+        dict: column -> (values, valid) NumPy arrays, missing values read as 0. Flag
+        columns are a single bool array.
+    """
+    parts = {}
+    with trace_format.TraceReader(path) as reader:
+        schema = reader._columns(table)
+        for rows, block in reader.blocks(table):
+            for name, col_type, optional in schema:
+                values, bitmap = block[name]
+                if col_type == trace_format.BIT:
+                    column = _bitmap_array(bitmap, rows)
+                else:
+                    valid = _bitmap_array(bitmap, rows) if optional else np.ones(rows, dtype=bool)
+                    column = (np.frombuffer(values, dtype=COLUMN_DTYPES[col_type]), valid)
+                parts.setdefault(name, []).append(column)
+            del values, bitmap, block # release the views of the mapped file
+        columns = {}
+        for name, col_type, optional in schema:
+            blocks = parts.get(name, [])
+            if col_type == trace_format.BIT:
+                columns[name] = np.concatenate(blocks) if blocks else np.zeros(0, dtype=bool)
+            else:
+                columns[name] = (np.concatenate([values for values, _ in blocks]) if blocks else np.zeros(0, dtype=np.int64),
+                                 np.concatenate([valid for _, valid in blocks]) if blocks else np.zeros(0, dtype=bool))
+    return columns
+
+def index_path(trace_path):
+    """Path of the sidecar index of a trace."""
+    return trace_path + INDEX_EXTENSION
+
+def _trace_stamp(trace_path):
+    stat = os.stat(trace_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def _key_map(keys, rows):
+    """
+    Sorted unique keys, and for each one its rows: ordinals[starts[i]:starts[i + 1]], in
+    trace order.
+    """
+    order = np.argsort(keys, kind="stable")
+    unique, starts = np.unique(keys[order], return_index=True)
+    return unique.astype(np.uint32), starts.astype(np.uint32), rows[order].astype(np.uint32)
+
+def build_index(trace_path):
+    """
+    Builds (or rebuilds) the sidecar index of a binary trace.
+
+    Returns:
+        str: Path to the index.
+    """
+    stamp = _trace_stamp(trace_path)
+    with trace_format.TraceReader(trace_path) as reader:
+        tables = reader.tables
+
+    with metrics.trace_stage(trace_path, "index") as stage:
+        arrays = {"version": np.array(INDEX_VERSION), "stamp": stamp}
+        for table in tables:
+            columns = table_columns(trace_path, table)
+            stage.count("rows", len(next(iter(columns.values()))[0]))
+            for key, (column, required) in INDEXED_COLUMNS[table].items():
+                values, valid = columns[column]
+                if required is not None:
+                    valid = valid & columns[required][1]
+                rows = np.flatnonzero(valid)
+                keys, starts, ordinals = _key_map(values[rows], rows)
+                arrays[f"{table}.{key}.keys"] = keys
+                arrays[f"{table}.{key}.starts"] = starts
+                arrays[f"{table}.{key}.ordinals"] = ordinals
+
+        path = index_path(trace_path)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temporary_path, path)
+    return path
+
+def build_index_if_binary(trace_path):
+    """Builds the index of a trace written by one of the tools, JSON traces have none."""
+    if trace_format.is_binary_trace(trace_path):
+        build_index(trace_path)
+
+class TraceIndex:
+    """
+    Index of a binary trace, loaded from its sidecar file (built first if it is missing or
+    older than the trace).
+
+    Args:
+        trace_path (str): The trace.
+    """
+    def __init__(self, trace_path):
+        self.trace_path = trace_path
+        path = index_path(trace_path)
+        self._archive = self._open(path, _trace_stamp(trace_path))
+        if self._archive is None:
+            build_index(trace_path)
+            self._archive = self._open(path, None)
+        self._arrays = {}
+
+    @staticmethod
+    def _open(path, stamp):
+        try:
+            archive = np.load(path)
+        except (OSError, ValueError):
+            return None # missing or unreadable, rebuilt
+        if int(archive["version"]) != INDEX_VERSION or (stamp is not None and not np.array_equal(archive["stamp"], stamp)):
+            archive.close()
+            return None
+        return archive
+
+    def _array(self, name):
+        # arrays are only read from the archive when a query needs them
+        if name not in self._arrays:
+            self._arrays[name] = self._archive[name] if name in self._archive.files else None
+        return self._arrays[name]
+
+    def lookup(self, table, key, value):
+        """
+        Rows of `table` where the `key` column ("pc", "reg" or "mem") equals `value`.
+
+        Returns:
+            numpy.ndarray: The row numbers, in trace order.
+        """
+        name = f"{table}.{key}"
+        keys = self._array(f"{name}.keys")
+        if keys is None:
+            return np.zeros(0, dtype=np.int64)
+        i = np.searchsorted(keys, value)
+        if i == len(keys) or keys[i] != value:
+            return np.zeros(0, dtype=np.int64)
+        starts = self._array(f"{name}.starts")
+        ordinals = self._array(f"{name}.ordinals")
+        end = starts[i + 1] if i + 1 < len(starts) else len(ordinals)
+        return ordinals[starts[i]:end]
+
+    def close(self):
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def query_trace(trace_path, key, value, limit=None):
+    """
+    Rows of a trace matching a pc, register or memory address. Binary traces are queried
+    through their index and only the matching rows are read; JSON traces are loaded and
+    scanned.
+
+    Args:
+        key (str): "pc", "reg" or "mem".
+        value (int): The pc, register number or address. Fragmented traces store word
+            addresses, the address is aligned down for them.
+        limit (int): Return at most this many rows per table (None for all).
+    Returns:
+        list: (table, row number, row dictionary) tuples, in trace order per table.
+    """
+    results = []
+    if not trace_format.is_binary_trace(trace_path):
+        data = trace_format.load_trace(trace_path)
+        tables = {"entries": data} if isinstance(data, list) else data # fragmented traces also have a "comment"
+        for table, keys in INDEXED_COLUMNS.items():
+            rows = tables.get(table, ())
+            if key not in keys:
+                continue
+            column, required = keys[key]
+            target = value & ~3 if table == "memory_accesses" else value
+            names = [name for name, _, _ in dict(trace_format.SCHEMAS[trace_format.KIND_FRAGMENTED]).get(table, ())]
+            matches = []
+            for i, row in enumerate(rows):
+                if isinstance(row, list): # fragmented JSON rows are [column, column] lists
+                    row = dict(zip(names, row))
+                if row.get(column) == target and (required is None or row.get(required) is not None):
+                    matches.append((table, i, row))
+            results.extend(matches[:limit])
+        return results
+
+    with TraceIndex(trace_path) as index, trace_format.TraceReader(trace_path) as reader:
+        for table in reader.tables:
+            if key not in INDEXED_COLUMNS[table]:
+                continue
+            target = value & ~3 if table == "memory_accesses" else value
+            for row in index.lookup(table, key, target)[:limit]:
+                results.append((table, int(row), reader.record(table, int(row))))
+    return results
+
+def format_row(row):
+    """Row with its addresses and values in hex, for printing."""
+    formatted = []
+    for name, value in row.items():
+        if value is None or isinstance(value, bool) or name in ("target_reg", "reg"):
+            formatted.append(f"{name}={value}")
+        else:
+            formatted.append(f"{name}=0x{value:08x}")
+    return " ".join(formatted)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query traces by pc, register or memory address through their sidecar indexes")
+    parser.add_argument("traces", nargs="+", help="Trace files (binary traces are indexed, JSON traces are scanned)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--pc", type=lambda x: int(x, 0), help="Entries (or fetches) at this pc")
+    group.add_argument("--reg", type=lambda x: int(x, 0), help="Entries (or register file commits) writing this register")
+    group.add_argument("--mem", type=lambda x: int(x, 0), help="Stores to this address")
+    parser.add_argument("--limit", type=int, help="Print at most N rows per trace and table")
+    parser.add_argument("--build", action="store_true", help="Only (re)build the indexes of the binary traces")
+    args = parser.parse_args()
+
+    if args.build or (args.pc is None and args.reg is None and args.mem is None):
+        for trace in args.traces:
+            if not trace_format.is_binary_trace(trace):
+                print(f"{trace}: not a binary trace, skipped")
+                continue
+            print(f"{trace}: index written to {build_index(trace)}")
+        sys.exit(0)
+
+    if args.pc is not None:
+        key, value = "pc", args.pc
+    elif args.reg is not None:
+        key, value = "reg", args.reg
+    else:
+        key, value = "mem", args.mem
+
+    for trace in args.traces:
+        results = query_trace(trace, key, value, args.limit)
+        print(f"{trace}: {len(results)} rows with {key} {value:#x}")
+        for table, row, record in results:
+            print(f"  {table}[{row}] {format_row(record)}")